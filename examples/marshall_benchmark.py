@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# Measures the throughput of the svn protocol (un)marshalling code for
+# messages shaped like those sent for log and update/replay commands.
+
+import os
+import time
+
+from subvertpy import marshall as marshall_mod
+from subvertpy.marshall import (
+    NeedMoreData,
+    Unmarshaller,
+    literal,
+    marshall,
+    )
+
+BLOCK_SIZE = 64 * 1024
+
+
+def log_messages(count=20000):
+    for revnum in xrange(count):
+        changes = [("/trunk/src/file%d.c" % i, literal("M"), ())
+                   for i in range(5)]
+        yield [changes, revnum, ["jelmer"], ["2013-05-06T12:00:00.000000Z"],
+               ["Fix a bug in revision %d.\n" % revnum], False, False, []]
+
+
+def textdelta_messages(count=200):
+    for i in xrange(count):
+        yield [literal("textdelta-chunk"), ["c%d" % i, os.urandom(100 * 1024)]]
+
+
+def measure(name, messages):
+    start = time.time()
+    data = "".join(marshall(msg) for msg in messages)
+    marshall_time = time.time() - start
+
+    start = time.time()
+    unmarshaller = Unmarshaller()
+    count = 0
+    for offset in xrange(0, len(data), BLOCK_SIZE):
+        unmarshaller.feed(data[offset:offset+BLOCK_SIZE])
+        while True:
+            try:
+                unmarshaller.read_item()
+            except NeedMoreData:
+                break
+            count += 1
+    unmarshall_time = time.time() - start
+
+    megabytes = len(data) / (1024.0 * 1024)
+    print "%s: %d messages, %.1f MB" % (name, count, megabytes)
+    print "  marshall:   %8.1f MB/s" % (megabytes / marshall_time)
+    print "  unmarshall: %8.1f MB/s" % (megabytes / unmarshall_time)
+
+
+if Unmarshaller.__module__ == marshall_mod.__name__:
+    print "Using pure-Python implementation"
+else:
+    print "Using C implementation"
+
+measure("log", list(log_messages()))
+measure("textdelta", list(textdelta_messages()))
@@ -376,7 +376,9 @@ def subvertpy_modules():
         SvnExtension("subvertpy.repos", [source_path(n) for n in ("repos.c", "util.c")],
             libraries=["svn_repos-1", "svn_subr-1", "svn_fs-1"]),
         SvnExtension("subvertpy.wc", [source_path(n) for n in ("wc.c",
-            "util.c", "editor.c")], libraries=["svn_wc-1", "svn_subr-1"])
+            "util.c", "editor.c")], libraries=["svn_wc-1", "svn_subr-1"]),
+        Extension("subvertpy._delta", [source_path("_delta.c")]),
+        Extension("subvertpy._marshall", [source_path("_marshall.c")]),
         ]
 
 
@@ -77,6 +77,7 @@ ERR_BAD_PROPERTY_VALUE = 125005
 ERR_FS_ROOT_DIR = 160021
 ERR_WC_NODE_KIND_CHANGE = 155018
 ERR_WC_UPGRADE_REQUIRED = 155036
+ERR_CHECKSUM_MISMATCH = 200014
 
 ERR_APR_OS_START_EAIERR = 670000
 ERR_APR_OS_ERRSPACE_SIZE = 50000
@@ -0,0 +1,402 @@
+/*
+ * Copyright © 2008 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+/* C implementations of performance critical functions in subvertpy.delta.
+ * This module does not depend on Subversion or APR. */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+
+/* Keep in sync with subvertpy/delta.py */
+#define TXDELTA_SOURCE 0
+#define TXDELTA_TARGET 1
+#define TXDELTA_NEW 2
+#define MATCH_BLOCK_SIZE 64
+
+static bool parse_op(PyObject *op, long *action, Py_ssize_t *offset,
+					 Py_ssize_t *length)
+{
+	PyObject *tuple;
+
+	tuple = PySequence_Tuple(op);
+	if (tuple == NULL)
+		return false;
+	if (!PyArg_ParseTuple(tuple, "lnn", action, offset, length)) {
+		Py_DECREF(tuple);
+		return false;
+	}
+	Py_DECREF(tuple);
+	if (*offset < 0 || *length < 0) {
+		PyErr_SetString(PyExc_Exception, "Invalid delta instruction");
+		return false;
+	}
+	return true;
+}
+
+static PyObject *txdelta_apply_ops(PyObject *self, PyObject *args)
+{
+	PyObject *src_ops, *py_ops, *ops, *ret;
+	const char *new_data, *sview;
+	Py_ssize_t new_data_len, sview_len, tview_len = 0, pos = 0, i, nops;
+	char *tview;
+
+	if (!PyArg_ParseTuple(args, "OOs#s#", &src_ops, &py_ops, &new_data,
+						  &new_data_len, &sview, &sview_len))
+		return NULL;
+
+	ops = PySequence_Fast(py_ops, "ops should be a sequence");
+	if (ops == NULL)
+		return NULL;
+	nops = PySequence_Fast_GET_SIZE(ops);
+
+	/* Determine the size of the target view first, so it can be
+	 * allocated in one go. */
+	for (i = 0; i < nops; i++) {
+		long action;
+		Py_ssize_t offset, length;
+		if (!parse_op(PySequence_Fast_GET_ITEM(ops, i), &action, &offset,
+					  &length)) {
+			Py_DECREF(ops);
+			return NULL;
+		}
+		if (length > PY_SSIZE_T_MAX - tview_len) {
+			PyErr_SetString(PyExc_Exception, "Target view too large");
+			Py_DECREF(ops);
+			return NULL;
+		}
+		tview_len += length;
+	}
+
+	ret = PyString_FromStringAndSize(NULL, tview_len);
+	if (ret == NULL) {
+		Py_DECREF(ops);
+		return NULL;
+	}
+	tview = PyString_AS_STRING(ret);
+
+	for (i = 0; i < nops; i++) {
+		long action;
+		Py_ssize_t offset, length;
+		if (!parse_op(PySequence_Fast_GET_ITEM(ops, i), &action, &offset,
+					  &length))
+			goto fail;
+		/* Converting an operation can run arbitrary code, so don't rely
+		 * on it having the same length as in the first pass. */
+		if (length > tview_len - pos) {
+			PyErr_SetString(PyExc_Exception, "Invalid target view length");
+			goto fail;
+		}
+		switch (action) {
+			case TXDELTA_SOURCE:
+				/* offset and length come from the svndiff data, so
+				 * avoid computing offset + length, which may
+				 * overflow. */
+				if (offset > sview_len || length > sview_len - offset) {
+					PyErr_SetString(PyExc_Exception,
+									"Invalid source view range");
+					goto fail;
+				}
+				memcpy(tview + pos, sview + offset, length);
+				break;
+			case TXDELTA_TARGET:
+				if (offset >= pos) {
+					PyErr_SetString(PyExc_Exception,
+									"Invalid target view offset");
+					goto fail;
+				}
+				if (length <= pos - offset) {
+					memcpy(tview + pos, tview + offset, length);
+				} else {
+					/* Overlapping copy; the data between offset and
+					 * pos repeats. */
+					Py_ssize_t j;
+					for (j = 0; j < length; j++)
+						tview[pos + j] = tview[offset + j];
+				}
+				break;
+			case TXDELTA_NEW:
+				if (offset > new_data_len ||
+					length > new_data_len - offset) {
+					PyErr_SetString(PyExc_Exception, "Invalid new data range");
+					goto fail;
+				}
+				memcpy(tview + pos, new_data + offset, length);
+				break;
+			default:
+				PyErr_SetString(PyExc_Exception,
+								"Invalid delta instruction code");
+				goto fail;
+		}
+		pos += length;
+	}
+
+	Py_DECREF(ops);
+	return ret;
+
+fail:
+	Py_DECREF(ops);
+	Py_DECREF(ret);
+	return NULL;
+}
+
+/* Blocks indexed by their checksum. Like dict.setdefault() in the Python
+ * implementation, only the first block with a particular checksum is
+ * kept. */
+struct block_table {
+	unsigned long *checksums;
+	Py_ssize_t *offsets; /* -1 for unused slots */
+	size_t mask;
+};
+
+static bool block_table_init(struct block_table *table, Py_ssize_t nblocks)
+{
+	size_t size = 16, i;
+
+	while (size < (size_t)nblocks * 2)
+		size *= 2;
+	table->mask = size - 1;
+	table->checksums = PyMem_New(unsigned long, size);
+	table->offsets = PyMem_New(Py_ssize_t, size);
+	if (table->checksums == NULL || table->offsets == NULL) {
+		PyMem_Free(table->checksums);
+		PyMem_Free(table->offsets);
+		PyErr_NoMemory();
+		return false;
+	}
+	for (i = 0; i < size; i++)
+		table->offsets[i] = -1;
+	return true;
+}
+
+static void block_table_free(struct block_table *table)
+{
+	PyMem_Free(table->checksums);
+	PyMem_Free(table->offsets);
+}
+
+static size_t block_table_slot(struct block_table *table, unsigned long checksum)
+{
+	size_t i = ((checksum ^ (checksum >> 15)) * 2654435761UL) & table->mask;
+	while (table->offsets[i] != -1 && table->checksums[i] != checksum)
+		i = (i + 1) & table->mask;
+	return i;
+}
+
+static void block_table_add(struct block_table *table, unsigned long checksum, Py_ssize_t offset)
+{
+	size_t i = block_table_slot(table, checksum);
+	if (table->offsets[i] == -1) {
+		table->checksums[i] = checksum;
+		table->offsets[i] = offset;
+	}
+}
+
+static Py_ssize_t block_table_get(struct block_table *table, unsigned long checksum)
+{
+	return table->offsets[block_table_slot(table, checksum)];
+}
+
+static void block_sums(const unsigned char *data, Py_ssize_t size,
+					   unsigned long *a, unsigned long *b)
+{
+	Py_ssize_t i;
+	*a = *b = 0;
+	for (i = 0; i < size; i++) {
+		*a += data[i];
+		*b += *a;
+	}
+	*a &= 0xffff;
+	*b &= 0xffff;
+}
+
+static unsigned long block_hash(const unsigned char *data, Py_ssize_t size)
+{
+	unsigned long a, b;
+	block_sums(data, size, &a, &b);
+	return (b << 16) | a;
+}
+
+static bool append_op(PyObject *ops, int action, Py_ssize_t offset,
+					  Py_ssize_t length)
+{
+	PyObject *op;
+	int ret;
+
+	op = Py_BuildValue("(inn)", action, offset, length);
+	if (op == NULL)
+		return false;
+	ret = PyList_Append(ops, op);
+	Py_DECREF(op);
+	return (ret == 0);
+}
+
+/* Keep in sync with compute_txdelta_window in subvertpy/delta.py; both
+ * should produce the same windows. */
+static PyObject *compute_txdelta_window(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+	char *kwnames[] = { "sview", "tview", "sview_offset", "match_size", NULL };
+	const unsigned char *sview, *tview, *view;
+	Py_ssize_t sview_len, tview_len, view_len, match_size = MATCH_BLOCK_SIZE;
+	PyObject *sview_offset = NULL;
+	Py_ssize_t pos = 0, pending = 0, indexed = 0, new_len = 0, src_ops = 0;
+	Py_ssize_t start, length;
+	unsigned long a = 0, b = 0;
+	struct block_table source_blocks, target_blocks;
+	PyObject *ops = NULL, *ret = NULL;
+	char *new_data = NULL;
+	int action;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s#s#|On:compute_txdelta_window",
+									 kwnames, &sview, &sview_len, &tview,
+									 &tview_len, &sview_offset, &match_size))
+		return NULL;
+
+	if (match_size <= 0) {
+		PyErr_SetString(PyExc_ValueError, "match_size should be positive");
+		return NULL;
+	}
+
+	if (!block_table_init(&source_blocks, sview_len / match_size))
+		return NULL;
+	if (!block_table_init(&target_blocks, tview_len / match_size)) {
+		block_table_free(&source_blocks);
+		return NULL;
+	}
+	for (start = 0; start + match_size <= sview_len; start += match_size)
+		block_table_add(&source_blocks, block_hash(sview + start, match_size),
+						start);
+
+	ops = PyList_New(0);
+	if (ops == NULL)
+		goto done;
+	new_data = PyMem_Malloc(tview_len + 1);
+	if (new_data == NULL) {
+		PyErr_NoMemory();
+		goto done;
+	}
+
+	if (tview_len >= match_size)
+		block_sums(tview, match_size, &a, &b);
+	while (pos + match_size <= tview_len) {
+		unsigned long checksum;
+		while (indexed + match_size <= pos) {
+			block_table_add(&target_blocks,
+							block_hash(tview + indexed, match_size), indexed);
+			indexed += match_size;
+		}
+		checksum = (b << 16) | a;
+		start = block_table_get(&source_blocks, checksum);
+		if (start != -1 && !memcmp(sview + start, tview + pos, match_size)) {
+			action = TXDELTA_SOURCE;
+			view = sview;
+			view_len = sview_len;
+		} else {
+			start = block_table_get(&target_blocks, checksum);
+			if (start != -1 &&
+				!memcmp(tview + start, tview + pos, match_size)) {
+				action = TXDELTA_TARGET;
+				view = tview;
+				view_len = tview_len;
+			} else {
+				/* Roll the checksum one byte forward */
+				if (pos + match_size < tview_len) {
+					unsigned long out = tview[pos];
+					a = (a - out + tview[pos + match_size]) & 0xffff;
+					b = (b - match_size * out + a) & 0xffff;
+				}
+				pos++;
+				continue;
+			}
+		}
+		/* Extend the match backwards over data that has not been sent
+		 * yet */
+		while (pos > pending && start > 0 &&
+			   view[start - 1] == tview[pos - 1]) {
+			pos--;
+			start--;
+		}
+		/* Extend the match forwards, a block at a time and then
+		 * bytewise */
+		length = match_size;
+		while (pos + length + match_size <= tview_len &&
+			   start + length + match_size <= view_len &&
+			   !memcmp(view + start + length, tview + pos + length,
+					   match_size))
+			length += match_size;
+		while (pos + length < tview_len && start + length < view_len &&
+			   view[start + length] == tview[pos + length])
+			length++;
+		if (pos > pending) {
+			if (!append_op(ops, TXDELTA_NEW, new_len, pos - pending))
+				goto done;
+			memcpy(new_data + new_len, tview + pending, pos - pending);
+			new_len += pos - pending;
+		}
+		if (!append_op(ops, action, start, length))
+			goto done;
+		if (action == TXDELTA_SOURCE)
+			src_ops++;
+		pos += length;
+		pending = pos;
+		if (pos + match_size <= tview_len)
+			block_sums(tview + pos, match_size, &a, &b);
+	}
+	if (pending < tview_len) {
+		if (!append_op(ops, TXDELTA_NEW, new_len, tview_len - pending))
+			goto done;
+		memcpy(new_data + new_len, tview + pending, tview_len - pending);
+		new_len += tview_len - pending;
+	}
+
+	if (sview_offset == NULL) {
+		ret = Py_BuildValue("(innnOs#)", 0, sview_len, tview_len, src_ops,
+							ops, new_data, new_len);
+	} else {
+		ret = Py_BuildValue("(OnnnOs#)", sview_offset, sview_len, tview_len,
+							src_ops, ops, new_data, new_len);
+	}
+
+done:
+	Py_XDECREF(ops);
+	PyMem_Free(new_data);
+	block_table_free(&source_blocks);
+	block_table_free(&target_blocks);
+	return ret;
+}
+
+static PyMethodDef delta_module_methods[] = {
+	{ "txdelta_apply_ops", txdelta_apply_ops, METH_VARARGS,
+		"txdelta_apply_ops(src_ops, ops, new_data, sview) -> str\n"
+		"Apply txdelta operations to a source view." },
+	{ "compute_txdelta_window", (PyCFunction)compute_txdelta_window,
+		METH_VARARGS|METH_KEYWORDS,
+		"compute_txdelta_window(sview, tview, sview_offset=0, match_size=64) "
+		"-> window\n"
+		"Compute a txdelta window that creates a target view from a source "
+		"view." },
+	{ NULL, }
+};
+
+void init_delta(void)
+{
+	Py_InitModule3("_delta", delta_module_methods,
+				   "C implementations of delta functions");
+}
@@ -0,0 +1,605 @@
+/*
+ * Copyright © 2008 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+/* C implementation of marshall.marshall and marshall.Unmarshaller.
+ * This module does not depend on Subversion or APR. */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdbool.h>
+#include <string.h>
+
+extern PyTypeObject Unmarshaller_Type;
+
+/* Objects defined in subvertpy.marshall, looked up on first use */
+static PyObject *literal_class = NULL;
+static PyObject *MarshallError = NULL;
+static PyObject *NeedMoreData = NULL;
+
+static bool load_marshall_objects(void)
+{
+	PyObject *mod;
+
+	if (literal_class != NULL)
+		return true;
+
+	mod = PyImport_ImportModule("subvertpy.marshall");
+	if (mod == NULL)
+		return false;
+
+	literal_class = PyObject_GetAttrString(mod, "literal");
+	MarshallError = PyObject_GetAttrString(mod, "MarshallError");
+	NeedMoreData = PyObject_GetAttrString(mod, "NeedMoreData");
+	Py_DECREF(mod);
+	if (literal_class == NULL || MarshallError == NULL ||
+		NeedMoreData == NULL) {
+		Py_CLEAR(literal_class);
+		Py_CLEAR(MarshallError);
+		Py_CLEAR(NeedMoreData);
+		return false;
+	}
+	return true;
+}
+
+#define IS_WHITESPACE(c) ((c) == ' ' || (c) == '\n')
+#define IS_DIGIT(c) ((c) >= '0' && (c) <= '9')
+#define IS_ALPHA(c) (((c) >= 'a' && (c) <= 'z') || ((c) >= 'A' && (c) <= 'Z'))
+
+/*
+ * Marshalling
+ */
+
+typedef struct {
+	char *data;
+	Py_ssize_t len;
+	Py_ssize_t size;
+} outbuf;
+
+static bool outbuf_append(outbuf *buf, const char *data, Py_ssize_t len)
+{
+	if (buf->len + len > buf->size) {
+		Py_ssize_t newsize = buf->size * 2;
+		char *newdata;
+		if (newsize < buf->len + len)
+			newsize = buf->len + len;
+		newdata = PyMem_Realloc(buf->data, newsize);
+		if (newdata == NULL) {
+			PyErr_NoMemory();
+			return false;
+		}
+		buf->data = newdata;
+		buf->size = newsize;
+	}
+	memcpy(buf->data + buf->len, data, len);
+	buf->len += len;
+	return true;
+}
+
+static bool outbuf_append_string(outbuf *buf, const char *data, Py_ssize_t len)
+{
+	char prefix[32];
+	int n;
+
+	n = snprintf(prefix, sizeof(prefix), "%" PY_FORMAT_SIZE_T "d:", len);
+	if (!outbuf_append(buf, prefix, n))
+		return false;
+	if (!outbuf_append(buf, data, len))
+		return false;
+	return outbuf_append(buf, " ", 1);
+}
+
+static bool marshall_item(outbuf *buf, PyObject *x)
+{
+	int ret;
+
+	if (PyInt_CheckExact(x)) {
+		char num[32];
+		int n = snprintf(num, sizeof(num), "%ld ", PyInt_AS_LONG(x));
+		return outbuf_append(buf, num, n);
+	}
+
+	if (PyString_CheckExact(x)) {
+		return outbuf_append_string(buf, PyString_AS_STRING(x),
+									PyString_GET_SIZE(x));
+	}
+
+	if (PyList_CheckExact(x) || PyTuple_CheckExact(x)) {
+		Py_ssize_t i, len;
+		PyObject *seq = PySequence_Fast(x, "expected sequence");
+		if (seq == NULL)
+			return false;
+		if (!outbuf_append(buf, "( ", 2)) {
+			Py_DECREF(seq);
+			return false;
+		}
+		len = PySequence_Fast_GET_SIZE(seq);
+		for (i = 0; i < len; i++) {
+			if (!marshall_item(buf, PySequence_Fast_GET_ITEM(seq, i))) {
+				Py_DECREF(seq);
+				return false;
+			}
+		}
+		Py_DECREF(seq);
+		return outbuf_append(buf, ") ", 2);
+	}
+
+	ret = PyObject_IsInstance(x, literal_class);
+	if (ret == -1)
+		return false;
+	if (ret == 1) {
+		PyObject *s = PyObject_Str(x);
+		bool ok;
+		if (s == NULL)
+			return false;
+		ok = (outbuf_append(buf, PyString_AS_STRING(s), PyString_GET_SIZE(s)) &&
+			  outbuf_append(buf, " ", 1));
+		Py_DECREF(s);
+		return ok;
+	}
+
+	if (PyUnicode_CheckExact(x)) {
+		PyObject *s = PyUnicode_AsUTF8String(x);
+		bool ok;
+		if (s == NULL)
+			return false;
+		ok = outbuf_append_string(buf, PyString_AS_STRING(s),
+								  PyString_GET_SIZE(s));
+		Py_DECREF(s);
+		return ok;
+	}
+
+	if (PyBool_Check(x)) {
+		if (x == Py_True)
+			return outbuf_append(buf, "true ", 5);
+		else
+			return outbuf_append(buf, "false ", 6);
+	}
+
+	{
+		PyObject *repr = PyObject_Str(x);
+		if (repr == NULL)
+			return false;
+		PyErr_Format(MarshallError, "Unable to marshall type %s",
+					 PyString_AsString(repr));
+		Py_DECREF(repr);
+	}
+	return false;
+}
+
+static PyObject *py_marshall(PyObject *self, PyObject *x)
+{
+	outbuf buf;
+	PyObject *ret;
+
+	if (!load_marshall_objects())
+		return NULL;
+
+	buf.size = 64;
+	buf.len = 0;
+	buf.data = PyMem_Malloc(buf.size);
+	if (buf.data == NULL)
+		return PyErr_NoMemory();
+
+	if (!marshall_item(&buf, x)) {
+		PyMem_Free(buf.data);
+		return NULL;
+	}
+
+	ret = PyString_FromStringAndSize(buf.data, buf.len);
+	PyMem_Free(buf.data);
+	return ret;
+}
+
+/*
+ * Unmarshalling
+ */
+
+typedef struct {
+	PyObject_HEAD
+	char *buf;
+	Py_ssize_t pos, len, size;
+	/* Lists that are still being parsed, innermost last */
+	PyObject *stack;
+	/* Pieces read so far and number of bytes still missing of an
+	 * incomplete string */
+	PyObject *strparts;
+	Py_ssize_t strlen;
+} UnmarshallerObject;
+
+static PyObject *unmarshaller_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+	char *kwnames[] = { NULL };
+	UnmarshallerObject *ret;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "", kwnames))
+		return NULL;
+
+	if (!load_marshall_objects())
+		return NULL;
+
+	ret = PyObject_New(UnmarshallerObject, &Unmarshaller_Type);
+	if (ret == NULL)
+		return NULL;
+
+	ret->buf = NULL;
+	ret->pos = ret->len = ret->size = 0;
+	ret->strparts = NULL;
+	ret->strlen = 0;
+	ret->stack = PyList_New(0);
+	if (ret->stack == NULL) {
+		Py_DECREF(ret);
+		return NULL;
+	}
+
+	return (PyObject *)ret;
+}
+
+static void unmarshaller_dealloc(PyObject *self)
+{
+	UnmarshallerObject *u = (UnmarshallerObject *)self;
+
+	PyMem_Free(u->buf);
+	Py_XDECREF(u->stack);
+	Py_XDECREF(u->strparts);
+	PyObject_Del(self);
+}
+
+static PyObject *unmarshaller_feed(PyObject *self, PyObject *args)
+{
+	UnmarshallerObject *u = (UnmarshallerObject *)self;
+	char *data;
+	Py_ssize_t len;
+
+	if (!PyArg_ParseTuple(args, "s#", &data, &len))
+		return NULL;
+
+	/* Drop data that has already been parsed */
+	if (u->pos > 0) {
+		memmove(u->buf, u->buf + u->pos, u->len - u->pos);
+		u->len -= u->pos;
+		u->pos = 0;
+	}
+
+	if (u->len + len > u->size) {
+		Py_ssize_t newsize = u->size * 2;
+		char *newbuf;
+		if (newsize < u->len + len)
+			newsize = u->len + len;
+		newbuf = PyMem_Realloc(u->buf, newsize);
+		if (newbuf == NULL)
+			return PyErr_NoMemory();
+		u->buf = newbuf;
+		u->size = newsize;
+	}
+
+	memcpy(u->buf + u->len, data, len);
+	u->len += len;
+
+	Py_RETURN_NONE;
+}
+
+static PyObject *unmarshaller_remaining(PyObject *self)
+{
+	UnmarshallerObject *u = (UnmarshallerObject *)self;
+
+	return PyString_FromStringAndSize(u->buf + u->pos, u->len - u->pos);
+}
+
+static PyObject *parse_number(const char *data, Py_ssize_t len)
+{
+	PyObject *tmp, *ret;
+	long num = 0;
+	Py_ssize_t i;
+
+	if (len < 10) {
+		for (i = 0; i < len; i++)
+			num = num * 10 + (data[i] - '0');
+		return PyInt_FromLong(num);
+	}
+
+	tmp = PyString_FromStringAndSize(data, len);
+	if (tmp == NULL)
+		return NULL;
+	ret = PyInt_FromString(PyString_AS_STRING(tmp), NULL, 10);
+	Py_DECREF(tmp);
+	return ret;
+}
+
+static PyObject *unmarshaller_read_item(PyObject *self)
+{
+	UnmarshallerObject *u = (UnmarshallerObject *)self;
+	const char *buf = u->buf;
+	Py_ssize_t end = u->len;
+	Py_ssize_t pos = u->pos;
+	PyObject *ret;
+
+	while (true) {
+		if (u->strparts != NULL) {
+			Py_ssize_t n = end - pos;
+			PyObject *chunk;
+			if (n > u->strlen)
+				n = u->strlen;
+			chunk = PyString_FromStringAndSize(buf + pos, n);
+			if (chunk == NULL)
+				return NULL;
+			if (PyList_Append(u->strparts, chunk) != 0) {
+				Py_DECREF(chunk);
+				return NULL;
+			}
+			Py_DECREF(chunk);
+			u->strlen -= n;
+			pos += n;
+			if (u->strlen > 0) {
+				u->pos = pos;
+				PyErr_Format(NeedMoreData,
+							 "Expected %" PY_FORMAT_SIZE_T "d more bytes of string",
+							 u->strlen);
+				return NULL;
+			}
+			if (PyList_GET_SIZE(u->strparts) == 1) {
+				ret = PyList_GET_ITEM(u->strparts, 0);
+				Py_INCREF(ret);
+			} else {
+				PyObject *empty = PyString_FromString("");
+				if (empty == NULL)
+					return NULL;
+				ret = _PyString_Join(empty, u->strparts);
+				Py_DECREF(empty);
+				if (ret == NULL)
+					return NULL;
+			}
+			Py_CLEAR(u->strparts);
+			if (pos < end) {
+				if (!IS_WHITESPACE(buf[pos])) {
+					PyErr_Format(MarshallError, "Expected whitespace, got '%c'",
+								 buf[pos]);
+					Py_DECREF(ret);
+					return NULL;
+				}
+				pos++;
+			}
+		} else {
+			char c;
+			while (pos < end && IS_WHITESPACE(buf[pos]))
+				pos++;
+			u->pos = pos;
+			if (pos == end) {
+				PyErr_SetString(NeedMoreData, "Not enough data");
+				return NULL;
+			}
+			c = buf[pos];
+			if (c == '(') {
+				PyObject *l;
+				if (pos + 1 == end) {
+					PyErr_SetString(NeedMoreData, "Missing whitespace");
+					return NULL;
+				}
+				if (!IS_WHITESPACE(buf[pos+1])) {
+					PyErr_SetString(MarshallError,
+									"missing whitespace after list start");
+					return NULL;
+				}
+				l = PyList_New(0);
+				if (l == NULL)
+					return NULL;
+				if (PyList_Append(u->stack, l) != 0) {
+					Py_DECREF(l);
+					return NULL;
+				}
+				Py_DECREF(l);
+				pos += 2;
+				continue;
+			} else if (c == ')') {
+				Py_ssize_t depth = PyList_GET_SIZE(u->stack);
+				if (depth == 0) {
+					PyErr_SetString(MarshallError, "Unexpected character ')'");
+					return NULL;
+				}
+				if (pos + 1 == end) {
+					PyErr_SetString(NeedMoreData, "Missing whitespace");
+					return NULL;
+				}
+				if (!IS_WHITESPACE(buf[pos+1])) {
+					PyErr_Format(MarshallError, "Expected space, got '%c'",
+								 buf[pos+1]);
+					return NULL;
+				}
+				ret = PyList_GET_ITEM(u->stack, depth-1);
+				Py_INCREF(ret);
+				if (PyList_SetSlice(u->stack, depth-1, depth, NULL) != 0) {
+					Py_DECREF(ret);
+					return NULL;
+				}
+				pos += 2;
+			} else if (IS_DIGIT(c)) {
+				/* Check if this is a string or a number */
+				Py_ssize_t start = pos;
+				PyObject *num;
+				while (pos < end && IS_DIGIT(buf[pos]))
+					pos++;
+				if (pos == end) {
+					PyErr_SetString(NeedMoreData, "Expected whitespace or ':'");
+					return NULL;
+				}
+				if (buf[pos] != ':' && !IS_WHITESPACE(buf[pos])) {
+					PyErr_Format(MarshallError,
+								 "Expected whitespace or ':', got '%c'", buf[pos]);
+					return NULL;
+				}
+				num = parse_number(buf + start, pos - start);
+				if (num == NULL)
+					return NULL;
+				if (buf[pos] == ':') {
+					u->strlen = PyInt_AsSsize_t(num);
+					Py_DECREF(num);
+					if (u->strlen == -1 && PyErr_Occurred())
+						return NULL;
+					u->strparts = PyList_New(0);
+					if (u->strparts == NULL)
+						return NULL;
+					pos++;
+					continue;
+				}
+				ret = num;
+				pos++;
+			} else if (IS_ALPHA(c)) {
+				Py_ssize_t start = pos;
+				while (pos < end && (IS_ALPHA(buf[pos]) ||
+									 IS_DIGIT(buf[pos]) || buf[pos] == '-'))
+					pos++;
+				if (pos == end) {
+					PyErr_SetString(NeedMoreData, "Expected literal");
+					return NULL;
+				}
+				if (!IS_WHITESPACE(buf[pos])) {
+					PyErr_Format(MarshallError, "Expected whitespace, got '%c'",
+								 buf[pos]);
+					return NULL;
+				}
+				ret = PyString_FromStringAndSize(buf + start, pos - start);
+				if (ret == NULL)
+					return NULL;
+				pos++;
+			} else {
+				PyErr_Format(MarshallError, "Unexpected character '%c'", c);
+				return NULL;
+			}
+		}
+
+		if (PyList_GET_SIZE(u->stack) > 0) {
+			PyObject *parent = PyList_GET_ITEM(u->stack,
+											   PyList_GET_SIZE(u->stack)-1);
+			if (PyList_Append(parent, ret) != 0) {
+				Py_DECREF(ret);
+				return NULL;
+			}
+			Py_DECREF(ret);
+		} else {
+			u->pos = pos;
+			return ret;
+		}
+	}
+}
+
+static PyMethodDef unmarshaller_methods[] = {
+	{ "feed", unmarshaller_feed, METH_VARARGS,
+		"S.feed(data)\n"
+		"Add more data to parse." },
+	{ "read_item", (PyCFunction)unmarshaller_read_item, METH_NOARGS,
+		"S.read_item() -> item\n"
+		"Parse the next item. Raises NeedMoreData if not enough data "
+		"has been fed yet." },
+	{ "remaining", (PyCFunction)unmarshaller_remaining, METH_NOARGS,
+		"S.remaining() -> str\n"
+		"Return the data that has not been parsed yet." },
+	{ NULL, }
+};
+
+PyTypeObject Unmarshaller_Type = {
+	PyObject_HEAD_INIT(NULL) 0,
+	"_marshall.Unmarshaller", /*	const char *tp_name;  For printing, in format "<module>.<name>" */
+	sizeof(UnmarshallerObject),
+	0,/*	Py_ssize_t tp_basicsize, tp_itemsize;  For allocation */
+
+	/* Methods to implement standard operations */
+
+	unmarshaller_dealloc, /*	destructor tp_dealloc;	*/
+	NULL, /*	printfunc tp_print;	*/
+	NULL, /*	getattrfunc tp_getattr;	*/
+	NULL, /*	setattrfunc tp_setattr;	*/
+	NULL, /*	cmpfunc tp_compare;	*/
+	NULL, /*	reprfunc tp_repr;	*/
+
+	/* Method suites for standard classes */
+
+	NULL, /*	PyNumberMethods *tp_as_number;	*/
+	NULL, /*	PySequenceMethods *tp_as_sequence;	*/
+	NULL, /*	PyMappingMethods *tp_as_mapping;	*/
+
+	/* More standard operations (here for binary compatibility) */
+
+	NULL, /*	hashfunc tp_hash;	*/
+	NULL, /*	ternaryfunc tp_call;	*/
+	NULL, /*	reprfunc tp_str;	*/
+	NULL, /*	getattrofunc tp_getattro;	*/
+	NULL, /*	setattrofunc tp_setattro;	*/
+
+	/* Functions to access object as input/output buffer */
+	NULL, /*	PyBufferProcs *tp_as_buffer;	*/
+
+	/* Flags to define presence of optional/expanded features */
+	0, /*	long tp_flags;	*/
+
+	"Incremental parser for items in the svn_ra protocol", /*	const char *tp_doc;  Documentation string */
+
+	/* Assigned meaning in release 2.0 */
+	/* call function for all accessible objects */
+	NULL, /*	traverseproc tp_traverse;	*/
+
+	/* delete references to contained objects */
+	NULL, /*	inquiry tp_clear;	*/
+
+	/* Assigned meaning in release 2.1 */
+	/* rich comparisons */
+	NULL, /*	richcmpfunc tp_richcompare;	*/
+
+	/* weak reference enabler */
+	0, /*	Py_ssize_t tp_weaklistoffset;	*/
+
+	/* Added in release 2.2 */
+	/* Iterators */
+	NULL, /*	getiterfunc tp_iter;	*/
+	NULL, /*	iternextfunc tp_iternext;	*/
+
+	/* Attribute descriptor and subclassing stuff */
+	unmarshaller_methods, /*	struct PyMethodDef *tp_methods;	*/
+	NULL, /*	struct PyMemberDef *tp_members;	*/
+	NULL, /*	struct PyGetSetDef *tp_getset;	*/
+	NULL, /*	struct _typeobject *tp_base;	*/
+	NULL, /*	PyObject *tp_dict;	*/
+	NULL, /*	descrgetfunc tp_descr_get;	*/
+	NULL, /*	descrsetfunc tp_descr_set;	*/
+	0, /*	Py_ssize_t tp_dictoffset;	*/
+	NULL, /*	initproc tp_init;	*/
+	NULL, /*	allocfunc tp_alloc;	*/
+	unmarshaller_new, /*	newfunc tp_new;	*/
+};
+
+static PyMethodDef marshall_module_methods[] = {
+	{ "marshall", py_marshall, METH_O,
+		"marshall(x) -> str\n"
+		"Marshall a Python data item." },
+	{ NULL, }
+};
+
+void init_marshall(void)
+{
+	PyObject *mod;
+
+	if (PyType_Ready(&Unmarshaller_Type) < 0)
+		return;
+
+	mod = Py_InitModule3("_marshall", marshall_module_methods,
+						 "Marshalling for the svn_ra protocol");
+	if (mod == NULL)
+		return;
+
+	PyModule_AddObject(mod, "Unmarshaller", (PyObject *)&Unmarshaller_Type);
+	Py_INCREF(&Unmarshaller_Type);
+}
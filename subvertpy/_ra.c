@@ -463,6 +463,8 @@ static bool ra_check_busy(RemoteAccessObject *raobj)
 	return false;
 }
 
+#include "_ra_export.c"
+
 #if ONLY_SINCE_SVN(1, 5)
 static svn_error_t *py_get_client_string(void *baton, const char **name, apr_pool_t *pool)
 {
@@ -917,7 +919,7 @@ static PyObject *ra_do_update(PyObject *self, PyObject *args)
 												  revision_to_update_to, 
 												  update_target, recurse?svn_depth_infinity:svn_depth_files, 
 												  send_copyfrom_args,
-												  &py_editor, update_editor, 
+												  get_editor_for(update_editor), update_editor, 
 												  temp_pool);
 #else
 	if (send_copyfrom_args) {
@@ -929,7 +931,7 @@ static PyObject *ra_do_update(PyObject *self, PyObject *args)
 	err = svn_ra_do_update(ra->ra, &reporter,
 		&report_baton, revision_to_update_to,
 		update_target, recurse,
-		&py_editor, update_editor,
+		get_editor_for(update_editor), update_editor,
 		temp_pool);
 
 #endif
@@ -986,13 +988,13 @@ static PyObject *ra_do_switch(PyObject *self, PyObject *args)
 	err = svn_ra_do_switch2(
 						ra->ra, &reporter, &report_baton, 
 						revision_to_update_to, update_target, 
-						recurse?svn_depth_infinity:svn_depth_files, switch_url, &py_editor, 
+						recurse?svn_depth_infinity:svn_depth_files, switch_url, get_editor_for(update_editor), 
 						update_editor, temp_pool);
 #else
 	err = svn_ra_do_switch(
 						ra->ra, &reporter, &report_baton, 
 						revision_to_update_to, update_target, 
-						recurse, switch_url, &py_editor, 
+						recurse, switch_url, get_editor_for(update_editor), 
 						update_editor, temp_pool);
 #endif
 
@@ -1100,11 +1102,11 @@ static PyObject *ra_replay(PyObject *self, PyObject *args)
 	temp_pool = Pool(NULL);
 	if (temp_pool == NULL)
 		return NULL;
-	/* Only INCREF here, py_editor takes care of the DECREF */
+	/* Only INCREF here, the editor takes care of the DECREF */
 	Py_INCREF(update_editor); 
 	RUN_RA_WITH_POOL(temp_pool, ra,
 					  svn_ra_replay(ra->ra, revision, low_water_mark,
-									send_deltas, &py_editor, update_editor, 
+									send_deltas, get_editor_for(update_editor), update_editor, 
 									temp_pool));
 	apr_pool_destroy(temp_pool);
 
@@ -1124,7 +1126,7 @@ static svn_error_t *py_revstart_cb(svn_revnum_t revision, void *replay_baton,
 	ret = PyObject_CallFunction(py_start_fn, "lO", revision, py_revprops);
 	CB_CHECK_PYRETVAL(ret);
 
-	*editor = &py_editor;
+	*editor = get_editor_for(ret);
 	*edit_baton = ret;
 
 	PyGILState_Release(state);
@@ -1439,25 +1441,39 @@ static PyObject *ra_get_dir(PyObject *self, PyObject *args, PyObject *kwargs)
 	return Py_BuildValue("(NlN)", py_dirents, fetch_rev, py_props);
 }
 
-static PyObject *ra_get_file(PyObject *self, PyObject *args)
+/* Fetch a file into py_stream. If want_length is set, py_stream has to be a
+ * writable buffer and the number of bytes written is returned as well. */
+static PyObject *ra_fetch_file(RemoteAccessObject *ra, char *path, PyObject *py_stream, svn_revnum_t revision, bool want_length)
 {
-	char *path;
-	svn_revnum_t revision = -1;
-	RemoteAccessObject *ra = (RemoteAccessObject *)self;
 	apr_hash_t *props;
 	svn_revnum_t fetch_rev;
-	PyObject *py_stream, *py_props;
+	PyObject *py_props;
+	svn_stream_t *stream;
 	apr_pool_t *temp_pool;
-
-	if (!PyArg_ParseTuple(args, "sO|l:get_file", &path, &py_stream, &revision))
-		return NULL;
+	Py_ssize_t written;
 
 	if (ra_check_busy(ra))
 		return NULL;
 
 	temp_pool = Pool(NULL);
-	if (temp_pool == NULL)
+	if (temp_pool == NULL) {
+		ra->busy = false;
 		return NULL;
+	}
+
+	stream = new_py_output_stream(temp_pool, py_stream, &written);
+	if (stream == NULL) {
+		apr_pool_destroy(temp_pool);
+		ra->busy = false;
+		return NULL;
+	}
+
+	if (want_length && written < 0) {
+		PyErr_SetString(PyExc_TypeError, "Expected a writable buffer");
+		apr_pool_destroy(temp_pool);
+		ra->busy = false;
+		return NULL;
+	}
 
 	if (revision != SVN_INVALID_REVNUM)
 		fetch_rev = revision;
@@ -1466,8 +1482,7 @@ static PyObject *ra_get_file(PyObject *self, PyObject *args)
 	while (*path == '/') path++;
 
 	RUN_RA_WITH_POOL(temp_pool, ra, svn_ra_get_file(ra->ra, svn_path_canonicalize(path, temp_pool), revision, 
-													new_py_stream(temp_pool, py_stream), 
-													&fetch_rev, &props, temp_pool));
+													stream, &fetch_rev, &props, temp_pool));
 
 	py_props = prop_hash_to_dict(props);
 	if (py_props == NULL) {
@@ -1477,9 +1492,38 @@ static PyObject *ra_get_file(PyObject *self, PyObject *args)
 
 	apr_pool_destroy(temp_pool);
 
+	if (want_length)
+		return Py_BuildValue("(lNn)", fetch_rev, py_props, written);
 	return Py_BuildValue("(lN)", fetch_rev, py_props);
 }
 
+static PyObject *ra_get_file(PyObject *self, PyObject *args)
+{
+	char *path;
+	svn_revnum_t revision = -1;
+	PyObject *py_stream;
+
+	if (!PyArg_ParseTuple(args, "sO|l:get_file", &path, &py_stream, &revision))
+		return NULL;
+
+	return ra_fetch_file((RemoteAccessObject *)self, path, py_stream,
+						 revision, false);
+}
+
+static PyObject *ra_get_file_into(PyObject *self, PyObject *args)
+{
+	char *path;
+	svn_revnum_t revision = -1;
+	PyObject *py_buffer;
+
+	if (!PyArg_ParseTuple(args, "sO|l:get_file_into", &path, &py_buffer,
+						  &revision))
+		return NULL;
+
+	return ra_fetch_file((RemoteAccessObject *)self, path, py_buffer,
+						 revision, true);
+}
+
 static PyObject *ra_get_lock(PyObject *self, PyObject *args)
 {
 	char *path;
@@ -2020,7 +2064,10 @@ static PyGetSetDef ra_getsetters[] = {
 	{ NULL }
 };
 
+#include "_ra_queue.c"
 #include "_ra_iter_log.c"
+#include "_ra_changes.c"
+#include "_ra_iter_replay.c"
 
 static PyMethodDef ra_methods[] = {
 	{ "get_file_revs", ra_get_file_revs, METH_VARARGS, 
@@ -2056,7 +2103,17 @@ static PyMethodDef ra_methods[] = {
 		"Get the contents of a directory. "},
 	{ "get_file", ra_get_file, METH_VARARGS, 
 		"S.get_file(path, stream, revnum=-1) -> (fetched_rev, properties)\n"
-		"Fetch a file. The contents will be written to stream." },
+		"Fetch a file. The contents will be written to stream.\n"
+		"stream can be a writable buffer such as a bytearray or mmap that is\n"
+		"large enough to hold the contents, a file or io.FileIO object or an\n"
+		"object with a write() method. Buffers and files are written to\n"
+		"directly, without calling into Python. Use get_file_into() to find\n"
+		"out how much of a buffer was filled." },
+	{ "get_file_into", ra_get_file_into, METH_VARARGS,
+		"S.get_file_into(path, buffer, revnum=-1) -> (fetched_rev, properties, length)\n"
+		"Fetch a file into a writable buffer, such as a bytearray or mmap,\n"
+		"that is large enough to hold the contents. length is the number of\n"
+		"bytes written to the start of the buffer." },
 	{ "change_rev_prop", ra_change_rev_prop, METH_VARARGS, 
 		"S.change_rev_prop(revnum, name, value)\n"
 		"Change a revision property" },
@@ -2069,6 +2126,11 @@ static PyMethodDef ra_methods[] = {
 	{ "replay", ra_replay, METH_VARARGS, 
 		"S.replay(revision, low_water_mark, update_editor, send_deltas=True)\n" 
 		"Replay a revision, reporting changes to update_editor." },
+	{ "replay_changes", ra_replay_changes, METH_VARARGS, 
+		"S.replay_changes(revision, low_water_mark, send_deltas=False) -> changes\n"
+		"Replay a revision and return a summary of its changes.\n"
+		"The changes are collected without calling into Python, and returned\n"
+		"in the same format as the changes yielded by iter_replay." },
 	{ "replay_range", ra_replay_range, METH_VARARGS, 
 		"S.replay_range(start_rev, end_rev, low_water_mark, cbs, send_deltas=True)\n"
 		"Replay a range of revisions, reporting them to an update editor.\n"
@@ -2076,6 +2138,23 @@ static PyMethodDef ra_methods[] = {
 		"- start_rev_cb(revision, revprops) -> editor\n"
 		"- finish_rev_cb(revision, revprops, editor)\n"
 	},
+	{ "iter_replay", (PyCFunction)ra_iter_replay, METH_VARARGS|METH_KEYWORDS, 
+		"S.iter_replay(start_rev, end_rev, low_water_mark, send_deltas=False, "
+		"max_queue_size=100)\n"
+		"Yields a tuple for each revision in the range:\n"
+		"(revision, revprops, changes)\n"
+		"changes is a dictionary mapping each changed path, relative to the\n"
+		"session URL, to a tuple:\n"
+		"(action, from_path, from_rev, node_kind, props, text_delta)\n"
+		"action is one of 'A', 'D', 'M' and 'R'; node_kind is NODE_UNKNOWN for\n"
+		"deleted paths. props is a dictionary with the changed properties, with\n"
+		"None for removed properties. text_delta is None if the contents did\n"
+		"not change and otherwise a list of delta windows, which is empty\n"
+		"unless send_deltas is set.\n"
+		"Like iter_log, the revisions are fetched in another thread, which\n"
+		"buffers at most max_queue_size of them. Run the iterator to\n"
+		"exhaustion before calling any further methods.\n"
+	},
 	{ "do_switch", ra_do_switch, METH_VARARGS, 
 		"S.do_switch(revision_to_update_to, update_target, recurse, switch_url, update_editor)\n" },
 	{ "do_update", ra_do_update, METH_VARARGS, 
@@ -2102,7 +2181,8 @@ static PyMethodDef ra_methods[] = {
 	{ "iter_log", (PyCFunction)ra_iter_log, METH_VARARGS|METH_KEYWORDS, 
 		"S.iter_log(paths, start, end, limit=0, "
 		"discover_changed_paths=False, strict_node_history=True, "
-		"include_merged_revisions=False, revprops=None)\n"
+		"include_merged_revisions=False, revprops=None, "
+		"max_queue_size=100)\n"
 		"Yields tuples of three or four elements:\n"
 		"(changed_paths, revision, revprops[, has_children])\n"
 		"The changed_paths element may be None, or a dictionary mapping each\n"
@@ -2112,6 +2192,8 @@ static PyMethodDef ra_methods[] = {
 		"any further methods, make sure the thread has completed by running the\n"
 		"iterator to exhaustion (i.e. until StopIteration is raised, the \"for\"\n"
 		"loop finishes, etc).\n"
+		"At most max_queue_size entries are buffered; the thread waits for\n"
+		"the consumer when that many are pending. Use 0 for no limit.\n"
 	},
 	{ "get_latest_revnum", (PyCFunction)ra_get_latest_revnum, METH_NOARGS, 
 		"S.get_latest_revnum() -> int\n"
@@ -3274,6 +3356,12 @@ void init_ra(void)
 	if (PyType_Ready(&LogIterator_Type) < 0)
 		return;
 
+	if (PyType_Ready(&ReplayIterator_Type) < 0)
+		return;
+
+	if (PyType_Ready(&ExportEditor_Type) < 0)
+		return;
+
 	apr_initialize();
 	pool = Pool(NULL);
 	if (pool == NULL)
@@ -3294,6 +3382,9 @@ void init_ra(void)
 	PyModule_AddObject(mod, "Editor", (PyObject *)&Editor_Type);
 	Py_INCREF(&Editor_Type);
 
+	PyModule_AddObject(mod, "ExportEditor", (PyObject *)&ExportEditor_Type);
+	Py_INCREF(&ExportEditor_Type);
+
 	busy_exc = PyErr_NewException("_ra.BusyException", NULL, NULL);
 	PyModule_AddObject(mod, "BusyException", busy_exc);
 
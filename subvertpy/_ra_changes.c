@@ -0,0 +1,378 @@
+/*
+ * Copyright © 2010 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+/* Editor that records the changes made by an edit drive in C structures.
+ * Nothing is converted to Python objects until the drive has finished, so
+ * the drive itself runs without the GIL. */
+
+struct change_entry {
+	char action;
+	svn_node_kind_t kind;
+	const char *copyfrom_path;
+	svn_revnum_t copyfrom_rev;
+	/* Array of svn_prop_t, in the order the changes were received */
+	apr_array_header_t *props;
+	/* Array of svn_txdelta_window_t *, or NULL if the contents did not
+	 * change */
+	apr_array_header_t *windows;
+};
+
+struct change_collector {
+	/* Pool the entries are allocated in */
+	apr_pool_t *pool;
+	/* Maps paths to struct change_entry */
+	apr_hash_t *changes;
+};
+
+/* Directory or file baton */
+struct change_node {
+	struct change_collector *collector;
+	const char *path;
+	svn_node_kind_t kind;
+	/* NULL until the node has been changed */
+	struct change_entry *entry;
+};
+
+static struct change_collector *change_collector_new(apr_pool_t *pool)
+{
+	struct change_collector *collector;
+
+	collector = apr_pcalloc(pool, sizeof(struct change_collector));
+	collector->pool = pool;
+	collector->changes = apr_hash_make(pool);
+	return collector;
+}
+
+static struct change_entry *change_collector_add(struct change_collector *collector,
+												 const char *path, char action,
+												 const char *copyfrom_path,
+												 svn_revnum_t copyfrom_rev,
+												 svn_node_kind_t kind)
+{
+	struct change_entry *entry;
+
+	entry = apr_pcalloc(collector->pool, sizeof(struct change_entry));
+	entry->action = action;
+	entry->kind = kind;
+	if (copyfrom_path != NULL)
+		entry->copyfrom_path = apr_pstrdup(collector->pool, copyfrom_path);
+	entry->copyfrom_rev = copyfrom_rev;
+	entry->props = apr_array_make(collector->pool, 0, sizeof(svn_prop_t));
+	apr_hash_set(collector->changes, apr_pstrdup(collector->pool, path),
+				 APR_HASH_KEY_STRING, entry);
+	return entry;
+}
+
+/* Return the entry for a node, marking it as modified if it did not
+ * have one yet. */
+static struct change_entry *change_node_entry(struct change_node *node)
+{
+	if (node->entry == NULL) {
+		node->entry = change_collector_add(node->collector, node->path, 'M',
+										   NULL, SVN_INVALID_REVNUM,
+										   node->kind);
+	}
+	return node->entry;
+}
+
+static struct change_node *change_node_new(struct change_collector *collector,
+										   const char *path,
+										   svn_node_kind_t kind,
+										   apr_pool_t *pool)
+{
+	struct change_node *node = apr_pcalloc(pool, sizeof(struct change_node));
+	node->collector = collector;
+	node->path = apr_pstrdup(pool, path);
+	node->kind = kind;
+	return node;
+}
+
+static svn_error_t *change_cb_set_target_revision(void *edit_baton, svn_revnum_t target_revision, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *change_cb_open_root(void *edit_baton, svn_revnum_t base_revision, apr_pool_t *pool, void **root_baton)
+{
+	*root_baton = change_node_new((struct change_collector *)edit_baton, "",
+								  svn_node_dir, pool);
+	return NULL;
+}
+
+static svn_error_t *change_cb_delete_entry(const char *path, svn_revnum_t revision, void *parent_baton, apr_pool_t *pool)
+{
+	struct change_node *parent = (struct change_node *)parent_baton;
+
+	change_collector_add(parent->collector, path, 'D', NULL,
+						 SVN_INVALID_REVNUM, svn_node_unknown);
+	return NULL;
+}
+
+static svn_error_t *change_add_node(const char *path, void *parent_baton, const char *copyfrom_path, svn_revnum_t copyfrom_revision, svn_node_kind_t kind, apr_pool_t *pool, void **child_baton)
+{
+	struct change_node *parent = (struct change_node *)parent_baton;
+	struct change_node *node;
+	char action;
+
+	node = change_node_new(parent->collector, path, kind, pool);
+	/* A node that was deleted earlier in the same edit is replaced */
+	if (apr_hash_get(node->collector->changes, path,
+					 APR_HASH_KEY_STRING) != NULL) {
+		action = 'R';
+	} else {
+		action = 'A';
+	}
+	node->entry = change_collector_add(node->collector, path, action,
+									   copyfrom_path, copyfrom_revision, kind);
+	*child_baton = node;
+	return NULL;
+}
+
+static svn_error_t *change_cb_add_directory(const char *path, void *parent_baton, const char *copyfrom_path, svn_revnum_t copyfrom_revision, apr_pool_t *pool, void **child_baton)
+{
+	return change_add_node(path, parent_baton, copyfrom_path,
+						   copyfrom_revision, svn_node_dir, pool, child_baton);
+}
+
+static svn_error_t *change_cb_open_directory(const char *path, void *parent_baton, svn_revnum_t base_revision, apr_pool_t *pool, void **child_baton)
+{
+	struct change_node *parent = (struct change_node *)parent_baton;
+	*child_baton = change_node_new(parent->collector, path, svn_node_dir, pool);
+	return NULL;
+}
+
+static svn_error_t *change_cb_change_prop(void *baton, const char *name, const svn_string_t *value, apr_pool_t *pool)
+{
+	struct change_node *node = (struct change_node *)baton;
+	struct change_entry *entry = change_node_entry(node);
+	apr_pool_t *entry_pool = node->collector->pool;
+	svn_prop_t *prop;
+
+	prop = &APR_ARRAY_PUSH(entry->props, svn_prop_t);
+	prop->name = apr_pstrdup(entry_pool, name);
+	if (value != NULL) {
+		prop->value = svn_string_dup(value, entry_pool);
+	} else {
+		prop->value = NULL;
+	}
+	return NULL;
+}
+
+static svn_error_t *change_cb_close_node(void *baton, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *change_cb_absent_node(const char *path, void *parent_baton, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *change_cb_add_file(const char *path, void *parent_baton, const char *copy_path, svn_revnum_t copy_revision, apr_pool_t *file_pool, void **file_baton)
+{
+	return change_add_node(path, parent_baton, copy_path, copy_revision,
+						   svn_node_file, file_pool, file_baton);
+}
+
+static svn_error_t *change_cb_open_file(const char *path, void *parent_baton, svn_revnum_t base_revision, apr_pool_t *file_pool, void **file_baton)
+{
+	struct change_node *parent = (struct change_node *)parent_baton;
+	*file_baton = change_node_new(parent->collector, path, svn_node_file,
+								  file_pool);
+	return NULL;
+}
+
+static svn_error_t *change_window_handler(svn_txdelta_window_t *window, void *baton)
+{
+	struct change_node *node = (struct change_node *)baton;
+
+	if (window == NULL) {
+		/* All delta windows have been received */
+		return NULL;
+	}
+
+	APR_ARRAY_PUSH(node->entry->windows, svn_txdelta_window_t *) =
+		svn_txdelta_window_dup(window, node->collector->pool);
+	return NULL;
+}
+
+static svn_error_t *change_cb_apply_textdelta(void *file_baton, const char *base_checksum, apr_pool_t *pool, svn_txdelta_window_handler_t *handler, void **handler_baton)
+{
+	struct change_node *node = (struct change_node *)file_baton;
+	struct change_entry *entry = change_node_entry(node);
+
+	entry->windows = apr_array_make(node->collector->pool, 0,
+									sizeof(svn_txdelta_window_t *));
+	*handler = change_window_handler;
+	*handler_baton = node;
+	return NULL;
+}
+
+static svn_error_t *change_cb_close_file(void *file_baton, const char *text_checksum, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *change_cb_close_edit(void *edit_baton, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static const svn_delta_editor_t change_collector_editor = {
+	change_cb_set_target_revision,
+	change_cb_open_root,
+	change_cb_delete_entry,
+	change_cb_add_directory,
+	change_cb_open_directory,
+	change_cb_change_prop,
+	change_cb_close_node,
+	change_cb_absent_node,
+	change_cb_add_file,
+	change_cb_open_file,
+	change_cb_apply_textdelta,
+	change_cb_change_prop,
+	change_cb_close_file,
+	change_cb_absent_node,
+	change_cb_close_edit,
+	change_cb_close_edit
+};
+
+static PyObject *pyify_change_entry(struct change_entry *entry)
+{
+	PyObject *py_props, *py_windows;
+	int i;
+
+	py_props = PyDict_New();
+	if (py_props == NULL)
+		return NULL;
+	for (i = 0; i < entry->props->nelts; i++) {
+		svn_prop_t *prop = &APR_ARRAY_IDX(entry->props, i, svn_prop_t);
+		PyObject *py_value;
+		int ret;
+		if (prop->value != NULL) {
+			py_value = PyString_FromStringAndSize(prop->value->data,
+												  prop->value->len);
+			if (py_value == NULL) {
+				Py_DECREF(py_props);
+				return NULL;
+			}
+		} else {
+			py_value = Py_None;
+			Py_INCREF(py_value);
+		}
+		ret = PyDict_SetItemString(py_props, prop->name, py_value);
+		Py_DECREF(py_value);
+		if (ret != 0) {
+			Py_DECREF(py_props);
+			return NULL;
+		}
+	}
+
+	if (entry->windows == NULL) {
+		py_windows = Py_None;
+		Py_INCREF(py_windows);
+	} else {
+		py_windows = PyList_New(entry->windows->nelts);
+		if (py_windows == NULL) {
+			Py_DECREF(py_props);
+			return NULL;
+		}
+		for (i = 0; i < entry->windows->nelts; i++) {
+			PyObject *py_window = pyify_txdelta_window(
+				APR_ARRAY_IDX(entry->windows, i, svn_txdelta_window_t *));
+			if (py_window == NULL) {
+				Py_DECREF(py_windows);
+				Py_DECREF(py_props);
+				return NULL;
+			}
+			PyList_SET_ITEM(py_windows, i, py_window);
+		}
+	}
+
+	return Py_BuildValue("(czliNN)", entry->action, entry->copyfrom_path,
+						 entry->copyfrom_rev, entry->kind, py_props,
+						 py_windows);
+}
+
+/* Convert the changes recorded by a collector to a dictionary mapping
+ * paths to tuples. Must be called with the GIL held. */
+static PyObject *pyify_changes(struct change_collector *collector,
+							   apr_pool_t *pool)
+{
+	PyObject *py_changes;
+	apr_hash_index_t *idx;
+	const char *key;
+	apr_ssize_t klen;
+	struct change_entry *entry;
+
+	py_changes = PyDict_New();
+	if (py_changes == NULL)
+		return NULL;
+
+	for (idx = apr_hash_first(pool, collector->changes); idx != NULL;
+		 idx = apr_hash_next(idx)) {
+		PyObject *py_entry;
+		int ret;
+		apr_hash_this(idx, (const void **)&key, &klen, (void **)&entry);
+		py_entry = pyify_change_entry(entry);
+		if (py_entry == NULL) {
+			Py_DECREF(py_changes);
+			return NULL;
+		}
+		ret = PyDict_SetItemString(py_changes, key, py_entry);
+		Py_DECREF(py_entry);
+		if (ret != 0) {
+			Py_DECREF(py_changes);
+			return NULL;
+		}
+	}
+
+	return py_changes;
+}
+
+static PyObject *ra_replay_changes(PyObject *self, PyObject *args)
+{
+	RemoteAccessObject *ra = (RemoteAccessObject *)self;
+	apr_pool_t *temp_pool;
+	svn_revnum_t revision, low_water_mark;
+	struct change_collector *collector;
+	PyObject *ret;
+	bool send_deltas = false;
+
+	if (!PyArg_ParseTuple(args, "ll|b:replay_changes", &revision,
+						  &low_water_mark, &send_deltas))
+		return NULL;
+
+	if (ra_check_busy(ra))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL) {
+		ra->busy = false;
+		return NULL;
+	}
+	collector = change_collector_new(temp_pool);
+	RUN_RA_WITH_POOL(temp_pool, ra,
+					  svn_ra_replay(ra->ra, revision, low_water_mark,
+									send_deltas, &change_collector_editor,
+									collector, temp_pool));
+	ret = pyify_changes(collector, temp_pool);
+	apr_pool_destroy(temp_pool);
+	return ret;
+}
@@ -0,0 +1,571 @@
+/*
+ * Copyright © 2010 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+/* Editor that writes the tree it receives to a local directory. It is
+ * implemented in C so that fetching a tree does not call into Python for
+ * every file and delta window. */
+
+#include <apr_md5.h>
+#include <svn_delta.h>
+#include <svn_io.h>
+#include <svn_md5.h>
+
+typedef struct {
+	PyObject_HEAD
+	apr_pool_t *pool;
+	const char *path;
+} ExportEditorObject;
+
+staticforward PyTypeObject ExportEditor_Type;
+
+#define ExportEditor_Check(op) PyObject_TypeCheck(op, &ExportEditor_Type)
+
+struct export_dir {
+	ExportEditorObject *editor;
+	const char *local_path;
+};
+
+struct export_file {
+	ExportEditorObject *editor;
+	const char *local_path;
+	apr_pool_t *pool;
+	bool added;
+	/* File the new contents are written to, or NULL if the contents
+	 * did not change. Removed when the pool is destroyed, unless it has
+	 * been moved into place. */
+	const char *tmp_path;
+	/* MD5 digest of the new contents, set once all windows are applied */
+	unsigned char digest[APR_MD5_DIGESTSIZE];
+	/* State of the file before this edit */
+	svn_boolean_t was_special;
+	svn_boolean_t was_executable;
+	/* New values of svn:executable and svn:special, -1 if unchanged */
+	int executable;
+	int special;
+};
+
+static svn_error_t *export_unsupported_copy(const char *path)
+{
+	return svn_error_createf(SVN_ERR_UNSUPPORTED_FEATURE, NULL,
+		"Unable to export '%s': copies are not supported by the export editor",
+		path);
+}
+
+/* Determine where path ends up on disk. Paths come from the server, so
+ * refuse ones that would end up outside the target directory. */
+static svn_error_t *export_local_path(ExportEditorObject *editor, const char *path, apr_pool_t *pool, const char **local_path)
+{
+	const char *p = path;
+
+	if (*path == '/')
+		goto bad;
+	while (*p != '\0') {
+		size_t len = strcspn(p, "/");
+		if (len == 2 && p[0] == '.' && p[1] == '.')
+			goto bad;
+		p += len;
+		if (*p == '/')
+			p++;
+	}
+	*local_path = svn_path_join(editor->path, path, pool);
+	return NULL;
+
+bad:
+	return svn_error_createf(SVN_ERR_BAD_FILENAME, NULL,
+		"Refusing to export '%s': path is not below the target directory",
+		path);
+}
+
+/* Make sure a directory is not a symbolic link, such as one created
+ * earlier in the export, so that nothing is written outside the target
+ * directory through it. Parent directories have been checked when their
+ * batons were created. */
+static svn_error_t *export_check_dir(const char *local_path, apr_pool_t *pool)
+{
+	svn_node_kind_t kind;
+	svn_boolean_t special;
+
+	SVN_ERR(svn_io_check_special_path(local_path, &kind, &special, pool));
+	if (special) {
+		return svn_error_createf(SVN_ERR_BAD_FILENAME, NULL,
+			"Refusing to export to '%s': it is a symbolic link", local_path);
+	}
+	return NULL;
+}
+
+static svn_error_t *export_cb_set_target_revision(void *edit_baton, svn_revnum_t target_revision, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *export_cb_open_root(void *edit_baton, svn_revnum_t base_revision, apr_pool_t *pool, void **root_baton)
+{
+	struct export_dir *dir = apr_pcalloc(pool, sizeof(struct export_dir));
+	dir->editor = (ExportEditorObject *)edit_baton;
+	dir->local_path = dir->editor->path;
+	SVN_ERR(svn_io_make_dir_recursively(dir->local_path, pool));
+	*root_baton = dir;
+	return NULL;
+}
+
+static svn_error_t *export_cb_delete_entry(const char *path, svn_revnum_t revision, void *parent_baton, apr_pool_t *pool)
+{
+	struct export_dir *parent = (struct export_dir *)parent_baton;
+	const char *local_path;
+	svn_node_kind_t kind;
+	svn_boolean_t special;
+
+	SVN_ERR(export_local_path(parent->editor, path, pool, &local_path));
+	/* Don't follow symbolic links; links to directories are removed
+	 * like files. */
+	SVN_ERR(svn_io_check_special_path(local_path, &kind, &special, pool));
+	if (kind == svn_node_dir) {
+#if ONLY_SINCE_SVN(1, 5)
+		SVN_ERR(svn_io_remove_dir2(local_path, TRUE, NULL, NULL, pool));
+#else
+		SVN_ERR(svn_io_remove_dir(local_path, pool));
+#endif
+	} else if (kind != svn_node_none) {
+		SVN_ERR(svn_io_remove_file(local_path, pool));
+	}
+	return NULL;
+}
+
+static svn_error_t *export_cb_add_directory(const char *path, void *parent_baton, const char *copyfrom_path, svn_revnum_t copyfrom_revision, apr_pool_t *pool, void **child_baton)
+{
+	struct export_dir *parent = (struct export_dir *)parent_baton;
+	struct export_dir *dir;
+
+	if (copyfrom_path != NULL)
+		return export_unsupported_copy(path);
+
+	dir = apr_pcalloc(pool, sizeof(struct export_dir));
+	dir->editor = parent->editor;
+	SVN_ERR(export_local_path(parent->editor, path, pool, &dir->local_path));
+	SVN_ERR(export_check_dir(dir->local_path, pool));
+	SVN_ERR(svn_io_make_dir_recursively(dir->local_path, pool));
+	*child_baton = dir;
+	return NULL;
+}
+
+static svn_error_t *export_cb_open_directory(const char *path, void *parent_baton, svn_revnum_t base_revision, apr_pool_t *pool, void **child_baton)
+{
+	struct export_dir *parent = (struct export_dir *)parent_baton;
+	struct export_dir *dir = apr_pcalloc(pool, sizeof(struct export_dir));
+	dir->editor = parent->editor;
+	SVN_ERR(export_local_path(parent->editor, path, pool, &dir->local_path));
+	SVN_ERR(export_check_dir(dir->local_path, pool));
+	*child_baton = dir;
+	return NULL;
+}
+
+static svn_error_t *export_cb_change_dir_prop(void *dir_baton, const char *name, const svn_string_t *value, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *export_cb_close_directory(void *dir_baton, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static svn_error_t *export_cb_absent(const char *path, void *parent_baton, apr_pool_t *pool)
+{
+	return NULL;
+}
+
+static apr_status_t export_file_cleanup(void *baton)
+{
+	struct export_file *file = (struct export_file *)baton;
+	if (file->tmp_path != NULL)
+		apr_file_remove(file->tmp_path, file->pool);
+	return APR_SUCCESS;
+}
+
+static svn_error_t *export_new_file(struct export_dir *parent, const char *path, bool added, apr_pool_t *pool, struct export_file **ret)
+{
+	struct export_file *file = apr_pcalloc(pool, sizeof(struct export_file));
+	file->editor = parent->editor;
+	SVN_ERR(export_local_path(parent->editor, path, pool, &file->local_path));
+	file->pool = pool;
+	file->added = added;
+	file->executable = -1;
+	file->special = -1;
+	apr_pool_cleanup_register(pool, file, export_file_cleanup,
+							  apr_pool_cleanup_null);
+	*ret = file;
+	return NULL;
+}
+
+static svn_error_t *export_cb_add_file(const char *path, void *parent_baton, const char *copy_path, svn_revnum_t copy_revision, apr_pool_t *file_pool, void **file_baton)
+{
+	if (copy_path != NULL)
+		return export_unsupported_copy(path);
+
+	return export_new_file((struct export_dir *)parent_baton, path, true,
+						   file_pool, (struct export_file **)file_baton);
+}
+
+static svn_error_t *export_cb_open_file(const char *path, void *parent_baton, svn_revnum_t base_revision, apr_pool_t *file_pool, void **file_baton)
+{
+	struct export_file *file;
+	svn_node_kind_t kind;
+
+	SVN_ERR(export_new_file((struct export_dir *)parent_baton, path, false,
+							file_pool, &file));
+	SVN_ERR(svn_io_check_special_path(file->local_path, &kind,
+									  &file->was_special, file_pool));
+	if (!file->was_special)
+		SVN_ERR(svn_io_is_file_executable(&file->was_executable,
+										  file->local_path, file_pool));
+	*file_baton = file;
+	return NULL;
+}
+
+static svn_error_t *export_check_checksum(const char *path, const char *expected, const unsigned char *digest, apr_pool_t *pool)
+{
+	const char *actual = svn_md5_digest_to_cstring_display(digest, pool);
+
+	if (strcmp(expected, actual) != 0) {
+		return svn_error_createf(SVN_ERR_CHECKSUM_MISMATCH, NULL,
+			"Checksum mismatch for '%s':\n"
+			"   expected:  %s\n"
+			"     actual:  %s\n", path, expected, actual);
+	}
+	return NULL;
+}
+
+/* Open the current contents of a file as the source for a delta. Symbolic
+ * links are represented the way Subversion stores them. If base_checksum
+ * is not NULL, the contents are checked against it first. */
+static svn_error_t *export_open_base(struct export_file *file, const char *base_checksum, svn_stream_t **stream)
+{
+	unsigned char digest[APR_MD5_DIGESTSIZE];
+
+	if (file->added) {
+		*stream = svn_stream_empty(file->pool);
+	} else if (file->was_special) {
+		svn_string_t *dest;
+		svn_stringbuf_t *contents;
+		SVN_ERR(svn_io_read_link(&dest, file->local_path, file->pool));
+		contents = svn_stringbuf_createf(file->pool, "link %s", dest->data);
+		if (base_checksum != NULL) {
+			apr_md5(digest, contents->data, contents->len);
+			SVN_ERR(export_check_checksum(file->local_path, base_checksum,
+										  digest, file->pool));
+		}
+		*stream = svn_stream_from_stringbuf(contents, file->pool);
+	} else {
+		apr_file_t *base_file;
+		if (base_checksum != NULL) {
+			SVN_ERR(svn_io_file_checksum(digest, file->local_path,
+										 file->pool));
+			SVN_ERR(export_check_checksum(file->local_path, base_checksum,
+										  digest, file->pool));
+		}
+		SVN_ERR(svn_io_file_open(&base_file, file->local_path, APR_READ,
+								 APR_OS_DEFAULT, file->pool));
+		*stream = svn_stream_from_aprfile2(base_file, FALSE, file->pool);
+	}
+	return NULL;
+}
+
+static svn_error_t *export_cb_apply_textdelta(void *file_baton, const char *base_checksum, apr_pool_t *pool, svn_txdelta_window_handler_t *handler, void **handler_baton)
+{
+	struct export_file *file = (struct export_file *)file_baton;
+	svn_stream_t *source, *target;
+	apr_file_t *tmp_file;
+
+	SVN_ERR(export_open_base(file, base_checksum, &source));
+
+	/* Write to a file next to the target, so it can be moved into place
+	 * once the contents are complete. */
+#if ONLY_SINCE_SVN(1, 6)
+	SVN_ERR(svn_io_open_unique_file3(&tmp_file, &file->tmp_path,
+									 svn_path_dirname(file->local_path,
+													  file->pool),
+									 svn_io_file_del_none, file->pool,
+									 file->pool));
+#else
+	SVN_ERR(svn_io_open_unique_file2(&tmp_file, &file->tmp_path,
+									 file->local_path, ".tmp",
+									 svn_io_file_del_none, file->pool));
+#endif
+	/* svn_txdelta_apply closes the target once all windows have been
+	 * applied, which also closes the file. */
+	target = svn_stream_from_aprfile2(tmp_file, FALSE, file->pool);
+
+	svn_txdelta_apply(source, target, file->digest, file->local_path,
+					  file->pool, handler, handler_baton);
+	return NULL;
+}
+
+static svn_error_t *export_cb_change_file_prop(void *file_baton, const char *name, const svn_string_t *value, apr_pool_t *pool)
+{
+	struct export_file *file = (struct export_file *)file_baton;
+
+	if (!strcmp(name, SVN_PROP_EXECUTABLE)) {
+		file->executable = (value != NULL);
+	} else if (!strcmp(name, SVN_PROP_SPECIAL)) {
+		file->special = (value != NULL);
+	}
+	return NULL;
+}
+
+/* Replace local_path with a symbolic link described by the contents of
+ * tmp_path, which Subversion stores as "link TARGET". */
+static svn_error_t *export_install_link(const char *local_path, const char *tmp_path, apr_pool_t *pool)
+{
+	svn_stringbuf_t *contents;
+	const char *link_path;
+
+	SVN_ERR(svn_stringbuf_from_file(&contents, tmp_path, pool));
+	if (strncmp(contents->data, "link ", 5) != 0) {
+		/* Not a special file Subversion knows about, keep the contents
+		 * as they are. */
+		return svn_io_file_rename(tmp_path, local_path, pool);
+	}
+	SVN_ERR(svn_io_remove_file(tmp_path, pool));
+	SVN_ERR(svn_io_create_unique_link(&link_path, local_path,
+									  contents->data + 5, ".tmp", pool));
+	return svn_io_file_rename(link_path, local_path, pool);
+}
+
+static svn_error_t *export_cb_close_file(void *file_baton, const char *text_checksum, apr_pool_t *pool)
+{
+	struct export_file *file = (struct export_file *)file_baton;
+	svn_boolean_t special, executable;
+
+	if (file->special != -1) {
+		special = file->special;
+	} else {
+		special = file->was_special;
+	}
+	if (file->executable != -1) {
+		executable = file->executable;
+	} else {
+		executable = file->was_executable;
+	}
+
+	if (file->tmp_path != NULL) {
+		if (text_checksum != NULL) {
+			SVN_ERR(export_check_checksum(file->local_path, text_checksum,
+										  file->digest, pool));
+		}
+		if (special) {
+			SVN_ERR(export_install_link(file->local_path, file->tmp_path,
+										pool));
+			file->tmp_path = NULL;
+			return NULL;
+		}
+		SVN_ERR(svn_io_file_rename(file->tmp_path, file->local_path, pool));
+		file->tmp_path = NULL;
+	} else if (file->added) {
+		svn_node_kind_t kind;
+		svn_boolean_t was_special;
+		/* Empty files don't receive any delta windows. Replace rather
+		 * than follow a link that is in the way. */
+		SVN_ERR(svn_io_check_special_path(file->local_path, &kind,
+										  &was_special, pool));
+		if (was_special)
+			SVN_ERR(svn_io_remove_file(file->local_path, pool));
+		SVN_ERR(svn_io_file_create(file->local_path, "", pool));
+	} else if (special || file->was_special) {
+		/* Nothing to do for links whose target did not change */
+		return NULL;
+	}
+
+	/* A new file was created if the contents changed, so the executable
+	 * bit has to be set again even if it did not change. */
+	if (executable || file->executable == 0) {
+		SVN_ERR(svn_io_set_file_executable(file->local_path, executable,
+										   FALSE, pool));
+	}
+	return NULL;
+}
+
+static svn_error_t *export_cb_close_edit(void *edit_baton, apr_pool_t *pool)
+{
+	PyObject *self = (PyObject *)edit_baton;
+	PyGILState_STATE state = PyGILState_Ensure();
+	Py_DECREF(self);
+	PyGILState_Release(state);
+	return NULL;
+}
+
+static svn_error_t *export_cb_abort_edit(void *edit_baton, apr_pool_t *pool)
+{
+	PyObject *self = (PyObject *)edit_baton;
+	PyGILState_STATE state;
+
+	/* Files that are still open have their temporary files removed when
+	 * their pool is destroyed; whatever was already written is left in
+	 * place. */
+	state = PyGILState_Ensure();
+	Py_DECREF(self);
+	PyGILState_Release(state);
+	return NULL;
+}
+
+static const svn_delta_editor_t export_editor = {
+	export_cb_set_target_revision,
+	export_cb_open_root,
+	export_cb_delete_entry,
+	export_cb_add_directory,
+	export_cb_open_directory,
+	export_cb_change_dir_prop,
+	export_cb_close_directory,
+	export_cb_absent,
+	export_cb_add_file,
+	export_cb_open_file,
+	export_cb_apply_textdelta,
+	export_cb_change_file_prop,
+	export_cb_close_file,
+	export_cb_absent,
+	export_cb_close_edit,
+	export_cb_abort_edit
+};
+
+/* Return the C editor to use when driving a Python editor object. Editors
+ * implemented in C are driven directly, anything else is called through
+ * py_editor. Either way the object itself is the edit baton. */
+static const svn_delta_editor_t *get_editor_for(PyObject *update_editor)
+{
+	if (ExportEditor_Check(update_editor))
+		return &export_editor;
+	return &py_editor;
+}
+
+static PyObject *export_editor_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+	char *kwnames[] = { "path", NULL };
+	char *path;
+	ExportEditorObject *ret;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s:ExportEditor", kwnames,
+									 &path))
+		return NULL;
+
+	ret = PyObject_New(ExportEditorObject, &ExportEditor_Type);
+	if (ret == NULL)
+		return NULL;
+
+	ret->pool = Pool(NULL);
+	if (ret->pool == NULL) {
+		PyObject_Del(ret);
+		return NULL;
+	}
+	ret->path = svn_path_canonicalize(path, ret->pool);
+	return (PyObject *)ret;
+}
+
+static void export_editor_dealloc(PyObject *self)
+{
+	ExportEditorObject *editor = (ExportEditorObject *)self;
+	apr_pool_destroy(editor->pool);
+	PyObject_Del(self);
+}
+
+static PyObject *export_editor_get_path(PyObject *self, void *closure)
+{
+	ExportEditorObject *editor = (ExportEditorObject *)self;
+	return PyString_FromString(editor->path);
+}
+
+static PyGetSetDef export_editor_getsetters[] = {
+	{ "path", export_editor_get_path, NULL, "Directory the tree is written to." },
+	{ NULL }
+};
+
+static PyTypeObject ExportEditor_Type = {
+	PyObject_HEAD_INIT(NULL) 0,
+	"_ra.ExportEditor", /*	const char *tp_name;  For printing, in format "<module>.<name>" */
+	sizeof(ExportEditorObject), 
+	0,/*	Py_ssize_t tp_basicsize, tp_itemsize;  For allocation */
+	
+	/* Methods to implement standard operations */
+	
+	export_editor_dealloc, /*	destructor tp_dealloc;	*/
+	NULL, /*	printfunc tp_print;	*/
+	NULL, /*	getattrfunc tp_getattr;	*/
+	NULL, /*	setattrfunc tp_setattr;	*/
+	NULL, /*	cmpfunc tp_compare;	*/
+	NULL, /*	reprfunc tp_repr;	*/
+	
+	/* Method suites for standard classes */
+	
+	NULL, /*	PyNumberMethods *tp_as_number;	*/
+	NULL, /*	PySequenceMethods *tp_as_sequence;	*/
+	NULL, /*	PyMappingMethods *tp_as_mapping;	*/
+	
+	/* More standard operations (here for binary compatibility) */
+	
+	NULL, /*	hashfunc tp_hash;	*/
+	NULL, /*	ternaryfunc tp_call;	*/
+	NULL, /*	reprfunc tp_str;	*/
+	NULL, /*	getattrofunc tp_getattro;	*/
+	NULL, /*	setattrofunc tp_setattro;	*/
+	
+	/* Functions to access object as input/output buffer */
+	NULL, /*	PyBufferProcs *tp_as_buffer;	*/
+	
+	/* Flags to define presence of optional/expanded features */
+	0, /*	long tp_flags;	*/
+	
+	"ExportEditor(path)\n"
+	"Editor that writes the tree it receives to the directory path.\n"
+	"It can be passed to RemoteAccess.do_update, do_switch, replay and\n"
+	"replay_range, which then drive it without calling into Python.\n"
+	"Files are marked executable and symbolic links are created according\n"
+	"to svn:executable and svn:special. Copies are not supported, so\n"
+	"copyfrom arguments should not be requested. Paths outside path are\n"
+	"refused and symbolic links are not followed.", /*	const char *tp_doc;  Documentation string */
+	
+	/* Assigned meaning in release 2.0 */
+	/* call function for all accessible objects */
+	NULL, /*	traverseproc tp_traverse;	*/
+	
+	/* delete references to contained objects */
+	NULL, /*	inquiry tp_clear;	*/
+	
+	/* Assigned meaning in release 2.1 */
+	/* rich comparisons */
+	NULL, /*	richcmpfunc tp_richcompare;	*/
+	
+	/* weak reference enabler */
+	0, /*	Py_ssize_t tp_weaklistoffset;	*/
+	
+	/* Added in release 2.2 */
+	/* Iterators */
+	NULL, /*	getiterfunc tp_iter;	*/
+	NULL, /*	iternextfunc tp_iternext;	*/
+	
+	/* Attribute descriptor and subclassing stuff */
+	NULL, /*	struct PyMethodDef *tp_methods;	*/
+	NULL, /*	struct PyMemberDef *tp_members;	*/
+	export_editor_getsetters, /*	struct PyGetSetDef *tp_getset;	*/
+	NULL, /*	struct _typeobject *tp_base;	*/
+	NULL, /*	PyObject *tp_dict;	*/
+	NULL, /*	descrgetfunc tp_descr_get;	*/
+	NULL, /*	descrsetfunc tp_descr_set;	*/
+	0, /*	Py_ssize_t tp_dictoffset;	*/
+	NULL, /*	initproc tp_init;	*/
+	NULL, /*	allocfunc tp_alloc;	*/
+	export_editor_new, /*	newfunc tp_new;	*/
+};
@@ -16,112 +16,26 @@
  * along with this program; if not, write to the Free Software
  * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
  */
-#include <pythread.h>
 
-struct log_entry {
-	PyObject *tuple;
-	struct log_entry *next;
-};
-
-typedef struct {
-	PyObject_HEAD
+struct log_args {
 	svn_revnum_t start, end;
 	svn_boolean_t discover_changed_paths;
 	svn_boolean_t strict_node_history;
 	svn_boolean_t include_merged_revisions;
 	int limit;
-	apr_pool_t *pool;
 	apr_array_header_t *apr_paths;
 	apr_array_header_t *apr_revprops;
-	RemoteAccessObject *ra;
-	svn_boolean_t done;
-	PyObject *exc_type;
-	PyObject *exc_val;
-	int queue_size;
-	struct log_entry *head;
-	struct log_entry *tail;
-} LogIteratorObject;
-
-static void log_iter_dealloc(PyObject *self)
-{
-	LogIteratorObject *iter = (LogIteratorObject *)self;
-
-	while (iter->head) {
-		struct log_entry *e = iter->head;
-		Py_DECREF(e->tuple);
-		iter->head = e->next;
-		free(e);
-	}
-	Py_XDECREF(iter->exc_type);
-	Py_XDECREF(iter->exc_val);
-	apr_pool_destroy(iter->pool);
-	Py_DECREF(iter->ra);
-	PyObject_Del(iter);
-}
-
-static PyObject *log_iter_next(LogIteratorObject *iter)
-{
-	struct log_entry *first;
-	PyObject *ret;
-	Py_INCREF(iter);
-
-	while (iter->head == NULL) {
-		/* Done, raise exception */
-		if (iter->exc_type != NULL) {
-			PyErr_SetObject(iter->exc_type, iter->exc_val);
-			Py_DECREF(iter);
-			return NULL;
-		} else {
-			Py_BEGIN_ALLOW_THREADS
-			/* FIXME: Don't waste cycles */
-			Py_END_ALLOW_THREADS
-		}
-	}
-	first = iter->head;
-	ret = iter->head->tuple;
-	iter->head = first->next;
-	if (first == iter->tail)
-		iter->tail = NULL;
-	free(first);
-	iter->queue_size--;
-	Py_DECREF(iter);
-	return ret;
-}
-
-static PyObject *py_iter_append(LogIteratorObject *iter, PyObject *tuple)
-{
-	struct log_entry *entry;
-
-	entry = calloc(sizeof(struct log_entry), 1);
-	if (entry == NULL) {
-		PyErr_NoMemory();
-		return NULL;
-	}
-
-	entry->tuple = tuple;
-	if (iter->tail == NULL) {
-		iter->tail = entry;
-	} else {
-		iter->tail->next = entry;
-		iter->tail = entry;
-	}
-	if (iter->head == NULL)
-		iter->head = entry;
-
-	iter->queue_size++;
-
-	Py_RETURN_NONE;
-}
+};
 
 PyTypeObject LogIterator_Type = {
 	PyObject_HEAD_INIT(NULL) 0,
 	"_ra.LogIterator", /*	const char *tp_name;  For printing, in format "<module>.<name>" */
-	sizeof(LogIteratorObject), 
+	sizeof(QueueIteratorObject), 
 	0,/*	Py_ssize_t tp_basicsize, tp_itemsize;  For allocation */
 	
 	/* Methods to implement standard operations */
 	
-	(destructor)log_iter_dealloc, /*	destructor tp_dealloc;	*/
+	(destructor)queue_iter_dealloc, /*	destructor tp_dealloc;	*/
 	NULL, /*	printfunc tp_print;	*/
 	NULL, /*	getattrfunc tp_getattr;	*/
 	NULL, /*	setattrfunc tp_setattr;	*/
@@ -167,14 +81,14 @@ PyTypeObject LogIterator_Type = {
 	/* Added in release 2.2 */
 	/* Iterators */
 	PyObject_SelfIter, /*	getiterfunc tp_iter;	*/
-	(iternextfunc)log_iter_next, /*	iternextfunc tp_iternext;	*/
+	(iternextfunc)queue_iter_next, /*	iternextfunc tp_iternext;	*/
 };
 
 #if ONLY_SINCE_SVN(1, 5)
 static svn_error_t *py_iter_log_entry_cb(void *baton, svn_log_entry_t *log_entry, apr_pool_t *pool)
 {
-	PyObject *revprops, *py_changed_paths, *ret, *tuple;
-	LogIteratorObject *iter = (LogIteratorObject *)baton;
+	PyObject *revprops, *py_changed_paths, *tuple;
+	struct iter_queue *queue = (struct iter_queue *)baton;
 
 	PyGILState_STATE state;
 
@@ -206,24 +120,15 @@ static svn_error_t *py_iter_log_entry_cb(void *baton, svn_log_entry_t *log_entry
 		return py_svn_error();
 	}
 
-	ret = py_iter_append(iter, tuple);
-	if (ret == NULL) {
-		Py_DECREF(tuple);
-		PyGILState_Release(state);
-		return py_svn_error();
-	}
-
-	Py_DECREF(ret);
-
 	PyGILState_Release(state);
 
-	return NULL;
+	return iter_queue_push(queue, tuple);
 }
 #else
 static svn_error_t *py_iter_log_cb(void *baton, apr_hash_t *changed_paths, svn_revnum_t revision, const char *author, const char *date, const char *message, apr_pool_t *pool)
 {
-	PyObject *revprops, *py_changed_paths, *ret, *obj, *tuple;
-	LogIteratorObject *iter = (LogIteratorObject *)baton;
+	PyObject *revprops, *py_changed_paths, *obj, *tuple;
+	struct iter_queue *queue = (struct iter_queue *)baton;
 
 	PyGILState_STATE state;
 
@@ -266,84 +171,59 @@ static svn_error_t *py_iter_log_cb(void *baton, apr_hash_t *changed_paths, svn_r
 		return py_svn_error();
 	}
 
-	ret = py_iter_append(iter, tuple);
-
-	if (ret == NULL) {
-		Py_DECREF(tuple);
-		PyGILState_Release(state);
-		return py_svn_error();
-	}
-
-	Py_DECREF(ret);
-
 	PyGILState_Release(state);
 
-	return NULL;
+	return iter_queue_push(queue, tuple);
 }
 #endif
 
 
 static void py_iter_log(void *baton)
 {
-	LogIteratorObject *iter = (LogIteratorObject *)baton;
+	struct iter_queue *queue = (struct iter_queue *)baton;
+	struct log_args *args = (struct log_args *)queue->baton;
 	svn_error_t *error;
-	PyGILState_STATE state;
 
 #if ONLY_SINCE_SVN(1, 5)
-	error = svn_ra_get_log2(iter->ra->ra, 
-			iter->apr_paths, iter->start, iter->end, iter->limit,
-			iter->discover_changed_paths, iter->strict_node_history, 
-			iter->include_merged_revisions, iter->apr_revprops,
-			py_iter_log_entry_cb, iter, iter->pool);
+	error = svn_ra_get_log2(queue->ra->ra, 
+			args->apr_paths, args->start, args->end, args->limit,
+			args->discover_changed_paths, args->strict_node_history, 
+			args->include_merged_revisions, args->apr_revprops,
+			py_iter_log_entry_cb, queue, queue->pool);
 #else
-	error = svn_ra_get_log(iter->ra->ra, 
-			iter->apr_paths, iter->start, iter->end, iter->limit,
-			iter->discover_changed_paths, iter->strict_node_history, py_iter_log_cb, 
-			iter, iter->pool);
+	error = svn_ra_get_log(queue->ra->ra, 
+			args->apr_paths, args->start, args->end, args->limit,
+			args->discover_changed_paths, args->strict_node_history, py_iter_log_cb, 
+			queue, queue->pool);
 #endif
-	state = PyGILState_Ensure();
-	if (error != NULL) {
-		iter->exc_type = (PyObject *)PyErr_GetSubversionExceptionTypeObject();
-		iter->exc_val  = PyErr_NewSubversionException(error);
-		svn_error_clear(error);
-	} else {
-		iter->exc_type = PyExc_StopIteration;
-		Py_INCREF(iter->exc_type);
-		iter->exc_val = Py_None;
-		Py_INCREF(iter->exc_val);
-	}
-	iter->done = TRUE;
-	iter->ra->busy = false;
-
-	Py_DECREF(iter);
-	PyGILState_Release(state);
+	iter_queue_finish(queue, error);
 }
 
 PyObject *ra_iter_log(PyObject *self, PyObject *args, PyObject *kwargs)
 {
 	char *kwnames[] = { "paths", "start", "end", "limit",
-		"discover_changed_paths", "strict_node_history", "include_merged_revisions", "revprops", NULL };
+		"discover_changed_paths", "strict_node_history", "include_merged_revisions", "revprops",
+		"max_queue_size", NULL };
 	PyObject *paths;
 	svn_revnum_t start = 0, end = 0;
-	int limit=0; 
+	int limit=0, max_queue_size=DEFAULT_ITER_QUEUE_SIZE;
 	bool discover_changed_paths=false, strict_node_history=true, include_merged_revisions=false;
 	RemoteAccessObject *ra = (RemoteAccessObject *)self;
 	PyObject *revprops = Py_None;
-	LogIteratorObject *ret;
+	struct iter_queue *queue;
+	struct log_args *log_args;
 	apr_pool_t *pool;
 	apr_array_header_t *apr_paths;
 	apr_array_header_t *apr_revprops;
 
-	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Oll|ibbbO:iter_log", kwnames, 
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "Oll|ibbbOi:iter_log", kwnames, 
 						 &paths, &start, &end, &limit,
 						 &discover_changed_paths, &strict_node_history,
-						 &include_merged_revisions, &revprops))
-		return NULL;
-
-	if (ra_check_busy(ra))
+						 &include_merged_revisions, &revprops,
+						 &max_queue_size))
 		return NULL;
 
-	pool = Pool(ra->pool);
+	pool = Pool(NULL);
 	if (pool == NULL)
 		return NULL;
 	if (paths == Py_None) {
@@ -394,29 +274,25 @@ PyObject *ra_iter_log(PyObject *self, PyObject *args, PyObject *kwargs)
 		return NULL;
 	}
 
-	ret = PyObject_New(LogIteratorObject, &LogIterator_Type);
-	ret->ra = ra;
-	Py_INCREF(ret->ra);
-	ret->start = start;
-	ret->exc_type = NULL;
-	ret->exc_val = NULL;
-	ret->discover_changed_paths = discover_changed_paths;
-	ret->end = end;
-	ret->limit = limit;
-	ret->apr_paths = apr_paths;
-	ret->pool = pool;
-	ret->include_merged_revisions = include_merged_revisions;
-	ret->strict_node_history = strict_node_history;
-	ret->apr_revprops = apr_revprops;
-	ret->done = FALSE;
-	ret->queue_size = 0;
-	ret->head = NULL;
-	ret->tail = NULL;
+	queue = iter_queue_new(ra, max_queue_size, pool);
+	if (queue == NULL)
+		return NULL;
 
-	Py_INCREF(ret);
-	PyThread_start_new_thread(py_iter_log, ret);
+	log_args = apr_pcalloc(pool, sizeof(struct log_args));
+	log_args->start = start;
+	log_args->end = end;
+	log_args->limit = limit;
+	log_args->discover_changed_paths = discover_changed_paths;
+	log_args->strict_node_history = strict_node_history;
+	log_args->include_merged_revisions = include_merged_revisions;
+	log_args->apr_paths = apr_paths;
+	log_args->apr_revprops = apr_revprops;
+	queue->baton = log_args;
+
+	if (ra_check_busy(ra)) {
+		iter_queue_unref(queue);
+		return NULL;
+	}
 
-	return (PyObject *)ret;
+	return iter_queue_start(queue, &LogIterator_Type, py_iter_log);
 }
-
-
@@ -0,0 +1,174 @@
+/*
+ * Copyright © 2010 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+struct replay_args {
+	svn_revnum_t start, end, low_water_mark;
+	svn_boolean_t send_deltas;
+};
+
+PyTypeObject ReplayIterator_Type = {
+	PyObject_HEAD_INIT(NULL) 0,
+	"_ra.ReplayIterator", /*	const char *tp_name;  For printing, in format "<module>.<name>" */
+	sizeof(QueueIteratorObject), 
+	0,/*	Py_ssize_t tp_basicsize, tp_itemsize;  For allocation */
+	
+	/* Methods to implement standard operations */
+	
+	(destructor)queue_iter_dealloc, /*	destructor tp_dealloc;	*/
+	NULL, /*	printfunc tp_print;	*/
+	NULL, /*	getattrfunc tp_getattr;	*/
+	NULL, /*	setattrfunc tp_setattr;	*/
+	NULL, /*	cmpfunc tp_compare;	*/
+	NULL, /*	reprfunc tp_repr;	*/
+	
+	/* Method suites for standard classes */
+	
+	NULL, /*	PyNumberMethods *tp_as_number;	*/
+	NULL, /*	PySequenceMethods *tp_as_sequence;	*/
+	NULL, /*	PyMappingMethods *tp_as_mapping;	*/
+	
+	/* More standard operations (here for binary compatibility) */
+	
+	NULL, /*	hashfunc tp_hash;	*/
+	NULL, /*	ternaryfunc tp_call;	*/
+	NULL, /*	reprfunc tp_str;	*/
+	NULL, /*	getattrofunc tp_getattro;	*/
+	NULL, /*	setattrofunc tp_setattro;	*/
+	
+	/* Functions to access object as input/output buffer */
+	NULL, /*	PyBufferProcs *tp_as_buffer;	*/
+	
+	/* Flags to define presence of optional/expanded features */
+	Py_TPFLAGS_HAVE_ITER, /*	long tp_flags;	*/
+	
+	NULL, /*	const char *tp_doc;  Documentation string */
+	
+	/* Assigned meaning in release 2.0 */
+	/* call function for all accessible objects */
+	NULL, /*	traverseproc tp_traverse;	*/
+	
+	/* delete references to contained objects */
+	NULL, /*	inquiry tp_clear;	*/
+	
+	/* Assigned meaning in release 2.1 */
+	/* rich comparisons */
+	NULL, /*	richcmpfunc tp_richcompare;	*/
+	
+	/* weak reference enabler */
+	0, /*	Py_ssize_t tp_weaklistoffset;	*/
+	
+	/* Added in release 2.2 */
+	/* Iterators */
+	PyObject_SelfIter, /*	getiterfunc tp_iter;	*/
+	(iternextfunc)queue_iter_next, /*	iternextfunc tp_iternext;	*/
+};
+
+#if ONLY_SINCE_SVN(1, 5)
+static svn_error_t *py_iter_revstart_cb(svn_revnum_t revision, void *replay_baton,
+   const svn_delta_editor_t **editor, void **edit_baton, apr_hash_t *rev_props, apr_pool_t *pool)
+{
+	*editor = &change_collector_editor;
+	*edit_baton = change_collector_new(pool);
+	return NULL;
+}
+
+static svn_error_t *py_iter_revfinish_cb(svn_revnum_t revision, void *replay_baton, 
+									const svn_delta_editor_t *editor, void *edit_baton, 
+									apr_hash_t *rev_props, apr_pool_t *pool)
+{
+	struct iter_queue *queue = (struct iter_queue *)replay_baton;
+	struct change_collector *collector = (struct change_collector *)edit_baton;
+	PyObject *revprops, *changes, *tuple;
+	PyGILState_STATE state = PyGILState_Ensure();
+
+	revprops = prop_hash_to_dict(rev_props);
+	CB_CHECK_PYRETVAL(revprops);
+	changes = pyify_changes(collector, pool);
+	if (changes == NULL) {
+		Py_DECREF(revprops);
+		PyGILState_Release(state);
+		return py_svn_error();
+	}
+	tuple = Py_BuildValue("lNN", revision, revprops, changes);
+	CB_CHECK_PYRETVAL(tuple);
+	PyGILState_Release(state);
+
+	return iter_queue_push(queue, tuple);
+}
+
+static void py_iter_replay(void *baton)
+{
+	struct iter_queue *queue = (struct iter_queue *)baton;
+	struct replay_args *args = (struct replay_args *)queue->baton;
+	svn_error_t *error;
+
+	error = svn_ra_replay_range(queue->ra->ra, args->start, args->end,
+			args->low_water_mark, args->send_deltas, py_iter_revstart_cb,
+			py_iter_revfinish_cb, queue, queue->pool);
+	iter_queue_finish(queue, error);
+}
+#endif
+
+PyObject *ra_iter_replay(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+	char *kwnames[] = { "start", "end", "low_water_mark", "send_deltas",
+		"max_queue_size", NULL };
+	svn_revnum_t start, end, low_water_mark;
+	bool send_deltas = false;
+	int max_queue_size = DEFAULT_ITER_QUEUE_SIZE;
+#if ONLY_SINCE_SVN(1, 5)
+	RemoteAccessObject *ra = (RemoteAccessObject *)self;
+	struct iter_queue *queue;
+	struct replay_args *replay_args;
+	apr_pool_t *pool;
+#endif
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "lll|bi:iter_replay",
+						 kwnames, &start, &end, &low_water_mark,
+						 &send_deltas, &max_queue_size))
+		return NULL;
+
+#if ONLY_SINCE_SVN(1, 5)
+	pool = Pool(NULL);
+	if (pool == NULL)
+		return NULL;
+
+	queue = iter_queue_new(ra, max_queue_size, pool);
+	if (queue == NULL)
+		return NULL;
+
+	replay_args = apr_pcalloc(pool, sizeof(struct replay_args));
+	replay_args->start = start;
+	replay_args->end = end;
+	replay_args->low_water_mark = low_water_mark;
+	replay_args->send_deltas = send_deltas;
+	queue->baton = replay_args;
+
+	if (ra_check_busy(ra)) {
+		iter_queue_unref(queue);
+		return NULL;
+	}
+
+	return iter_queue_start(queue, &ReplayIterator_Type, py_iter_replay);
+#else
+	PyErr_SetString(PyExc_NotImplementedError, 
+		"svn_ra_replay_range not available with Subversion 1.4");
+	return NULL;
+#endif
+}
@@ -0,0 +1,283 @@
+/*
+ * Copyright © 2010 Jelmer Vernooij <jelmer@samba.org>
+ * -*- coding: utf-8 -*-
+ *
+ * This program is free software; you can redistribute it and/or modify
+ * it under the terms of the GNU Lesser General Public License as published by
+ * the Free Software Foundation; either version 2.1 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+ */
+
+/* Bounded queue shared between an iterator and the thread that produces
+ * its items, as used by RemoteAccess.iter_log and iter_replay. */
+
+#include <pythread.h>
+#include <apr_thread_mutex.h>
+#include <apr_thread_cond.h>
+
+/* Number of items that are buffered by default before the producing
+ * thread waits for the consumer to catch up. */
+#define DEFAULT_ITER_QUEUE_SIZE 100
+
+struct queue_entry {
+	PyObject *item;
+	struct queue_entry *next;
+};
+
+/* State shared by an iterator and the thread that produces its items.
+ * It is freed by whichever of the two lets go of it last. */
+struct iter_queue {
+	apr_pool_t *pool;
+	RemoteAccessObject *ra;
+	/* Arguments for the producing thread, allocated in pool. */
+	void *baton;
+
+	/* The members below are protected by lock. */
+	apr_thread_mutex_t *lock;
+	apr_thread_cond_t *not_empty;
+	apr_thread_cond_t *not_full;
+	int refcount;
+	/* Set once the producing thread has finished and exc_type/exc_val
+	 * describe how. */
+	bool done;
+	/* Set when the iterator has gone away. */
+	bool cancelled;
+	PyObject *exc_type;
+	PyObject *exc_val;
+	int queue_size;
+	int max_queue_size;
+	struct queue_entry *head;
+	struct queue_entry *tail;
+};
+
+typedef struct {
+	PyObject_HEAD
+	struct iter_queue *queue;
+} QueueIteratorObject;
+
+/* Create a new queue, taking ownership of pool. The pool is destroyed by
+ * whichever thread finishes last, so it can not be a subpool of the
+ * (unsynchronized) connection pool. */
+static struct iter_queue *iter_queue_new(RemoteAccessObject *ra,
+										 int max_queue_size, apr_pool_t *pool)
+{
+	struct iter_queue *queue;
+	apr_status_t status;
+
+	queue = calloc(sizeof(struct iter_queue), 1);
+	if (queue == NULL) {
+		PyErr_NoMemory();
+		apr_pool_destroy(pool);
+		return NULL;
+	}
+
+	status = apr_thread_mutex_create(&queue->lock, APR_THREAD_MUTEX_DEFAULT,
+									 pool);
+	if (status == APR_SUCCESS)
+		status = apr_thread_cond_create(&queue->not_empty, pool);
+	if (status == APR_SUCCESS)
+		status = apr_thread_cond_create(&queue->not_full, pool);
+	if (status != APR_SUCCESS) {
+		PyErr_SetAprStatus(status);
+		free(queue);
+		apr_pool_destroy(pool);
+		return NULL;
+	}
+
+	queue->ra = ra;
+	Py_INCREF(queue->ra);
+	queue->pool = pool;
+	queue->max_queue_size = max_queue_size;
+	queue->refcount = 1;
+	return queue;
+}
+
+/* Release a reference to a queue. Must be called with the GIL held. */
+static void iter_queue_unref(struct iter_queue *queue)
+{
+	bool last;
+
+	apr_thread_mutex_lock(queue->lock);
+	last = (--queue->refcount == 0);
+	apr_thread_mutex_unlock(queue->lock);
+	if (!last)
+		return;
+
+	while (queue->head) {
+		struct queue_entry *e = queue->head;
+		Py_DECREF(e->item);
+		queue->head = e->next;
+		free(e);
+	}
+	Py_XDECREF(queue->exc_type);
+	Py_XDECREF(queue->exc_val);
+	Py_DECREF(queue->ra);
+	/* This also destroys the lock and condition variables. */
+	apr_pool_destroy(queue->pool);
+	free(queue);
+}
+
+/* Append an item to the queue, waiting for the consumer if the queue
+ * is full. Must be called without holding the GIL. Steals the reference
+ * to item. */
+static svn_error_t *iter_queue_push(struct iter_queue *queue, PyObject *item)
+{
+	struct queue_entry *entry;
+	PyGILState_STATE state;
+	svn_error_t *err;
+
+	entry = calloc(sizeof(struct queue_entry), 1);
+	if (entry == NULL) {
+		state = PyGILState_Ensure();
+		Py_DECREF(item);
+		PyErr_NoMemory();
+		err = py_svn_error();
+		PyGILState_Release(state);
+		return err;
+	}
+	entry->item = item;
+
+	apr_thread_mutex_lock(queue->lock);
+	while (queue->max_queue_size > 0 &&
+		   queue->queue_size >= queue->max_queue_size &&
+		   !queue->cancelled)
+		apr_thread_cond_wait(queue->not_full, queue->lock);
+	if (queue->cancelled) {
+		apr_thread_mutex_unlock(queue->lock);
+		state = PyGILState_Ensure();
+		Py_DECREF(item);
+		PyGILState_Release(state);
+		free(entry);
+		return svn_error_create(SVN_ERR_CANCELLED, NULL,
+								"Iterator was deallocated");
+	}
+	if (queue->tail == NULL) {
+		queue->head = entry;
+	} else {
+		queue->tail->next = entry;
+	}
+	queue->tail = entry;
+	queue->queue_size++;
+	apr_thread_cond_signal(queue->not_empty);
+	apr_thread_mutex_unlock(queue->lock);
+
+	return NULL;
+}
+
+/* Record how the producing thread finished and release its reference.
+ * Must be called without holding the GIL. Takes ownership of error. */
+static void iter_queue_finish(struct iter_queue *queue, svn_error_t *error)
+{
+	PyObject *exc_type, *exc_val;
+	PyGILState_STATE state;
+
+	state = PyGILState_Ensure();
+	if (error != NULL) {
+		exc_type = (PyObject *)PyErr_GetSubversionExceptionTypeObject();
+		exc_val  = PyErr_NewSubversionException(error);
+		svn_error_clear(error);
+	} else {
+		exc_type = PyExc_StopIteration;
+		Py_INCREF(exc_type);
+		exc_val = Py_None;
+		Py_INCREF(exc_val);
+	}
+	queue->ra->busy = false;
+
+	apr_thread_mutex_lock(queue->lock);
+	queue->exc_type = exc_type;
+	queue->exc_val = exc_val;
+	queue->done = true;
+	apr_thread_cond_broadcast(queue->not_empty);
+	apr_thread_mutex_unlock(queue->lock);
+
+	iter_queue_unref(queue);
+	PyGILState_Release(state);
+}
+
+/* Create an iterator of the given type for queue and start fn(queue) in a
+ * new thread. The connection should already have been marked busy; on
+ * failure it is marked idle again and the queue is released. */
+static PyObject *iter_queue_start(struct iter_queue *queue,
+								  PyTypeObject *type, void (*fn)(void *))
+{
+	QueueIteratorObject *ret;
+
+	ret = PyObject_New(QueueIteratorObject, type);
+	if (ret == NULL) {
+		queue->ra->busy = false;
+		iter_queue_unref(queue);
+		return NULL;
+	}
+	ret->queue = queue;
+
+	/* One reference for the iterator, one for the producing thread */
+	queue->refcount = 2;
+	if (PyThread_start_new_thread(fn, queue) == -1) {
+		PyErr_SetString(PyExc_RuntimeError,
+						"Unable to start thread");
+		queue->ra->busy = false;
+		queue->refcount = 1;
+		Py_DECREF(ret);
+		return NULL;
+	}
+
+	return (PyObject *)ret;
+}
+
+static void queue_iter_dealloc(PyObject *self)
+{
+	QueueIteratorObject *iter = (QueueIteratorObject *)self;
+	struct iter_queue *queue = iter->queue;
+
+	/* Let the producing thread know it can stop, in case it is still
+	 * running or waiting for room in the queue. */
+	apr_thread_mutex_lock(queue->lock);
+	queue->cancelled = true;
+	apr_thread_cond_signal(queue->not_full);
+	apr_thread_mutex_unlock(queue->lock);
+
+	iter_queue_unref(queue);
+	PyObject_Del(iter);
+}
+
+static PyObject *queue_iter_next(QueueIteratorObject *iter)
+{
+	struct iter_queue *queue = iter->queue;
+	struct queue_entry *first;
+	PyObject *ret;
+
+	Py_BEGIN_ALLOW_THREADS
+	apr_thread_mutex_lock(queue->lock);
+	while (queue->head == NULL && !queue->done)
+		apr_thread_cond_wait(queue->not_empty, queue->lock);
+	first = queue->head;
+	if (first != NULL) {
+		queue->head = first->next;
+		if (first == queue->tail)
+			queue->tail = NULL;
+		queue->queue_size--;
+		apr_thread_cond_signal(queue->not_full);
+	}
+	apr_thread_mutex_unlock(queue->lock);
+	Py_END_ALLOW_THREADS
+
+	if (first == NULL) {
+		/* Done, raise exception */
+		PyErr_SetObject(queue->exc_type, queue->exc_val);
+		return NULL;
+	}
+
+	ret = first->item;
+	free(first);
+	return ret;
+}
@@ -21,6 +21,7 @@ __docformat__ = "restructuredText"
 from hashlib import (
     md5,
     )
+import zlib
 
 
 TXDELTA_SOURCE = 0
@@ -32,6 +33,9 @@ MAX_ENCODED_INT_LEN = 10
 
 DELTA_WINDOW_SIZE = 102400
 
+# Size of the blocks that are matched when computing deltas
+MATCH_BLOCK_SIZE = 64
+
 def apply_txdelta_window(sbuf,
             (sview_offset, sview_len, tview_len, src_ops, ops, new_data)):
     """Apply a txdelta window to a buffer.
@@ -79,6 +83,32 @@ def apply_txdelta_handler(sbuf, target_stream):
     return apply_window
 
 
+def apply_txdelta_handler_file(source_file, target_stream):
+    """Return a function that can be called repeatedly with txdelta windows.
+
+    Rather than requiring the full source text in memory, the source view
+    of each window is read from source_file when it is needed, so memory
+    use is bounded by the window size.
+
+    :param source_file: Seekable file-like object (or mmap) with the
+        source text
+    :param target_stream: Target stream
+    """
+    def apply_window(window):
+        if window is None:
+            return # Last call
+        (sview_offset, sview_len, tview_len, src_ops, ops, new_data) = window
+        source_file.seek(sview_offset)
+        sview = source_file.read(sview_len)
+        if len(sview) != sview_len:
+            raise AssertionError("%d != %d" % (len(sview), sview_len))
+        tview = txdelta_apply_ops(src_ops, ops, new_data, sview)
+        if len(tview) != tview_len:
+            raise AssertionError("%d != %d" % (len(tview), tview_len))
+        target_stream.write(tview)
+    return apply_window
+
+
 def txdelta_apply_ops(src_ops, ops, new_data, sview):
     """Apply txdelta operations to a source view.
 
@@ -88,39 +118,185 @@ def txdelta_apply_ops(src_ops, ops, new_data, sview):
     :param sview: Source data
     :return: Result data
     """
-    tview = ""
+    tview_len = 0
     for (action, offset, length) in ops:
+        if offset < 0 or length < 0:
+            raise Exception("Invalid delta instruction")
+        tview_len += length
+    tview = bytearray(tview_len)
+    sview = memoryview(sview)
+    new_data = memoryview(new_data)
+    pos = 0
+    for (action, offset, length) in ops:
+        end = pos + length
         if action == TXDELTA_SOURCE:
             # Copy from source area.
-            tview += sview[offset:offset+length]
+            if offset + length > len(sview):
+                raise Exception("Invalid source view range")
+            tview[pos:end] = sview[offset:offset+length]
         elif action == TXDELTA_TARGET:
-            for i in xrange(length):
-                tview += tview[offset+i]
+            if offset >= pos:
+                raise Exception("Invalid target view offset")
+            # The range being copied may overlap with the range being
+            # written, in which case the data between offset and pos
+            # repeats. Copy in increasingly large blocks from a distance
+            # that is a multiple of the length of the repeated data.
+            period = pos - offset
+            while pos < end:
+                distance = ((pos - offset) // period) * period
+                n = min(end - pos, distance)
+                tview[pos:pos+n] = tview[pos-distance:pos-distance+n]
+                pos += n
         elif action == TXDELTA_NEW:
-            tview += new_data[offset:offset+length]
+            if offset + length > len(new_data):
+                raise Exception("Invalid new data range")
+            tview[pos:end] = new_data[offset:offset+length]
         else:
             raise Exception("Invalid delta instruction code")
-    return tview
+        pos = end
+    return str(tview)
 
 
-def send_stream(stream, handler, block_size=DELTA_WINDOW_SIZE):
+def send_stream(stream, handler, block_size=DELTA_WINDOW_SIZE,
+                source_stream=None):
     """Send txdelta windows that create stream to handler
 
     :param stream: file-like object to read the file from
     :param handler: txdelta window handler function
+    :param source_stream: Optional file-like object with the base text;
+        if specified, the windows will copy data from it where possible
+        rather than sending all data as new data.
     :return: MD5 hash over the stream
     """
     hash = md5()
+    offset = 0
     text = stream.read(block_size)
     while text != "":
         hash.update(text)
-        window = (0, 0, len(text), 0, [(TXDELTA_NEW, 0, len(text))], text)
+        if source_stream is None:
+            window = (0, 0, len(text), 0, [(TXDELTA_NEW, 0, len(text))], text)
+        else:
+            window = compute_txdelta_window(source_stream.read(block_size),
+                text, offset)
         handler(window)
+        offset += len(text)
         text = stream.read(block_size)
     handler(None)
     return hash.digest()
 
 
+def _block_sums(data, start, size):
+    """Compute the Adler-style sums over a block of a bytearray.
+
+    :return: Tuple with the sum of the bytes and the sum of the running
+        sums, both modulo 2**16
+    """
+    a = b = 0
+    for c in data[start:start+size]:
+        a += c
+        b += a
+    return (a & 0xffff, b & 0xffff)
+
+
+def _block_hash(data, start, size):
+    """Compute the Adler-style checksum of a block of a bytearray."""
+    (a, b) = _block_sums(data, start, size)
+    return (b << 16) | a
+
+
+def compute_txdelta_window(sview, tview, sview_offset=0,
+                           match_size=MATCH_BLOCK_SIZE):
+    """Compute a txdelta window that creates a target view from a source view.
+
+    Like the xdelta algorithm used by Subversion, the blocks of the source
+    view and of the part of the target view that has already been covered
+    are indexed by an Adler-style checksum. A rolling checksum is then
+    moved over the target view a byte at a time; blocks whose checksum and
+    contents match are extended as far as possible and turned into
+    TXDELTA_SOURCE or TXDELTA_TARGET copies. Data that could not be
+    matched is sent as new data.
+
+    :param sview: Source view
+    :param tview: Target view
+    :param sview_offset: Offset of the source view in the base text
+    :param match_size: Size of the blocks that are matched
+    :return: txdelta window
+    """
+    sbytes = bytearray(sview)
+    tbytes = bytearray(tview)
+    source_blocks = {}
+    for i in xrange(0, len(sview) - match_size + 1, match_size):
+        source_blocks.setdefault(_block_hash(sbytes, i, match_size), i)
+    target_blocks = {}
+    indexed = 0
+    ops = []
+    src_ops = 0
+    new_data = []
+    new_len = 0
+    pending = 0
+    pos = 0
+    tview_len = len(tview)
+    if tview_len >= match_size:
+        (a, b) = _block_sums(tbytes, 0, match_size)
+    while pos + match_size <= tview_len:
+        while indexed + match_size <= pos:
+            target_blocks.setdefault(_block_hash(tbytes, indexed, match_size),
+                indexed)
+            indexed += match_size
+        checksum = (b << 16) | a
+        block = None
+        start = source_blocks.get(checksum)
+        if start is not None:
+            block = tview[pos:pos+match_size]
+        if start is not None and sview[start:start+match_size] == block:
+            action = TXDELTA_SOURCE
+            view = sview
+        else:
+            start = target_blocks.get(checksum)
+            if start is not None and block is None:
+                block = tview[pos:pos+match_size]
+            if start is not None and tview[start:start+match_size] == block:
+                action = TXDELTA_TARGET
+                view = tview
+            else:
+                # Roll the checksum one byte forward
+                if pos + match_size < tview_len:
+                    out = tbytes[pos]
+                    a = (a - out + tbytes[pos+match_size]) & 0xffff
+                    b = (b - match_size * out + a) & 0xffff
+                pos += 1
+                continue
+        # Extend the match backwards over data that has not been sent yet
+        while pos > pending and start > 0 and view[start-1] == tview[pos-1]:
+            pos -= 1
+            start -= 1
+        # Extend the match forwards, a block at a time and then bytewise
+        length = match_size
+        while (pos + length + match_size <= tview_len and
+               view[start+length:start+length+match_size] ==
+               tview[pos+length:pos+length+match_size]):
+            length += match_size
+        while (pos + length < tview_len and start + length < len(view) and
+               view[start+length] == tview[pos+length]):
+            length += 1
+        if pos > pending:
+            ops.append((TXDELTA_NEW, new_len, pos - pending))
+            new_data.append(tview[pending:pos])
+            new_len += pos - pending
+        ops.append((action, start, length))
+        if action == TXDELTA_SOURCE:
+            src_ops += 1
+        pos += length
+        pending = pos
+        if pos + match_size <= tview_len:
+            (a, b) = _block_sums(tbytes, pos, match_size)
+    if pending < tview_len:
+        ops.append((TXDELTA_NEW, new_len, tview_len - pending))
+        new_data.append(tview[pending:])
+    return (sview_offset, len(sview), tview_len, src_ops, ops,
+            "".join(new_data))
+
+
 def encode_length(len):
     """Encode a length variable.
 
@@ -152,20 +328,32 @@ def encode_length(len):
     return ret
 
 
+def decode_length_at(text, offset):
+    """Decode a length variable at a specific offset.
+
+    :param text: Bytestring to decode
+    :param offset: Offset of the length variable in text
+    :return: Tuple with integer with actual length and offset of the first
+        byte after the length variable
+    :raise IndexError: if text ends before the length variable
+    """
+    ret = 0
+    while True:
+        c = ord(text[offset])
+        offset += 1
+        ret = ((ret << 7) | (c & 0x7f))
+        if not (c & 0x80):
+            return ret, offset
+
+
 def decode_length(text):
     """Decode a length variable.
 
     :param text: Bytestring to decode
     :return: Integer with actual length
     """
-    # Decode bytes until we're done.  */
-    ret = 0
-    next = True
-    while next:
-        ret = ((ret << 7) | (ord(text[0]) & 0x7f))
-        next = ((ord(text[0]) >> 7) & 0x1)
-        text = text[1:]
-    return ret, text
+    ret, offset = decode_length_at(text, 0)
+    return ret, text[offset:]
 
 
 def pack_svndiff_instruction((action, offset, length)):
@@ -185,41 +373,55 @@ def pack_svndiff_instruction((action, offset, length)):
     return text
 
 
-def unpack_svndiff_instruction(text):
-    """Unpack a SVN diff instruction
+def unpack_svndiff_instruction_at(text, offset):
+    """Unpack a SVN diff instruction at a specific offset.
 
     :param text: Text to parse
-    :return: tuple with operation, remaining text
+    :param offset: Offset of the instruction in text
+    :return: tuple with operation, offset of the first byte after the
+        instruction
     """
-    action = (ord(text[0]) >> 6)
-    length = (ord(text[0]) & 0x3f)
-    text = text[1:]
-    assert action in (TXDELTA_NEW, TXDELTA_SOURCE, TXDELTA_TARGET)
+    action = (ord(text[offset]) >> 6)
+    length = (ord(text[offset]) & 0x3f)
+    offset += 1
+    if action not in (TXDELTA_NEW, TXDELTA_SOURCE, TXDELTA_TARGET):
+        raise ValueError("Invalid svndiff instruction code %d" % action)
     if length == 0:
-        length, text = decode_length(text)
+        length, offset = decode_length_at(text, offset)
     if action != TXDELTA_NEW:
-        offset, text = decode_length(text)
+        op_offset, offset = decode_length_at(text, offset)
     else:
-        offset = 0
-    return (action, offset, length), text
+        op_offset = 0
+    return (action, op_offset, length), offset
+
+
+def unpack_svndiff_instruction(text):
+    """Unpack a SVN diff instruction
+
+    :param text: Text to parse
+    :return: tuple with operation, remaining text
+    """
+    op, offset = unpack_svndiff_instruction_at(text, 0)
+    return op, text[offset:]
 
 
 SVNDIFF0_HEADER = "SVN\0"
+SVNDIFF1_HEADER = "SVN\1"
 
-def pack_svndiff0_window(window):
-    """Pack an individual window using svndiff0.
+# Sections smaller than this are never compressed in svndiff1
+SVNDIFF1_MIN_COMPRESS_SIZE = 512
 
-    :param window: Window to pack
-    :return: Packed diff (as bytestring)
-    """
+SVNDIFF1_COMPRESSION_LEVEL = 5
+
+
+def _pack_svndiff_window(window, pack_section):
     (sview_offset, sview_len, tview_len, src_ops, ops, new_data) = window
     ret = [encode_length(sview_offset) + \
            encode_length(sview_len) + \
            encode_length(tview_len)]
 
-    instrdata = ""
-    for op in ops:
-        instrdata += pack_svndiff_instruction(op)
+    instrdata = pack_section("".join(map(pack_svndiff_instruction, ops)))
+    new_data = pack_section(new_data)
 
     ret.append(encode_length(len(instrdata)))
     ret.append(encode_length(len(new_data)))
@@ -228,18 +430,93 @@ def pack_svndiff0_window(window):
     return "".join(ret)
 
 
+def pack_svndiff0_window(window):
+    """Pack an individual window using svndiff0.
+
+    :param window: Window to pack
+    :return: Packed diff (as bytestring)
+    """
+    return _pack_svndiff_window(window, lambda section: section)
+
+
 def pack_svndiff0(windows):
     """Pack a SVN diff file.
 
     :param windows: Iterator over diff windows
     :return: text
     """
-    ret = SVNDIFF0_HEADER
+    ret = [SVNDIFF0_HEADER]
     for window in windows:
-        ret += pack_svndiff0_window(window)
+        ret.append(pack_svndiff0_window(window))
+    return "".join(ret)
+
+
+def pack_svndiff1_section(data, level=SVNDIFF1_COMPRESSION_LEVEL):
+    """Pack a section of a svndiff1 window.
+
+    :param data: Data to pack
+    :param level: zlib compression level
+    :return: Length of data followed by the data, zlib-compressed if that
+        makes it smaller
+    """
+    ret = encode_length(len(data))
+    if len(data) >= SVNDIFF1_MIN_COMPRESS_SIZE:
+        compressed = zlib.compress(data, level)
+        if len(compressed) < len(data):
+            return ret + compressed
+    return ret + data
+
+
+def unpack_svndiff1_section(data):
+    """Unpack a section of a svndiff1 window.
+
+    :param data: Packed section
+    :return: Original data
+    """
+    orig_len, offset = decode_length_at(data, 0)
+    if len(data) - offset == orig_len:
+        return data[offset:]
+    ret = zlib.decompress(data[offset:])
+    if len(ret) != orig_len:
+        raise ValueError("svndiff1 section has length %d, expected %d" % (
+            len(ret), orig_len))
     return ret
 
 
+def pack_svndiff1_window(window, level=SVNDIFF1_COMPRESSION_LEVEL):
+    """Pack an individual window using svndiff1.
+
+    :param window: Window to pack
+    :param level: zlib compression level
+    :return: Packed diff (as bytestring)
+    """
+    return _pack_svndiff_window(window,
+        lambda section: pack_svndiff1_section(section, level))
+
+
+def pack_svndiff1(windows, level=SVNDIFF1_COMPRESSION_LEVEL):
+    """Pack a SVN diff file using svndiff1.
+
+    :param windows: Iterator over diff windows
+    :param level: zlib compression level
+    :return: text
+    """
+    ret = [SVNDIFF1_HEADER]
+    for window in windows:
+        ret.append(pack_svndiff1_window(window, level))
+    return "".join(ret)
+
+
+def _unpack_svndiff(text, header):
+    if not text.startswith(header):
+        raise ValueError("Expected svndiff header %r, got %r" % (
+            header, text[:len(header)]))
+    decoder = SVNDiffDecoder()
+    for window in decoder.feed(text):
+        yield window
+    decoder.finish()
+
+
 def unpack_svndiff0(text):
     """Unpack a version 0 svndiff text.
     
@@ -247,25 +524,146 @@ def unpack_svndiff0(text):
     :return: yields tuples with sview_offset, sview_len, tview_len, ops_len, 
         ops, newdata
     """
-    assert text.startswith(SVNDIFF0_HEADER)
-    text = text[4:]
+    return _unpack_svndiff(text, SVNDIFF0_HEADER)
 
-    while text != "":
-        sview_offset, text = decode_length(text)
-        sview_len, text = decode_length(text)
-        tview_len, text = decode_length(text)
-        instr_len, text = decode_length(text)
-        newdata_len, text = decode_length(text)
 
-        instrdata = text[:instr_len]
-        text = text[instr_len:]
+def unpack_svndiff1(text):
+    """Unpack a version 1 svndiff text.
 
-        ops = []
-        while instrdata != "":
-            op, instrdata = unpack_svndiff_instruction(instrdata)
-            ops.append(op)
+    :param text: Text to unpack.
+    :return: yields tuples with sview_offset, sview_len, tview_len, ops_len,
+        ops, newdata
+    """
+    return _unpack_svndiff(text, SVNDIFF1_HEADER)
 
-        newdata = text[:newdata_len]
-        text = text[newdata_len:]
-        yield (sview_offset, sview_len, tview_len, len(ops), ops, newdata)
 
+def unpack_svndiff_stream(stream, block_size=DELTA_WINDOW_SIZE):
+    """Unpack svndiff data read from a file-like object.
+
+    Only the data for a single window is kept in memory at a time.
+
+    :param stream: File-like object to read svndiff data from
+    :param block_size: Number of bytes to read at a time
+    :return: yields tuples with sview_offset, sview_len, tview_len, ops_len,
+        ops, newdata
+    """
+    decoder = SVNDiffDecoder()
+    while True:
+        data = stream.read(block_size)
+        if data == "":
+            break
+        for window in decoder.feed(data):
+            yield window
+    decoder.finish()
+
+
+class SVNDiffDecoder(object):
+    """Incremental svndiff decoder.
+
+    Both svndiff0 and svndiff1 data are supported. Chunks of an svndiff
+    stream can be fed as they arrive; windows are returned as soon as they
+    are complete, so only data for the current window is kept in memory.
+    Data is parsed in place using offsets rather than by slicing off what
+    has been parsed.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        # Chunks that have been fed but not yet appended to _buf
+        self._pending = []
+        self._pending_len = 0
+        # Number of bytes that must be available before parsing can continue
+        self._needed = len(SVNDIFF0_HEADER)
+        self._seen_header = False
+        # svndiff format version, known once the header has been read
+        self.version = None
+        # Function that decodes the instructions and new data sections of
+        # a window
+        self._unpack_section = None
+
+    def feed(self, data):
+        """Feed a chunk of svndiff data.
+
+        :param data: Chunk of data, of arbitrary size
+        :return: List with the windows that were completed
+        """
+        self._pending.append(data)
+        self._pending_len += len(data)
+        if len(self._buf) - self._pos + self._pending_len < self._needed:
+            return []
+        self._buf = self._buf[self._pos:] + "".join(self._pending)
+        self._pos = 0
+        self._pending = []
+        self._pending_len = 0
+        if not self._seen_header:
+            header = self._buf[:len(SVNDIFF0_HEADER)]
+            if header == SVNDIFF0_HEADER:
+                self._unpack_section = lambda section: section
+            elif header == SVNDIFF1_HEADER:
+                self._unpack_section = unpack_svndiff1_section
+            else:
+                raise ValueError("Invalid svndiff header %r" % header)
+            self.version = ord(header[-1])
+            self._pos = len(header)
+            self._seen_header = True
+        windows = []
+        while True:
+            window = self._read_window()
+            if window is None:
+                break
+            windows.append(window)
+        return windows
+
+    def _read_window(self):
+        text = self._buf
+        offset = self._pos
+        try:
+            sview_offset, offset = decode_length_at(text, offset)
+            sview_len, offset = decode_length_at(text, offset)
+            tview_len, offset = decode_length_at(text, offset)
+            instr_len, offset = decode_length_at(text, offset)
+            newdata_len, offset = decode_length_at(text, offset)
+        except IndexError:
+            # Window header is incomplete
+            self._needed = len(text) - self._pos + 1
+            return None
+        end = offset + instr_len + newdata_len
+        if end > len(text):
+            self._needed = end - self._pos
+            return None
+        instr_end = offset + instr_len
+        instructions = self._unpack_section(text[offset:instr_end])
+        newdata = self._unpack_section(text[instr_end:end])
+        ops = []
+        # New data instructions don't encode an offset; they consume the
+        # new data in order.
+        new_offset = 0
+        offset = 0
+        while offset < len(instructions):
+            (action, op_offset, length), offset = \
+                unpack_svndiff_instruction_at(instructions, offset)
+            if action == TXDELTA_NEW:
+                op_offset = new_offset
+                new_offset += length
+            ops.append((action, op_offset, length))
+        self._pos = end
+        self._needed = 1
+        return (sview_offset, sview_len, tview_len, len(ops), ops, newdata)
+
+    def finish(self):
+        """Check that the stream did not end in the middle of a window."""
+        if (not self._seen_header or self._pending_len > 0 or
+            self._pos < len(self._buf)):
+            raise ValueError("svndiff data ended unexpectedly")
+
+
+# Pure Python implementations, which remain available for testing when
+# the C extension is used.
+_py_txdelta_apply_ops = txdelta_apply_ops
+_py_compute_txdelta_window = compute_txdelta_window
+
+try:
+    from subvertpy._delta import txdelta_apply_ops, compute_txdelta_window
+except ImportError:
+    pass
@@ -1070,11 +1070,52 @@ static svn_error_t *py_cb_editor_open_file(const char *path, void *parent_baton,
 	return NULL;
 }
 
-svn_error_t *py_txdelta_window_handler(svn_txdelta_window_t *window, void *baton)
+PyObject *pyify_txdelta_window(svn_txdelta_window_t *window)
 {
 	int i;
-	PyObject *ops, *ret;
-	PyObject *fn = (PyObject *)baton, *py_new_data, *py_window;
+	PyObject *ops, *py_new_data;
+
+	if (window == NULL) {
+		Py_RETURN_NONE;
+	}
+
+	ops = PyList_New(window->num_ops);
+	if (ops == NULL)
+		return NULL;
+	for (i = 0; i < window->num_ops; i++) {
+		PyObject *pyval = Py_BuildValue("(iII)", 
+										window->ops[i].action_code, 
+										window->ops[i].offset, 
+										window->ops[i].length);
+		if (pyval == NULL) {
+			Py_DECREF(ops);
+			return NULL;
+		}
+		PyList_SET_ITEM(ops, i, pyval);
+	}
+	if (window->new_data != NULL && window->new_data->data != NULL) {
+		py_new_data = PyString_FromStringAndSize(window->new_data->data,
+												 window->new_data->len);
+	} else {
+		py_new_data = Py_None;
+		Py_INCREF(py_new_data);
+	}
+	if (py_new_data == NULL) {
+		Py_DECREF(ops);
+		return NULL;
+	}
+
+	return Py_BuildValue("(LIIiNN)", 
+						 window->sview_offset, 
+						 window->sview_len, 
+						 window->tview_len, 
+						 window->src_ops, ops, py_new_data);
+}
+
+svn_error_t *py_txdelta_window_handler(svn_txdelta_window_t *window, void *baton)
+{
+	PyObject *ret;
+	PyObject *fn = (PyObject *)baton, *py_window;
 	PyGILState_STATE state;
 	if (fn == Py_None) {
 		/* User doesn't care about deltas */
@@ -1083,49 +1124,9 @@ svn_error_t *py_txdelta_window_handler(svn_txdelta_window_t *window, void *baton
 
 	state = PyGILState_Ensure();
 
-	if (window == NULL) {
-		py_window = Py_None;
-		Py_INCREF(py_window);
-	} else {
-		ops = PyList_New(window->num_ops);
-		if (ops == NULL) {
-			PyGILState_Release(state);
-			return NULL;
-		}
-		for (i = 0; i < window->num_ops; i++) {
-			PyObject *pyval = Py_BuildValue("(iII)", 
-											window->ops[i].action_code, 
-											window->ops[i].offset, 
-											window->ops[i].length);
-			CB_CHECK_PYRETVAL(pyval);
-			if (PyList_SetItem(ops, i, pyval) != 0) {
-				Py_DECREF(ops);
-				Py_DECREF(pyval);
-				PyGILState_Release(state);
-				return NULL;
-			}
-		}
-		if (window->new_data != NULL && window->new_data->data != NULL) {
-			py_new_data = PyString_FromStringAndSize(window->new_data->data,
-													 window->new_data->len);
-		} else {
-			py_new_data = Py_None;
-			Py_INCREF(py_new_data);
-		}
-		if (py_new_data == NULL) {
-			Py_DECREF(ops);
-			PyGILState_Release(state);
-			return NULL;
-		}
-
-		py_window = Py_BuildValue("((LIIiNN))", 
-								  window->sview_offset, 
-								  window->sview_len, 
-								  window->tview_len, 
-								  window->src_ops, ops, py_new_data);
-		CB_CHECK_PYRETVAL(py_window); /* FIXME: free ops and py_new_data */
-	}
-	ret = PyObject_CallFunction(fn, "O", py_window);
+	py_window = pyify_txdelta_window(window);
+	CB_CHECK_PYRETVAL(py_window);
+	ret = PyObject_CallFunction(fn, "(O)", py_window);
 	Py_DECREF(py_window);
 	if (window == NULL) {
 		/* Signals all delta windows have been received */
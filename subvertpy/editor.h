@@ -43,6 +43,7 @@ typedef struct {
 } TxDeltaWindowHandlerObject;
 
 svn_error_t *py_txdelta_window_handler(svn_txdelta_window_t *window, void *baton);
+PyObject *pyify_txdelta_window(svn_txdelta_window_t *window);
 
 #ifdef __GNUC__
 #pragma GCC visibility pop
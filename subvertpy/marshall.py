@@ -16,6 +16,9 @@
 
 """Marshalling for the svn_ra protocol."""
 
+import re
+
+
 class literal:
     """A protocol literal."""
 
@@ -43,6 +46,11 @@ class literal:
 #   space  = 1*(SP / LF)
 # 
 
+_whitespace = "\n "
+_number_re = re.compile("[0-9]+")
+_word_re = re.compile("[A-Za-z][A-Za-z0-9-]*")
+
+
 class MarshallError(Exception):
     """A Marshall error."""
 
@@ -76,66 +84,151 @@ def marshall(x):
     raise MarshallError("Unable to marshall type %s" % x)
 
 
+class Unmarshaller(object):
+    """Incremental parser for items in the svn_ra protocol.
+
+    Data can be fed in pieces of arbitrary size. The parser keeps track
+    of partially parsed lists and strings between calls, so data that has
+    been fed is never parsed more than once.
+    """
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        # Data that has been fed but not yet appended to _buf
+        self._pending = []
+        # Lists that are still being parsed, innermost last
+        self._stack = []
+        # Bytes still missing and pieces read so far of an incomplete string
+        self._strlen = None
+        self._strparts = []
+
+    def feed(self, data):
+        """Add more data to parse.
+
+        :param data: String with data
+        """
+        self._pending.append(data)
+
+    def _join_pending(self):
+        self._buf = self._buf[self._pos:] + "".join(self._pending)
+        self._pos = 0
+        self._pending = []
+
+    def remaining(self):
+        """Return the data that has not been parsed yet."""
+        self._join_pending()
+        return self._buf
+
+    def read_item(self):
+        """Parse the next item.
+
+        :return: Unpacked item
+        :raise NeedMoreData: if not enough data has been fed to parse a
+            complete item yet
+        """
+        if self._pending:
+            self._join_pending()
+        buf = self._buf
+        end = len(buf)
+        pos = self._pos
+        stack = self._stack
+        while True:
+            if self._strlen is not None:
+                chunk = buf[pos:pos+self._strlen]
+                pos += len(chunk)
+                self._strlen -= len(chunk)
+                self._strparts.append(chunk)
+                if self._strlen > 0:
+                    self._pos = pos
+                    raise NeedMoreData("Expected %d more bytes of string" %
+                        self._strlen)
+                ret = "".join(self._strparts)
+                self._strlen = None
+                self._strparts = []
+                if pos < end:
+                    if not buf[pos] in _whitespace:
+                        raise MarshallError("Expected whitespace, got '%c'" %
+                            buf[pos])
+                    pos += 1
+            else:
+                while pos < end and buf[pos] in _whitespace:
+                    pos += 1
+                self._pos = pos
+                if pos == end:
+                    raise NeedMoreData("Not enough data")
+                c = buf[pos]
+                if c == "(": # list follows
+                    if pos + 1 == end:
+                        raise NeedMoreData("Missing whitespace")
+                    if not buf[pos+1] in _whitespace:
+                        raise MarshallError(
+                            "missing whitespace after list start")
+                    pos += 2
+                    stack.append([])
+                    continue
+                elif c == ")":
+                    if not stack:
+                        raise MarshallError("Unexpected character ')'")
+                    if pos + 1 == end:
+                        raise NeedMoreData("Missing whitespace")
+                    if not buf[pos+1] in _whitespace:
+                        raise MarshallError("Expected space, got '%c'" %
+                            buf[pos+1])
+                    pos += 2
+                    ret = stack.pop()
+                elif c.isdigit():
+                    # Check if this is a string or a number
+                    m = _number_re.match(buf, pos)
+                    if m.end() == end:
+                        raise NeedMoreData("Expected whitespace or ':'")
+                    num = int(m.group(0))
+                    pos = m.end() + 1
+                    if buf[m.end()] == ":":
+                        self._strlen = num
+                        continue
+                    elif buf[m.end()] in _whitespace:
+                        ret = num
+                    else:
+                        raise MarshallError(
+                            "Expected whitespace or ':', got '%c'" %
+                            buf[m.end()])
+                elif c.isalpha():
+                    m = _word_re.match(buf, pos)
+                    if m.end() == end:
+                        raise NeedMoreData("Expected literal")
+                    if not buf[m.end()] in _whitespace:
+                        raise MarshallError("Expected whitespace, got '%c'" %
+                            buf[m.end()])
+                    pos = m.end() + 1
+                    ret = m.group(0)
+                else:
+                    raise MarshallError("Unexpected character '%c'" % c)
+            if stack:
+                stack[-1].append(ret)
+            else:
+                self._pos = pos
+                return ret
+
+
 def unmarshall(x):
     """Unmarshall the next item from a text.
 
     :param x: Text to parse
     :return: tuple with unpacked item and remaining text
     """
-    whitespace = ['\n', ' ']
-    if len(x) == 0:
-        raise NeedMoreData("Not enough data")
-    if x[0] == "(": # list follows
-        if len(x) <= 1:
-            raise NeedMoreData("Missing whitespace")
-        if x[1] != " ": 
-            raise MarshallError("missing whitespace after list start")
-        x = x[2:]
-        ret = []
-        try:
-            while x[0] != ")":
-                (x, n) = unmarshall(x)
-                ret.append(n)
-        except IndexError:
-            raise NeedMoreData("List not terminated")
-
-        if len(x) <= 1:
-            raise NeedMoreData("Missing whitespace")
-        
-        if not x[1] in whitespace:
-            raise MarshallError("Expected space, got '%c'" % x[1])
-
-        return (x[2:], ret)
-    elif x[0].isdigit():
-        num = ""
-        # Check if this is a string or a number
-        while x[0].isdigit():
-            num += x[0]
-            x = x[1:]
-        num = int(num)
-
-        if x[0] in whitespace:
-            return (x[1:], num)
-        elif x[0] == ":":
-            if len(x) < num:
-                raise NeedMoreData("Expected string of length %r" % num)
-            return (x[num+2:], x[1:num+1])
-        else:
-            raise MarshallError("Expected whitespace or ':', got '%c'" % x[0])
-    elif x[0].isalpha():
-        ret = ""
-        # Parse literal
-        try:
-            while x[0].isalpha() or x[0].isdigit() or x[0] == '-':
-                ret += x[0]
-                x = x[1:]
-        except IndexError:
-            raise NeedMoreData("Expected literal")
-
-        if not x[0] in whitespace:
-            raise MarshallError("Expected whitespace, got '%c'" % x[0])
-
-        return (x[1:], ret)
-    else:
-        raise MarshallError("Unexpected character '%c'" % x[0])
+    unmarshaller = Unmarshaller()
+    unmarshaller.feed(x)
+    ret = unmarshaller.read_item()
+    return (unmarshaller.remaining(), ret)
+
+
+# Pure Python implementations, which remain available for testing when
+# the C extension is used.
+_py_marshall = marshall
+_PyUnmarshaller = Unmarshaller
 
+try:
+    from subvertpy._marshall import marshall, Unmarshaller
+except ImportError:
+    pass
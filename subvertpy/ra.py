@@ -23,7 +23,10 @@ from subvertpy import _ra
 from subvertpy._ra import *
 from subvertpy import ra_svn
 
+import threading
+import time
 import urllib
+from contextlib import contextmanager
 
 url_handlers = {
         "svn": _ra.RemoteAccess,
@@ -45,3 +48,253 @@ def RemoteAccess(url, *args, **kwargs):
     if not type in url_handlers:
         raise SubversionException("Unknown URL type '%s'" % type, ERR_BAD_URL)
     return url_handlers[type](url, *args, **kwargs)
+
+
+class SessionPoolTimeout(Exception):
+    """No session became available in time."""
+
+
+def _url_host(url):
+    (type, opaque) = urllib.splittype(url)
+    (host, path) = urllib.splithost(opaque)
+    return (type, host)
+
+
+class SessionPool(object):
+    """Pool of sessions that can be shared between threads.
+
+    Idle sessions are kept per repository root, and retargeted with
+    reparent() when they are handed out for another URL in the same
+    repository.
+
+    :param open_session: Function that opens a new session for a URL;
+        RemoteAccess by default. Further keyword arguments are passed
+        on to it.
+    :param max_per_host: Maximum number of sessions per host, both idle
+        and in use
+    :param ttl: Number of seconds after which idle sessions are closed
+    :param check_interval: Sessions that have been idle for more than
+        this number of seconds are checked before they are handed out;
+        None to never check them
+    """
+
+    def __init__(self, open_session=None, max_per_host=4, ttl=300,
+                 check_interval=30, **session_kwargs):
+        if open_session is None:
+            open_session = RemoteAccess
+        self._open_session = open_session
+        self._session_kwargs = session_kwargs
+        self.max_per_host = max_per_host
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._cond = threading.Condition()
+        # Repository root -> list of (session, last use), most recent last
+        self._idle = {}
+        # Session -> [repository root, host, session URL]
+        self._sessions = {}
+        # Host -> number of sessions, including ones being opened
+        self._host_sessions = {}
+        # Sessions that have been forgotten but not closed yet
+        self._forgotten = []
+
+    def _find_root(self, url):
+        url = url.rstrip("/")
+        for root in self._idle:
+            if url == root or url.startswith(root + "/"):
+                return root
+        return None
+
+    def _forget(self, session):
+        """Stop tracking a session.
+
+        The session is closed by the next call to _close_forgotten(), which
+        should happen once the lock has been released.
+        """
+        (root, host, url) = self._sessions.pop(session)
+        self._host_sessions[host] -= 1
+        self._forgotten.append(session)
+        self._cond.notifyAll()
+
+    def _close_forgotten(self):
+        """Close forgotten sessions; must be called without the lock held.
+
+        Closing a session may block on the network, so this should not
+        stall other threads using the pool.
+        """
+        self._cond.acquire()
+        try:
+            forgotten = self._forgotten
+            self._forgotten = []
+        finally:
+            self._cond.release()
+        for session in forgotten:
+            # RemoteAccess sessions are closed once the last reference to
+            # them is gone; other session types may need to be closed
+            # explicitly.
+            close = getattr(session, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except Exception:
+                    # The session may already be broken, which is often
+                    # why it is being forgotten.
+                    pass
+
+    def _evict_expired(self, now):
+        for (root, idle) in self._idle.items():
+            while idle and idle[0][1] + self.ttl <= now:
+                self._forget(idle.pop(0)[0])
+
+    def _evict_host(self, host):
+        """Close the least recently used idle session for a host."""
+        oldest = None
+        for idle in self._idle.values():
+            if (idle and self._sessions[idle[0][0]][1] == host and
+                (oldest is None or idle[0][1] < oldest[0][1])):
+                oldest = idle
+        if oldest is None:
+            return False
+        self._forget(oldest.pop(0)[0])
+        return True
+
+    def _check(self, session):
+        try:
+            session.get_latest_revnum()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self, url, timeout=None):
+        """Obtain a session for a URL.
+
+        The session must be returned with release() after use.
+
+        :param url: URL the session should be opened at
+        :param timeout: Number of seconds to wait for a session to become
+            available if the host already has max_per_host sessions;
+            None to wait forever
+        :return: Session
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            session = None
+            self._cond.acquire()
+            try:
+                while True:
+                    now = time.time()
+                    self._evict_expired(now)
+                    root = self._find_root(url)
+                    if root is not None and self._idle[root]:
+                        (session, last_used) = self._idle[root].pop()
+                        session_url = self._sessions[session][2]
+                        break
+                    host = _url_host(url)
+                    if (self._host_sessions.get(host, 0) < self.max_per_host
+                        or self._evict_host(host)):
+                        self._host_sessions[host] = (
+                            self._host_sessions.get(host, 0) + 1)
+                        break
+                    if timeout is None:
+                        self._cond.wait()
+                    elif now >= deadline:
+                        raise SessionPoolTimeout(
+                            "No session available for %s" % url)
+                    else:
+                        self._cond.wait(deadline - now)
+            finally:
+                self._cond.release()
+                self._close_forgotten()
+            if session is None:
+                return self._open(url, host)
+            if (self.check_interval is not None and
+                last_used + self.check_interval <= now and
+                not self._check(session)):
+                self.release(session, discard=True)
+                continue
+            if session_url != url:
+                try:
+                    session.reparent(url)
+                except:
+                    self.release(session, discard=True)
+                    raise
+                self._cond.acquire()
+                try:
+                    self._sessions[session][2] = url
+                finally:
+                    self._cond.release()
+            return session
+
+    def _open(self, url, host):
+        try:
+            session = self._open_session(url, **self._session_kwargs)
+            root = session.get_repos_root().rstrip("/")
+        except:
+            self._cond.acquire()
+            try:
+                self._host_sessions[host] -= 1
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+            raise
+        self._cond.acquire()
+        try:
+            self._sessions[session] = [root, host, url]
+            self._idle.setdefault(root, [])
+        finally:
+            self._cond.release()
+        return session
+
+    def release(self, session, discard=False):
+        """Return a session to the pool.
+
+        :param session: Session obtained with acquire()
+        :param discard: Close the session rather than keeping it, e.g.
+            because it was left in an unusable state
+        """
+        self._cond.acquire()
+        try:
+            if discard:
+                self._forget(session)
+            else:
+                root = self._sessions[session][0]
+                self._idle[root].append((session, time.time()))
+                self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        self._close_forgotten()
+
+    @contextmanager
+    def session(self, url, timeout=None):
+        """Context manager that acquires and releases a session.
+
+        The session is discarded if the block raises an exception.
+        """
+        session = self.acquire(url, timeout)
+        try:
+            yield session
+        except:
+            self.release(session, discard=True)
+            raise
+        else:
+            self.release(session)
+
+    def evict_idle(self):
+        """Close idle sessions that have expired."""
+        self._cond.acquire()
+        try:
+            self._evict_expired(time.time())
+        finally:
+            self._cond.release()
+        self._close_forgotten()
+
+    def close(self):
+        """Close all idle sessions."""
+        self._cond.acquire()
+        try:
+            for idle in self._idle.values():
+                while idle:
+                    self._forget(idle.pop()[0])
+        finally:
+            self._cond.release()
+        self._close_forgotten()
@@ -17,15 +17,22 @@
 
 __author__ = "Jelmer Vernooij <jelmer@samba.org>"
 
+import Queue
 import SocketServer
 import base64
 import os
 import socket
 import subprocess
+import threading
+import time
 import urllib
 from errno import EPIPE
+from hashlib import md5
 
 from subvertpy import (
+    ERR_CHECKSUM_MISMATCH,
+    ERR_RA_SVN_CONNECTION_CLOSED,
+    ERR_RA_SVN_MALFORMED_DATA,
     ERR_RA_SVN_UNKNOWN_CMD,
     ERR_UNSUPPORTED_FEATURE,
     NODE_DIR,
@@ -36,15 +43,17 @@ from subvertpy import (
     properties,
     )
 from subvertpy.delta import (
+    SVNDiffDecoder,
     pack_svndiff0_window,
-    unpack_svndiff0,
+    pack_svndiff1_window,
     SVNDIFF0_HEADER,
+    SVNDIFF1_HEADER,
     )
 from subvertpy.marshall import (
     NeedMoreData,
+    Unmarshaller,
     literal,
     marshall,
-    unmarshall,
     )
 from subvertpy.ra import (
     DIRENT_CREATED_REV,
@@ -70,6 +79,10 @@ class SSHSubprocess(object):
     def send(self, data):
         return os.write(self.proc.stdin.fileno(), data)
 
+    def sendall(self, data):
+        while data:
+            data = data[self.send(data):]
+
     def recv(self, count):
         return os.read(self.proc.stdout.fileno(), count)
 
@@ -101,28 +114,142 @@ class SSHVendor(object):
 get_ssh_vendor = SSHVendor
 
 
+# Maximum number of bytes to read from the peer at once
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Number of bytes of outgoing messages to collect before sending them
+SEND_BUFFER_SIZE = 64 * 1024
+
+
 class SVNConnection(object):
+    """A connection speaking the svn protocol.
+
+    :param recv_fn: Function that takes a maximum number of bytes and returns
+        whatever data is available (up to that size), like socket.recv.
+        An empty string indicates the connection was closed.
+    :param send_fn: Function that sends a string to the peer.
+
+    Outgoing messages are buffered, and only sent once the connection
+    waits for data from the peer, once SEND_BUFFER_SIZE bytes have been
+    collected or when flush() is called. The number of bytes sent and the
+    number of times the buffer was flushed are available as bytes_sent and
+    flushes.
+
+    Per-command statistics can be collected by calling enable_stats().
+    """
 
     def __init__(self, recv_fn, send_fn):
-        self.inbuffer = ""
+        self._unmarshaller = Unmarshaller()
         self.recv_fn = recv_fn
         self.send_fn = send_fn
+        self._outbuffer = []
+        self._outbuffer_size = 0
+        self.bytes_sent = 0
+        self.flushes = 0
+        # svndiff version to use for textdeltas sent to the peer
+        self._svndiff_version = 0
+        self.command_stats = None
+        self._stats_callback = None
+        # Statistics for the command that is currently running
+        self._command = None
+
+    def enable_stats(self, callback=None):
+        """Start collecting statistics for each protocol command.
+
+        Afterwards, command_stats is a dictionary mapping command names
+        to dictionaries with the totals for all invocations of that
+        command: count, time (wall time in seconds), bytes_in, bytes_out,
+        messages_in, messages_out and unmarshall_time.
+
+        :param callback: Optional function that is called with the
+            statistics for a single command once it has finished; these
+            have the same keys, with "command" rather than "count".
+        """
+        if self.command_stats is None:
+            self.command_stats = {}
+        self._stats_callback = callback
+
+    def _begin_command(self, name):
+        if self.command_stats is None:
+            return
+        self._end_command()
+        self._command = {"command": name, "time": time.time(),
+            "bytes_in": 0, "bytes_out": 0, "messages_in": 0,
+            "messages_out": 0, "unmarshall_time": 0.0}
+
+    def _end_command(self):
+        command = self._command
+        if command is None:
+            return
+        self._command = None
+        command["time"] = time.time() - command["time"]
+        totals = self.command_stats.setdefault(command["command"],
+            {"count": 0, "time": 0.0, "bytes_in": 0, "bytes_out": 0,
+             "messages_in": 0, "messages_out": 0, "unmarshall_time": 0.0})
+        totals["count"] += 1
+        for key in totals:
+            if key != "count":
+                totals[key] += command[key]
+        if self._stats_callback is not None:
+            self._stats_callback(command)
+
+    def flush(self):
+        """Send any buffered messages to the peer."""
+        if not self._outbuffer:
+            return
+        data = "".join(self._outbuffer)
+        self._outbuffer = []
+        self._outbuffer_size = 0
+        self.bytes_sent += len(data)
+        self.flushes += 1
+        self.send_fn(data)
+
+    def _fill_buffer(self):
+        """Read the next block of data from the peer into the buffer."""
+        # The peer may be waiting for messages that are still buffered
+        self.flush()
+        newdata = self.recv_fn(RECV_BUFFER_SIZE)
+        if newdata == "":
+            raise SubversionException("Connection closed",
+                ERR_RA_SVN_CONNECTION_CLOSED)
+        #self.mutter("IN: %r" % newdata)
+        if self._command is not None:
+            self._command["bytes_in"] += len(newdata)
+        self._unmarshaller.feed(newdata)
 
     def recv_msg(self):
+        if self._command is not None:
+            return self._recv_msg_timed()
         while True:
             try:
-                (self.inbuffer, ret) = unmarshall(self.inbuffer)
-                return ret
+                return self._unmarshaller.read_item()
             except NeedMoreData:
-                newdata = self.recv_fn(1)
-                if newdata != "":
-                    #self.mutter("IN: %r" % newdata)
-                    self.inbuffer += newdata
+                self._fill_buffer()
+
+    def _recv_msg_timed(self):
+        command = self._command
+        while True:
+            start = time.time()
+            try:
+                msg = self._unmarshaller.read_item()
+            except NeedMoreData:
+                command["unmarshall_time"] += time.time() - start
+                self._fill_buffer()
+            else:
+                command["unmarshall_time"] += time.time() - start
+                command["messages_in"] += 1
+                return msg
 
     def send_msg(self, data):
         marshalled_data = marshall(data)
         # self.mutter("OUT: %r" % marshalled_data)
-        self.send_fn(marshalled_data)
+        if self._command is not None:
+            self._command["bytes_out"] += len(marshalled_data)
+            self._command["messages_out"] += 1
+        self._outbuffer.append(marshalled_data)
+        self._outbuffer_size += len(marshalled_data)
+        if self._outbuffer_size >= SEND_BUFFER_SIZE:
+            self.flush()
 
     def send_success(self, *contents):
         self.send_msg([literal("success"), list(contents)])
@@ -131,79 +258,113 @@ class SVNConnection(object):
 SVN_PORT = 3690
 
 
-def feed_editor(conn, editor):
-    tokens = {}
-    diff = {}
-    txdelta_handler = {}
-    # Process commands
-    while True:
-        command, args = conn.recv_msg()
+class EditorDriver(object):
+    """Drives an editor with editor commands received from the peer.
+
+    :param editor: Editor to drive
+    :param for_replay: Whether the edit is part of a replay, in which case
+        it is ended by finish-replay rather than by close-edit
+    """
+
+    def __init__(self, editor, for_replay=False):
+        self._editor = editor
+        self._for_replay = for_replay
+        self._tokens = {}
+        self._diff = {}
+        self._txdelta_handler = {}
+
+    def process(self, msg):
+        """Process a single editor command.
+
+        :param msg: Unmarshalled editor command
+        :return: Whether the edit has finished
+        """
+        command, args = msg
         if command == "target-rev":
-            editor.set_target_revision(args[0])
+            self._editor.set_target_revision(args[0])
         elif command == "open-root":
             if len(args[0]) == 0:
-                token = editor.open_root()
+                token = self._editor.open_root()
             else:
-                token = editor.open_root(args[0][0])
-            tokens[args[1]] = token
+                token = self._editor.open_root(args[0][0])
+            self._tokens[args[1]] = token
         elif command == "delete-entry":
-            tokens[args[2]].delete_entry(args[0], args[1])
+            self._tokens[args[2]].delete_entry(args[0], args[1])
         elif command == "add-dir":
             if len(args[3]) == 0:
-                token = tokens[args[1]].add_directory(args[0])
+                token = self._tokens[args[1]].add_directory(args[0])
             else:
-                token = tokens[args[1]].add_directory(args[0], args[3][0], args[4][0])
-            tokens[args[2]] = token
+                token = self._tokens[args[1]].add_directory(args[0], args[3][0], args[4][0])
+            self._tokens[args[2]] = token
         elif command == "open-dir":
-            tokens[args[2]] = tokens[args[1]].open_directory(args[0], args[3])
+            self._tokens[args[2]] = self._tokens[args[1]].open_directory(args[0], args[3])
         elif command == "change-dir-prop":
             if len(args[2]) == 0:
-                tokens[args[0]].change_prop(args[1], None)
+                self._tokens[args[0]].change_prop(args[1], None)
             else:
-                tokens[args[0]].change_prop(args[1], args[2][0])
+                self._tokens[args[0]].change_prop(args[1], args[2][0])
         elif command == "close-dir":
-            tokens[args[0]].close()
+            self._tokens[args[0]].close()
         elif command == "absent-dir":
-            tokens[args[1]].absent(args[0])
+            self._tokens[args[1]].absent(args[0])
         elif command == "add-file":
             if len(args[3]) == 0:
-                token = tokens[args[1]].add_file(args[0])
+                token = self._tokens[args[1]].add_file(args[0])
             else:
-                token = tokens[args[1]].add_file(args[0], args[3][0], args[4][0])
-            tokens[args[2]] = token
+                token = self._tokens[args[1]].add_file(args[0], args[3][0], args[4][0])
+            self._tokens[args[2]] = token
         elif command == "open-file":
-            tokens[args[2]] = tokens[args[1]].open_file(args[0], args[3])
+            self._tokens[args[2]] = self._tokens[args[1]].open_file(args[0], args[3])
         elif command == "apply-textdelta":
             if len(args[1]) == 0:
-                txdelta_handler[args[0]] = tokens[args[0]].apply_textdelta(None)
+                self._txdelta_handler[args[0]] = self._tokens[args[0]].apply_textdelta(None)
             else:
-                txdelta_handler[args[0]] = tokens[args[0]].apply_textdelta(args[1][0])
-            diff[args[0]] = ""
+                self._txdelta_handler[args[0]] = self._tokens[args[0]].apply_textdelta(args[1][0])
+            self._diff[args[0]] = SVNDiffDecoder()
         elif command == "textdelta-chunk":
-            diff[args[0]] += args[1]
+            # Pass on windows as soon as they are complete, rather than
+            # keeping the whole delta in memory.
+            for w in self._diff[args[0]].feed(args[1]):
+                self._txdelta_handler[args[0]](w)
         elif command == "textdelta-end":
-            for w in unpack_svndiff0(diff[args[0]]):
-                txdelta_handler[args[0]](w)
-            txdelta_handler[args[0]](None)
+            self._diff.pop(args[0]).finish()
+            self._txdelta_handler.pop(args[0])(None)
         elif command == "change-file-prop":
             if len(args[2]) == 0:
-                tokens[args[0]].change_prop(args[1], None)
+                self._tokens[args[0]].change_prop(args[1], None)
             else:
-                tokens[args[0]].change_prop(args[1], args[2][0])
+                self._tokens[args[0]].change_prop(args[1], args[2][0])
         elif command == "close-file":
             if len(args[1]) == 0:
-                tokens[args[0]].close()
+                self._tokens[args[0]].close()
             else:
-                tokens[args[0]].close(args[1][0])
+                self._tokens[args[0]].close(args[1][0])
         elif command == "close-edit":
-            editor.close()
-            break
+            self._editor.close()
+            return True
         elif command == "abort-edit":
-            editor.abort()
+            self._editor.abort()
+            return True
+        elif command == "finish-replay":
+            if not self._for_replay:
+                raise SubversionException(
+                    "Command 'finish-replay' invalid outside of replays",
+                    ERR_RA_SVN_UNKNOWN_CMD)
+            return True
+        return False
+
+
+def feed_editor(conn, editor, for_replay=False):
+    driver = EditorDriver(editor, for_replay)
+    # Process commands
+    while True:
+        msg = conn.recv_msg()
+        if driver.process(msg):
             break
-
-    conn.send_success()
-    conn._unpack()
+    if msg[0] != "finish-replay":
+        conn.send_success()
+    if not for_replay:
+        conn._unpack()
 
 
 class Reporter(object):
@@ -246,10 +407,13 @@ class Reporter(object):
         auth = self.conn.recv_msg()
         feed_editor(self.conn, self.editor)
         self.conn.busy = False
+        self.conn._end_command()
 
     def abort(self):
         self.conn.send_msg([literal("abort-report"), []])
+        self.conn.flush()
         self.conn.busy = False
+        self.conn._end_command()
 
 
 class Editor(object):
@@ -274,9 +438,11 @@ class Editor(object):
 
     def close(self):
         self.conn.send_msg([literal("close-edit"), []])
+        self.conn.flush()
 
     def abort(self):
         self.conn.send_msg([literal("abort-edit"), []])
+        self.conn.flush()
 
 
 class DirectoryEditor(object):
@@ -368,13 +534,19 @@ class FileEditor(object):
             base_check = []
         else:
             base_check = [base_checksum]
+        if self.conn._svndiff_version == 1:
+            header = SVNDIFF1_HEADER
+            pack_window = pack_svndiff1_window
+        else:
+            header = SVNDIFF0_HEADER
+            pack_window = pack_svndiff0_window
         self.conn.send_msg([literal("apply-textdelta"), [self.id, base_check]])
-        self.conn.send_msg([literal("textdelta-chunk"), [self.id, SVNDIFF0_HEADER]])
+        self.conn.send_msg([literal("textdelta-chunk"), [self.id, header]])
         def send_textdelta(delta):
             if delta is None:
                 self.conn.send_msg([literal("textdelta-end"), [self.id]])
             else:
-                self.conn.send_msg([literal("textdelta-chunk"), [self.id, pack_svndiff0_window(delta)]])
+                self.conn.send_msg([literal("textdelta-chunk"), [self.id, pack_window(delta)]])
         return send_textdelta
 
     def change_prop(self, name, value):
@@ -394,31 +566,254 @@ def mark_busy(unbound):
             ret = unbound(self, *args, **kwargs)
         finally:
             self.busy = False
+            self._end_command()
         return ret
 
     convert.__doc__ = unbound.__doc__
     convert.__name__ = unbound.__name__
     return convert
 
+def unmarshall_bool(value):
+    """Convert a boolean sent as the word "true" or "false"."""
+    return value in ("true", True)
+
+
 def unmarshall_dirent(d):
     ret = {
         "name": d[0],
         "kind": d[1],
         "size": d[2],
-        "has-props": bool(d[3]),
+        "has-props": unmarshall_bool(d[3]),
         "created-rev": d[4],
         }
     if d[5] != []:
-        ret["created-date"] = d[5]
+        ret["created-date"] = d[5][0]
     if d[6] != []:
-        ret["last-author"] = d[6]
+        ret["last-author"] = d[6][0]
     return ret
 
 
+def unmarshall_stat(ret):
+    """Convert the response to a stat command.
+
+    :return: Dirent, or None if the path does not exist
+    """
+    if len(ret) == 0:
+        return None
+    return unmarshall_dirent(ret[0])
+
+
+def _optional(value):
+    if value is None:
+        return []
+    return [value]
+
+
+def _unmarshall_optional(ret):
+    if len(ret) == 0:
+        return None
+    return ret[0]
+
+
+def unmarshall_node_kind(kind):
+    return {"dir": NODE_DIR, "file": NODE_FILE, "unknown": NODE_UNKNOWN,
+            "none": NODE_NONE}[kind]
+
+
+def unmarshall_log_entry(msg):
+    """Convert a log entry sent by the server.
+
+    :return: Tuple with changed paths, revision number, revision properties
+        and whether the revision has children (None if unknown)
+    """
+    paths = {}
+    for p, action, cfd in msg[0]:
+        if len(cfd) == 0:
+            paths[p] = (str(action), None, -1)
+        else:
+            paths[p] = (str(action), cfd[0], cfd[1])
+
+    if len(msg) > 5:
+        has_children = msg[5]
+    else:
+        has_children = None
+    revprops = {}
+    if len(msg[2]) != 0:
+        revprops[properties.PROP_REVISION_AUTHOR] = msg[2][0]
+    if len(msg[3]) != 0:
+        revprops[properties.PROP_REVISION_DATE] = msg[3][0]
+    if len(msg[4]) != 0:
+        revprops[properties.PROP_REVISION_LOG] = msg[4][0]
+    if len(msg) > 8:
+        revprops.update(dict(msg[8]))
+    return paths, msg[1], revprops, has_children
+
+
+def unmarshall_dir(ret):
+    """Convert the response to a get-dir command.
+
+    :return: Tuple with dirents, fetched revision and properties
+    """
+    fetch_rev = ret[0]
+    props = dict(ret[1])
+    dirents = {}
+    for d in ret[2]:
+        entry = unmarshall_dirent(d)
+        dirents[entry["name"]] = entry
+    return (dirents, fetch_rev, props)
+
+
+def parse_response(msg):
+    """Check the response to a command.
+
+    :param msg: Unmarshalled response
+    :return: Contents of the response, if it was successful
+    """
+    if msg[0] == "failure":
+        if isinstance(msg[1], str):
+            raise SubversionException(*msg[1])
+        num = msg[1][0][0]
+        msg = msg[1][0][1]
+        if num == ERR_RA_SVN_UNKNOWN_CMD:
+            raise NotImplementedError(msg)
+        raise SubversionException(msg, num)
+    assert msg[0] == "success", "Got: %r" % msg
+    assert len(msg) == 2
+    return msg[1]
+
+
+def _revnum_arg(revnum):
+    """Marshall an optional revision number; -1 and None mean HEAD."""
+    if revnum is None or revnum == -1:
+        return []
+    return [revnum]
+
+
+def _get_dir_args(path, revision, dirent_fields, want_props, want_contents):
+    args = [path, _revnum_arg(revision), want_props, want_contents]
+
+    fields = []
+    if dirent_fields & DIRENT_KIND:
+        fields.append(literal("kind"))
+    if dirent_fields & DIRENT_SIZE:
+        fields.append(literal("size"))
+    if dirent_fields & DIRENT_HAS_PROPS:
+        fields.append(literal("has-props"))
+    if dirent_fields & DIRENT_CREATED_REV:
+        fields.append(literal("created-rev"))
+    if dirent_fields & DIRENT_TIME:
+        fields.append(literal("time"))
+    if dirent_fields & DIRENT_LAST_AUTHOR:
+        fields.append(literal("last-author"))
+    args.append(fields)
+    return args
+
+
+def _log_args(paths, start, end, limit, discover_changed_paths,
+              strict_node_history, include_merged_revisions, revprops):
+    args = [paths, _revnum_arg(start), _revnum_arg(end),
+            discover_changed_paths, strict_node_history, limit,
+            include_merged_revisions]
+    if revprops is None:
+        args.append(literal("all-revprops"))
+        args.append([])
+    else:
+        args.append(literal("revprops"))
+        args.append(revprops)
+    return args
+
+
+class SVNBatch(object):
+    """Read-only commands that are sent to the server back to back.
+
+    Rather than waiting for the response to each command before sending
+    the next, all commands are written at once and the responses are read
+    afterwards, so a batch costs a single round trip. Command methods
+    return the batch itself so they can be chained, e.g.
+    client.batch().stat(p1).check_path(p2).execute().
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def _add(self, cmd, args, convert):
+        self._commands.append((cmd, args, convert))
+        return self
+
+    def get_latest_revnum(self):
+        return self._add("get-latest-rev", [], lambda ret: ret[0])
+
+    def check_path(self, path, revision=None):
+        return self._add("check-path", [path, _revnum_arg(revision)],
+            lambda ret: unmarshall_node_kind(ret[0]))
+
+    def stat(self, path, revision=-1):
+        return self._add("stat", [path, _revnum_arg(revision)],
+            unmarshall_stat)
+
+    def get_dir(self, path, revision=-1, dirent_fields=0, want_props=True,
+                want_contents=True):
+        return self._add("get-dir", _get_dir_args(path, revision,
+            dirent_fields, want_props, want_contents), unmarshall_dir)
+
+    def rev_proplist(self, revision):
+        return self._add("rev-proplist", [revision],
+            lambda ret: dict(ret[0]))
+
+    def rev_prop(self, revision, name):
+        return self._add("rev-prop", [revision, name], _unmarshall_optional)
+
+    def get_lock(self, path):
+        return self._add("get-lock", [path], _unmarshall_optional)
+
+    def execute(self):
+        """Send the commands and read their responses.
+
+        If any command fails, the responses to the other commands are
+        still read, after which the first error is raised.
+
+        :return: List with the result of each command, in order
+        """
+        client = self._client
+        commands = self._commands
+        self._commands = []
+        client.busy = True
+        # Statistics are kept for the batch as a whole
+        client._begin_command("batch")
+        try:
+            # The commands are buffered until the first response is read
+            for (cmd, args, convert) in commands:
+                client.send_msg([literal(cmd), args])
+            results = []
+            error = None
+            for (cmd, args, convert) in commands:
+                try:
+                    client._recv_ack()
+                    results.append(convert(client._unpack()))
+                except (SubversionException, NotImplementedError), e:
+                    if error is None:
+                        error = e
+                    results.append(None)
+        finally:
+            client.busy = False
+            client._end_command()
+        if error is not None:
+            raise error
+        return results
+
+
 class SVNClient(SVNConnection):
+    """Client for the svn protocol.
+
+    :param url: svn:// or svn+ssh:// URL to connect to
+    :param transport: Optional object with recv and sendall methods to use
+        rather than connecting to url, e.g. a connected socket
+    """
 
     def __init__(self, url, progress_cb=None, auth=None, config=None, 
-                 client_string_func=None, open_tmp_file_func=None):
+                 client_string_func=None, open_tmp_file_func=None,
+                 transport=None):
         self.url = url
         (type, opaque) = urllib.splittype(url)
         assert type in ("svn", "svn+ssh")
@@ -428,13 +823,17 @@ class SVNClient(SVNConnection):
         self._config = config
         self._client_string_func = client_string_func
         # open_tmp_file_func is ignored, as it is not needed for svn://
-        if type == "svn":
+        if transport is not None:
+            (recv_func, send_func) = (transport.recv, transport.sendall)
+        elif type == "svn":
             (recv_func, send_func) = self._connect(host)
         else:
             (recv_func, send_func) = self._connect_ssh(host)
         super(SVNClient, self).__init__(recv_func, send_func)
         (min_version, max_version, _, self._server_capabilities) = self._recv_greeting()
         self.send_msg([max_version, [literal(x) for x in CAPABILITIES if x in self._server_capabilities], self.url])
+        if "svndiff1" in self._server_capabilities:
+            self._svndiff_version = 1
         (self._server_mechanisms, mech_arg) = self._unpack()
         if self._server_mechanisms != []:
             # FIXME: Support other mechanisms as well
@@ -447,18 +846,11 @@ class SVNClient(SVNConnection):
         self.busy = False
 
     def _unpack(self):
-        msg = self.recv_msg()
-        if msg[0] == "failure":
-            if isinstance(msg[1], str):
-                raise SubversionException(*msg[1])
-            num = msg[1][0][0]
-            msg = msg[1][0][1]
-            if num == ERR_RA_SVN_UNKNOWN_CMD:
-                raise NotImplementedError(msg)
-            raise SubversionException(msg, num)
-        assert msg[0] == "success", "Got: %r" % msg
-        assert len(msg) == 2
-        return msg[1]
+        return parse_response(self.recv_msg())
+
+    def _send_command(self, name, args):
+        self._begin_command(name)
+        self.send_msg([literal(name), args])
 
     def _recv_greeting(self):
         greeting = self._unpack()
@@ -485,7 +877,7 @@ class SVNClient(SVNConnection):
         if self._socket is None:
             raise err
         self._socket.setblocking(True)
-        return (self._socket.recv, self._socket.send)
+        return (self._socket.recv, self._socket.sendall)
 
     def _connect_ssh(self, host):
         (user, host) = urllib.splituser(host)
@@ -495,14 +887,14 @@ class SVNClient(SVNConnection):
             password = None
         (host, port) = urllib.splitnport(host, 22)
         self._tunnel = get_ssh_vendor().connect_ssh(user, password, host, port, ["svnserve", "-t"])
-        return (self._tunnel.recv, self._tunnel.send)
+        return (self._tunnel.recv, self._tunnel.sendall)
 
     def get_file_revs(self, path, start, end, file_rev_handler):
         raise NotImplementedError(self.get_file_revs)
 
     @mark_busy
     def get_locations(self, path, peg_revision, location_revisions):
-        self.send_msg([literal("get-locations"), [path, peg_revision, location_revisions]])
+        self._send_command("get-locations", [path, peg_revision, location_revisions])
         self._recv_ack()
         ret = {}
         while True:
@@ -513,8 +905,9 @@ class SVNClient(SVNConnection):
         self._unparse()
         return ret
 
+    @mark_busy
     def get_locks(self, path):
-        self.send_msg([literal("get-lock"), [path]])
+        self._send_command("get-lock", [path])
         self._recv_ack()
         return self._unpack()
 
@@ -539,7 +932,7 @@ class SVNClient(SVNConnection):
         else:
             args.append([end_revision])
         args.append(include_merged_revisions)
-        self.send_msg([literal("get-location-segments"), args])
+        self._send_command("get-location-segments", args)
         self._recv_ack()
         while True:
             msg = self.recv_msg()
@@ -547,6 +940,7 @@ class SVNClient(SVNConnection):
                 break
             yield msg
         self._unpack()
+        self._end_command()
 
     def get_location_segments(self, path, start_revision, end_revision, rcvr):
         for msg in self.location_segments(path, start_revision, end_revision):
@@ -557,18 +951,13 @@ class SVNClient(SVNConnection):
 
     @mark_busy
     def check_path(self, path, revision=None):
-        args = [path]
-        if revision is None or revision == -1:
-            args.append([])
-        else:
-            args.append([revision])
-        self.send_msg([literal("check-path"), args])
+        self._send_command("check-path", [path, _revnum_arg(revision)])
         self._recv_ack()
-        ret = self._unpack()[0]
-        return {"dir": NODE_DIR, "file": NODE_FILE, "unknown": NODE_UNKNOWN, "none": NODE_NONE}[ret]
+        return unmarshall_node_kind(self._unpack()[0])
 
+    @mark_busy
     def get_lock(self, path):
-        self.send_msg([literal("get-lock"), [path]])
+        self._send_command("get-lock", [path])
         self._recv_ack()
         ret = self._unpack()
         if len(ret) == 0:
@@ -578,65 +967,58 @@ class SVNClient(SVNConnection):
 
     @mark_busy
     def get_dir(self, path, revision=-1, dirent_fields=0, want_props=True, want_contents=True):
-        args = [path]
-        if revision is None or revision == -1:
-            args.append([])
-        else:
-            args.append([revision])
-        
-        args += [want_props, want_contents]
-
-        fields = []
-        if dirent_fields & DIRENT_KIND:
-            fields.append(literal("kind"))
-        if dirent_fields & DIRENT_SIZE:
-            fields.append(literal("size"))
-        if dirent_fields & DIRENT_HAS_PROPS:
-            fields.append(literal("has-props"))
-        if dirent_fields & DIRENT_CREATED_REV:
-            fields.append(literal("created-rev"))
-        if dirent_fields & DIRENT_TIME:
-            fields.append(literal("time"))
-        if dirent_fields & DIRENT_LAST_AUTHOR:
-            fields.append(literal("last-author"))
-        args.append(fields)
-
-        self.send_msg([literal("get-dir"), args])
+        self._send_command("get-dir", _get_dir_args(path, revision,
+            dirent_fields, want_props, want_contents))
         self._recv_ack()
-        ret = self._unpack()
-        fetch_rev = ret[0]
-        props = dict(ret[1])
-        dirents = {}
-        for d in ret[2]:
-            entry = unmarshall_dirent(d)
-            dirents[entry["name"]] = entry
-
-        return (dirents, fetch_rev, props)
+        return unmarshall_dir(self._unpack())
 
     @mark_busy
     def stat(self, path, revision=-1):
-        args = [path]
-        if revision is None or revision == -1:
-            args.append([revision])
-        else:
-            args.append([])
-
-        self.send_msg([literal("stat"), args])
+        self._send_command("stat", [path, _revnum_arg(revision)])
         self._recv_ack()
-        ret = self._unpack()
-        if len(ret) == 0:
-            return None
-        return unmarshall_dirent(ret[0])
+        return unmarshall_stat(self._unpack())
 
     @mark_busy
-    def get_file(self, path, stream, revision=-1):
-        raise NotImplementedError(self.get_file)
+    def get_file(self, path, stream, revision=-1, verify_checksum=False):
+        """Retrieve a file.
+
+        The contents are written to stream as they arrive.
+
+        :param path: Path of the file, relative to the session URL
+        :param stream: File-like object to write the contents to
+        :param revision: Revision to retrieve; -1 or None for HEAD
+        :param verify_checksum: Whether to check the MD5 checksum sent by
+            the server against the received contents
+        :return: Tuple with fetched revision number and properties
+        """
+        self._send_command("get-file",
+            [path, _revnum_arg(revision), True, True])
+        self._recv_ack()
+        (checksum, fetch_rev, props) = self._unpack()[:3]
+        if verify_checksum and checksum:
+            hash = md5()
+        else:
+            hash = None
+        while True:
+            data = self.recv_msg()
+            if data == "":
+                break
+            if hash is not None:
+                hash.update(data)
+            stream.write(data)
+        self._unpack()
+        if hash is not None and hash.hexdigest() != checksum[0]:
+            raise SubversionException(
+                "Checksum mismatch for '%s': expected %s, got %s" % (
+                path, checksum[0], hash.hexdigest()), ERR_CHECKSUM_MISMATCH)
+        return (fetch_rev, dict(props))
 
+    @mark_busy
     def change_rev_prop(self, rev, name, value):
         args = [rev, name]
         if value is not None:
             args.append(value)
-        self.send_msg([literal("change-rev-prop"), args])
+        self._send_command("change-rev-prop", args)
         self._recv_ack()
         self._unparse()
 
@@ -650,42 +1032,70 @@ class SVNClient(SVNConnection):
         args.append(keep_locks)
         if len(revprops) > 1:
             args.append(revprops.items())
-        self.send_msg([literal("commit"), args])
+        self._send_command("commit", args)
         self._recv_ack()
         raise NotImplementedError(self.get_commit_editor)
 
+    @mark_busy
     def rev_proplist(self, revision):
-        self.send_msg([literal("rev-proplist"), [revision]])
+        self._send_command("rev-proplist", [revision])
         self._recv_ack()
         return dict(self._unpack()[0])
 
+    @mark_busy
     def rev_prop(self, revision, name):
-        self.send_msg([literal("rev-prop"), [revision, name]])
+        self._send_command("rev-prop", [revision, name])
         self._recv_ack()
-        ret = self._unpack()
-        if len(ret) == 0:
-            return None
-        else:
-            return ret[0]
+        return _unmarshall_optional(self._unpack())
+
+    def batch(self):
+        """Start a batch of read-only commands.
+
+        :return: SVNBatch; commands are only sent once its execute()
+            method is called
+        """
+        return SVNBatch(self)
 
     @mark_busy
     def replay(self, revision, low_water_mark, update_editor, send_deltas=True):
-        self.send_msg([literal("replay"), [revision, low_water_mark, send_deltas]])
+        self._send_command("replay", [revision, low_water_mark, send_deltas])
         self._recv_ack()
-        feed_editor(self, update_editor)
+        feed_editor(self, update_editor, for_replay=True)
         self._unpack()
 
     @mark_busy
     def replay_range(self, start_revision, end_revision, low_water_mark, cbs, 
                      send_deltas=True):
-        self.send_msg([literal("replay-range"), [start_revision, end_revision, low_water_mark, send_deltas]])
-        self._recv_ack()
+        """Replay a range of revisions.
+
+        The server streams all revisions without waiting for the client.
+
+        :param cbs: Tuple with a function that is called with the revision
+            number and revision properties before each revision and returns
+            the editor to drive, and a function that is called with the
+            revision number, revision properties and editor afterwards
+        """
+        self._send_command("replay-range", [start_revision, end_revision, low_water_mark, send_deltas])
+        try:
+            self._recv_ack()
+        except NotImplementedError:
+            # Older servers only support replaying a single revision
+            self.busy = False
+            for i in range(start_revision, end_revision+1):
+                revprops = self.rev_proplist(i)
+                edit = cbs[0](i, revprops)
+                self.replay(i, low_water_mark, edit, send_deltas)
+                cbs[1](i, revprops, edit)
+            return
         for i in range(start_revision, end_revision+1):
             msg = self.recv_msg()
-            assert msg[0] == "revprops"
-            edit = cbs[0](i, dict(msg[1]))
-            feed_editor(self, edit)
-            cbs[1](i, dict(msg[1]), edit)
+            if msg[0] != "revprops":
+                raise SubversionException("Expected revprops, got %r" % msg[0],
+                    ERR_RA_SVN_MALFORMED_DATA)
+            revprops = dict(msg[1])
+            edit = cbs[0](i, revprops)
+            feed_editor(self, edit, for_replay=True)
+            cbs[1](i, revprops, edit)
         self._unpack()
 
     def do_switch(self, revision_to_update_to, update_target, recurse, 
@@ -703,11 +1113,12 @@ class SVNClient(SVNConnection):
 
         self.busy = True
         try:
-            self.send_msg([literal("switch"), args])
+            self._send_command("switch", args)
             self._recv_ack()
             return Reporter(self, update_editor)
         except:
             self.busy = False
+            self._end_command()
             raise
 
     def do_update(self, revision_to_update_to, update_target, recurse, 
@@ -724,11 +1135,12 @@ class SVNClient(SVNConnection):
 
         self.busy = True
         try:
-            self.send_msg([literal("update"), args])
+            self._send_command("update", args)
             self._recv_ack()
             return Reporter(self, update_editor)
         except:
             self.busy = False
+            self._end_command()
             raise
 
     def do_diff(self, revision_to_update, diff_target, versus_url, diff_editor,
@@ -743,11 +1155,12 @@ class SVNClient(SVNConnection):
             args.append(literal(depth))
         self.busy = True
         try:
-            self.send_msg([literal("diff"), args])
+            self._send_command("diff", args)
             self._recv_ack()
             return Reporter(self, diff_editor)
         except:
             self.busy = False
+            self._end_command()
             raise
 
     def get_repos_root(self):
@@ -755,19 +1168,19 @@ class SVNClient(SVNConnection):
 
     @mark_busy
     def get_latest_revnum(self):
-        self.send_msg([literal("get-latest-rev"), []])
+        self._send_command("get-latest-rev", [])
         self._recv_ack()
         return self._unpack()[0]
 
     @mark_busy
     def get_dated_rev(self, date):
-        self.send_msg([literal("get-dated-rev"), [date]])
+        self._send_command("get-dated-rev", [date])
         self._recv_ack()
         return self._unpack()[0]
 
     @mark_busy
     def reparent(self, url):
-        self.send_msg([literal("reparent"), [url]])
+        self._send_command("reparent", [url])
         self._recv_ack()
         self._unpack()
         self.url = url
@@ -779,59 +1192,18 @@ class SVNClient(SVNConnection):
     def log(self, paths, start, end, limit=0, 
                 discover_changed_paths=True, strict_node_history=True, 
                 include_merged_revisions=True, revprops=None):
-        args = [paths]
-        if start is None or start == -1:
-            args.append([])
-        else:
-            args.append([start])
-        if end is None or end == -1:
-            args.append([])
-        else:
-            args.append([end])
-        args.append(discover_changed_paths)
-        args.append(strict_node_history)
-        args.append(limit)
-        args.append(include_merged_revisions)
-        if revprops is None:
-            args.append(literal("all-revprops"))
-            args.append([])
-        else:
-            args.append(literal("revprops"))
-            args.append(revprops)
-
-        self.send_msg([literal("log"), args])
+        self._send_command("log", _log_args(paths, start, end, limit,
+            discover_changed_paths, strict_node_history,
+            include_merged_revisions, revprops))
         self._recv_ack()
         while True:
             msg = self.recv_msg()
             if msg == "done":
                 break
-            paths = {}
-            for p, action, cfd in msg[0]:
-                if len(cfd) == 0:
-                    paths[p] = (str(action), None, -1)
-                else:
-                    paths[p] = (str(action), cfd[0], cfd[1])
-
-            if len(msg) > 5:
-                has_children = msg[5]
-            else:
-                has_children = None
-            if len(msg) > 6 and msg[6]:
-                revno = None
-            else:
-                revno = msg[1]
-            revprops = {}
-            if len(msg[2]) != 0:
-                revprops[properties.PROP_REVISION_AUTHOR] = msg[2][0]
-            if len(msg[3]) != 0:
-                revprops[properties.PROP_REVISION_DATE] = msg[3][0]
-            if len(msg[4]) != 0:
-                revprops[properties.PROP_REVISION_LOG] = msg[4][0]
-            if len(msg) > 8:
-                revprops.update(dict(msg[8]))
-            yield paths, msg[1], revprops, has_children
+            yield unmarshall_log_entry(msg)
 
         self._unpack()
+        self._end_command()
 
     def get_log(self, callback, *args, **kwargs):
         for (paths, rev, props, has_children) in self.log(*args, **kwargs):
@@ -843,7 +1215,7 @@ class SVNClient(SVNConnection):
 
 MIN_VERSION = 2
 MAX_VERSION = 2
-CAPABILITIES = ["edit-pipeline", "bazaar", "log-revprops"]
+CAPABILITIES = ["edit-pipeline", "bazaar", "log-revprops", "svndiff1"]
 MECHANISMS = ["ANONYMOUS"]
 
 
@@ -900,7 +1272,8 @@ class SVNServer(SVNConnection):
                         changes.append((p, literal(action), (cf, cr)))
                     else:
                         changes.append((p, literal(action), ()))
-            self.send_msg([changes, revno, [author], [date], [message]])
+            self.send_msg([changes, revno, _optional(author),
+                           _optional(date), _optional(message)])
         self.send_ack()
         if len(start_rev) == 0:
             start_revnum = None
@@ -910,13 +1283,17 @@ class SVNServer(SVNConnection):
             end_revnum = None
         else:
             end_revnum = end_rev[0]
-        self.repo_backend.log(send_revision, target_path, start_revnum, 
-                              end_revnum, changed_paths, strict_node, limit)
-        self.send_msg(literal("done"))
+        try:
+            self.repo_backend.log(send_revision, target_path, start_revnum,
+                end_revnum, unmarshall_bool(changed_paths),
+                unmarshall_bool(strict_node), limit)
+        finally:
+            self.send_msg(literal("done"))
         self.send_success()
 
     def open_backend(self, url):
-        (rooturl, location) = urllib.splithost(url)
+        (type, opaque) = urllib.splittype(url)
+        (host, location) = urllib.splithost(opaque)
         self.repo_backend, self.relpath = self.backend.open_repository(location)
 
     def reparent(self, parent):
@@ -932,9 +1309,9 @@ class SVNServer(SVNConnection):
         self.send_ack()
         dirent = self.repo_backend.stat(path, revnum)
         if dirent is None:
-            self.send_success([])
+            self.send_success()
         else:
-            args = [dirent["name"], dirent["kind"], dirent["size"],
+            args = [dirent["name"], literal(dirent["kind"]), dirent["size"],
                           dirent["has-props"], dirent["created-rev"]]
             if "created-date" in dirent:
                 args.append([dirent["created-date"]])
@@ -944,7 +1321,7 @@ class SVNServer(SVNConnection):
                 args.append([dirent["last-author"]])
             else:
                 args.append([])
-            self.send_success([args])
+            self.send_success(args)
 
     def commit(self, logmsg, locks, keep_locks=False, rev_props=None):
         self.send_failure([ERR_UNSUPPORTED_FEATURE, 
@@ -973,11 +1350,13 @@ class SVNServer(SVNConnection):
 
     def update(self, rev, target, recurse, depth=None, send_copyfrom_param=True):
         self.send_ack()
+        report = []
         while True:
             msg = self.recv_msg()
             assert msg[0] in ["set-path", "finish-report"]
             if msg[0] == "finish-report":
                 break
+            report.append(msg[1])
 
         self.send_ack()
 
@@ -985,7 +1364,16 @@ class SVNServer(SVNConnection):
             revnum = None
         else:
             revnum = rev[0]
-        self.repo_backend.update(Editor(self), revnum, target, recurse)
+        # Changes can be sent relative to the client's tree if all of it
+        # is at the same revision. Anything else, such as a working copy
+        # with mixed revisions, gets the full tree.
+        if (len(report) == 1 and report[0][0] == "" and
+            not unmarshall_bool(report[0][2])):
+            base_revnum = report[0][1]
+        else:
+            base_revnum = None
+        self.repo_backend.update(Editor(self), revnum, target,
+                                 unmarshall_bool(recurse), base_revnum)
         self.send_success()
         client_result = self.recv_msg()
         if client_result[0] == "success":
@@ -1020,7 +1408,11 @@ class SVNServer(SVNConnection):
     def send_auth_request(self):
         pass
 
-    def serve(self):
+    def handshake(self):
+        """Greet the client, authenticate it and open the repository.
+
+        :return: Whether the connection should be kept open
+        """
         self.send_greeting()
         msg = self.recv_msg()
         version = msg[0]
@@ -1033,6 +1425,8 @@ class SVNServer(SVNConnection):
         self.capabilities = capabilities
         self.version = version
         self.url = url
+        if "svndiff1" in capabilities:
+            self._svndiff_version = 1
         self.mutter("client supports:")
         self.mutter("  version %r" % version)
         self.mutter("  capabilities %r " % capabilities)
@@ -1042,18 +1436,56 @@ class SVNServer(SVNConnection):
         # TODO: Proper authentication
         self.send_success()
 
-        self.open_backend(url)
-        self.send_success(self.repo_backend.get_uuid(), url)
-
-        # Expect:
-        while not self._stop:
-            ( cmd, args ) = self.recv_msg()
-            if cmd not in self.commands:
-                self.mutter("client used unknown command %r" % cmd)
-                self.send_unknown(cmd)
-                return
-            else:
+        try:
+            self.open_backend(url)
+        except SubversionException, e:
+            self.send_failure([e.args[1], e.args[0], __file__, 0])
+            return False
+        self.send_success(self.repo_backend.get_uuid(), self.repos_root_url())
+        return True
+
+    def repos_root_url(self):
+        """Return the URL of the root of the repository that was opened.
+
+        This is the URL the client connected to, with the path of the
+        session inside the repository stripped.
+        """
+        url = self.url.rstrip("/")
+        relpath = self.relpath.strip("/")
+        if relpath:
+            url = url.rsplit("/", relpath.count("/") + 1)[0]
+        return url
+
+    def run_command(self, msg):
+        """Run a single command received from the client.
+
+        :param msg: Unmarshalled command
+        :return: Whether further commands should be read from the client
+        """
+        ( cmd, args ) = msg
+        if cmd not in self.commands:
+            self.mutter("client used unknown command %r" % cmd)
+            self.send_unknown(cmd)
+            return False
+        self._begin_command(cmd)
+        try:
+            try:
                 self.commands[cmd](self, *args)
+            except SubversionException, e:
+                if e.args[1] == ERR_RA_SVN_CONNECTION_CLOSED:
+                    raise
+                self.mutter("command %r failed: %s" % (cmd, e.args[0]))
+                self.send_failure([e.args[1], e.args[0], __file__, 0])
+        finally:
+            self._end_command()
+        return not self._stop
+
+    def serve(self):
+        if self.handshake():
+            # Expect:
+            while self.run_command(self.recv_msg()):
+                pass
+        self.flush()
 
     def close(self):
         self._stop = True
@@ -1071,7 +1503,9 @@ class TCPSVNRequestHandler(SocketServer.StreamRequestHandler):
             client_address, server)
 
     def handle(self):
-        server = SVNServer(self._server._backend, self.rfile.read, 
+        # Read from the socket directly rather than through rfile, as
+        # rfile.read() blocks until the full requested size is available.
+        server = SVNServer(self._server._backend, self.request.recv,
             self.wfile.write, self._server._logf)
         try:
             server.serve()
@@ -1079,6 +1513,10 @@ class TCPSVNRequestHandler(SocketServer.StreamRequestHandler):
             if e.args[0] == EPIPE:
                 return
             raise
+        except SubversionException, e:
+            if e.args[1] == ERR_RA_SVN_CONNECTION_CLOSED:
+                return
+            raise
 
 
 class TCPSVNServer(SocketServer.TCPServer):
@@ -1091,3 +1529,119 @@ class TCPSVNServer(SocketServer.TCPServer):
         self._backend = backend
         SocketServer.TCPServer.__init__(self, addr, TCPSVNRequestHandler)
 
+
+class _SerializedBackend(object):
+    """Wrapper around a ServerBackend that serializes open_repository calls.
+
+    Repository backends returned by open_repository are only used by the
+    connection that opened them.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+
+    def open_repository(self, location):
+        self._lock.acquire()
+        try:
+            return self._backend.open_repository(location)
+        finally:
+            self._lock.release()
+
+
+class ThreadPoolTCPSVNServer(TCPSVNServer):
+    """svn:// server that handles connections in a pool of worker threads.
+
+    :param backend: ServerBackend to use
+    :param addr: Address to listen on
+    :param logf: Optional file to log to
+    :param workers: Number of worker threads, and thus the maximum number
+        of clients that are served at the same time
+    :param max_queued: Maximum number of accepted connections that can
+        wait for a worker; connections beyond that are closed immediately
+    """
+
+    def __init__(self, backend, addr, logf=None, workers=10, max_queued=50):
+        self.request_queue_size = max_queued
+        TCPSVNServer.__init__(self, _SerializedBackend(backend), addr, logf)
+        # Not bounded by max_queued, so that server_close can always add
+        # the markers that stop the workers.
+        self._requests = Queue.Queue()
+        self._max_queued = max_queued
+        self._closing = False
+        self._active = set()
+        self._active_lock = threading.Lock()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._process_requests,
+                name="svnserve-worker-%d" % i)
+            worker.setDaemon(True)
+            worker.start()
+            self._workers.append(worker)
+
+    def process_request(self, request, client_address):
+        if self._requests.qsize() >= self._max_queued:
+            if self._logf is not None:
+                self._logf.write("Too many queued connections, dropping %r\n" %
+                    (client_address, ))
+            self.close_request(request)
+        else:
+            self._requests.put((request, client_address))
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            (request, client_address) = item
+            self._active_lock.acquire()
+            try:
+                closing = self._closing
+                if not closing:
+                    self._active.add(request)
+            finally:
+                self._active_lock.release()
+            if closing:
+                self.close_request(request)
+                continue
+            try:
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+            finally:
+                self._active_lock.acquire()
+                try:
+                    self._active.discard(request)
+                finally:
+                    self._active_lock.release()
+                self.close_request(request)
+
+    def server_close(self, timeout=None):
+        """Stop accepting connections and wait for the workers to finish.
+
+        Connections that were already accepted are still served.
+
+        :param timeout: Number of seconds to wait for clients to disconnect
+            before their connections are shut down; None to wait forever
+        """
+        TCPSVNServer.server_close(self)
+        for worker in self._workers:
+            self._requests.put(None)
+        if timeout is not None:
+            deadline = time.time() + timeout
+            for worker in self._workers:
+                worker.join(max(0, deadline - time.time()))
+            self._active_lock.acquire()
+            try:
+                self._closing = True
+                active = list(self._active)
+            finally:
+                self._active_lock.release()
+            for request in active:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        for worker in self._workers:
+            worker.join()
@@ -0,0 +1,701 @@
+# Copyright (C) 2006-2008 Jelmer Vernooij <jelmer@samba.org>
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Event driven implementation of the svn:// protocol."""
+
+__author__ = "Jelmer Vernooij <jelmer@samba.org>"
+
+import Queue
+import asyncore
+import base64
+import os
+import select
+import socket
+import sys
+import threading
+import time
+import traceback
+import urllib
+from collections import deque
+from errno import EAGAIN, EWOULDBLOCK
+
+from subvertpy import (
+    ERR_RA_SVN_CONNECTION_CLOSED,
+    SubversionException,
+    )
+from subvertpy.marshall import (
+    MarshallError,
+    NeedMoreData,
+    Unmarshaller,
+    literal,
+    marshall,
+    )
+from subvertpy.ra_svn import (
+    CAPABILITIES,
+    RECV_BUFFER_SIZE,
+    SVN_PORT,
+    EditorDriver,
+    SVNServer,
+    _SerializedBackend,
+    _get_dir_args,
+    _log_args,
+    _revnum_arg,
+    parse_response,
+    unmarshall_dir,
+    unmarshall_log_entry,
+    unmarshall_node_kind,
+    unmarshall_stat,
+    )
+
+
+class _WorkerPool(object):
+    """Fixed size pool of threads that run submitted functions."""
+
+    def __init__(self, workers, name):
+        self._jobs = Queue.Queue()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run,
+                name="%s-%d" % (name, i))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            (fn, args) = job
+            fn(*args)
+
+    def submit(self, fn, *args):
+        self._jobs.put((fn, args))
+
+    def close(self):
+        """Wait for the submitted functions to finish and stop the threads."""
+        for thread in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+class _Waker(asyncore.file_dispatcher):
+    """Pipe that allows other threads to interrupt the event loop."""
+
+    def __init__(self, map):
+        (self._readfd, self._writefd) = os.pipe()
+        asyncore.file_dispatcher.__init__(self, self._readfd, map=map)
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def wake(self, connection):
+        """Have the event loop call connection.wakeup()."""
+        self._lock.acquire()
+        try:
+            self._pending.add(connection)
+        finally:
+            self._lock.release()
+        try:
+            os.write(self._writefd, "x")
+        except OSError:
+            pass
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(4096)
+        self._lock.acquire()
+        try:
+            pending = self._pending
+            self._pending = set()
+        finally:
+            self._lock.release()
+        for connection in pending:
+            connection.wakeup()
+
+    def close(self):
+        asyncore.file_dispatcher.close(self)
+        os.close(self._writefd)
+
+
+class _AsyncSVNConnection(asyncore.dispatcher):
+    """A client connection of an AsyncSVNServer.
+
+    Commands run in the worker pool of the server, one at a time per
+    connection, and exchange data with the event loop through the buffers
+    of this object. Reading from and closing the socket is left to the event
+    loop. Workers write replies directly if the socket buffer has room and
+    queue them for the event loop otherwise; the socket is only written to
+    with the lock held, so that the output is not reordered. The state
+    shared with the workers is likewise only accessed with the lock held.
+    While no command is running, incoming data is parsed by the event loop
+    so that idle connections do not occupy a worker.
+    """
+
+    def __init__(self, server, sock):
+        asyncore.dispatcher.__init__(self, sock, map=server._map)
+        self._server = server
+        self._lock = threading.Condition()
+        # Data received while a command is running
+        self._inbuffer = []
+        self._outbuffer = []
+        self._eof = False
+        self._closing = False
+        self._busy = True
+        self._svn = SVNServer(server._backend, self._recv, self._send,
+            server._logf)
+        server._workers.submit(self._run, self._svn.handshake)
+
+    # Called from the worker threads
+
+    def _recv(self, size):
+        self._lock.acquire()
+        try:
+            while not self._inbuffer and not self._eof:
+                self._lock.wait()
+            data = "".join(self._inbuffer)
+            self._inbuffer = []
+            if len(data) > size:
+                self._inbuffer.append(data[size:])
+                data = data[:size]
+            return data
+        finally:
+            self._lock.release()
+
+    def _send(self, data):
+        self._lock.acquire()
+        try:
+            if self._eof:
+                raise SubversionException("Connection closed",
+                    ERR_RA_SVN_CONNECTION_CLOSED)
+            if not self._outbuffer:
+                # Avoid a round trip through the event loop if the data
+                # fits in the socket buffer.
+                try:
+                    data = data[self.socket.send(data):]
+                except socket.error, e:
+                    if e.args[0] not in (EAGAIN, EWOULDBLOCK):
+                        raise SubversionException("Connection closed",
+                            ERR_RA_SVN_CONNECTION_CLOSED)
+                if not data:
+                    return
+            self._outbuffer.append(data)
+        finally:
+            self._lock.release()
+        self._server._waker.wake(self)
+
+    def _run(self, fn, *args):
+        try:
+            try:
+                keep_open = fn(*args)
+            finally:
+                self._svn.flush()
+        except SubversionException, e:
+            if e.args[1] != ERR_RA_SVN_CONNECTION_CLOSED:
+                self._server.handle_error()
+            keep_open = False
+        except Exception:
+            self._server.handle_error()
+            keep_open = False
+        self._lock.acquire()
+        try:
+            self._busy = False
+            if not keep_open:
+                self._closing = True
+        finally:
+            self._lock.release()
+        self._server._waker.wake(self)
+
+    # Called from the event loop
+
+    def wakeup(self):
+        """Start the next command or close the connection, if possible."""
+        self._lock.acquire()
+        try:
+            if self._busy:
+                return
+            if self._closing or self._eof:
+                if not self._outbuffer:
+                    self.close()
+                return
+            pending = self._inbuffer
+            self._inbuffer = []
+        finally:
+            self._lock.release()
+        unmarshaller = self._svn._unmarshaller
+        for data in pending:
+            unmarshaller.feed(data)
+        try:
+            msg = unmarshaller.read_item()
+        except NeedMoreData:
+            return
+        except MarshallError:
+            self._lock.acquire()
+            try:
+                self._closing = True
+            finally:
+                self._lock.release()
+            self.handle_error()
+            return
+        self._lock.acquire()
+        try:
+            self._busy = True
+        finally:
+            self._lock.release()
+        self._server._workers.submit(self._run, self._svn.run_command, msg)
+
+    def readable(self):
+        self._lock.acquire()
+        try:
+            return not self._eof and not self._closing
+        finally:
+            self._lock.release()
+
+    def writable(self):
+        self._lock.acquire()
+        try:
+            return bool(self._outbuffer)
+        finally:
+            self._lock.release()
+
+    def handle_read(self):
+        data = self.recv(RECV_BUFFER_SIZE)
+        if data == "":
+            # handle_close has already been called
+            return
+        self._lock.acquire()
+        try:
+            self._inbuffer.append(data)
+            self._lock.notify()
+        finally:
+            self._lock.release()
+        self.wakeup()
+
+    def handle_write(self):
+        self._lock.acquire()
+        try:
+            data = "".join(self._outbuffer)
+            sent = self.send(data)
+            if self._eof:
+                # handle_close was called and discarded the output
+                return
+            if sent < len(data):
+                self._outbuffer = [data[sent:]]
+            else:
+                self._outbuffer = []
+            done = not self._outbuffer
+        finally:
+            self._lock.release()
+        if done:
+            self.wakeup()
+
+    def handle_close(self):
+        self._lock.acquire()
+        try:
+            self._eof = True
+            # Drop any output, the peer is gone
+            self._outbuffer = []
+            self._lock.notify()
+        finally:
+            self._lock.release()
+        self.wakeup()
+
+    def handle_error(self):
+        self._server.handle_error()
+        self.handle_close()
+
+    def abort(self):
+        """Close the connection, even if a command is still running."""
+        self._lock.acquire()
+        try:
+            # Unblock a command that is waiting for the client
+            self._eof = True
+            self._lock.notify()
+        finally:
+            self._lock.release()
+        self.close()
+
+
+class AsyncSVNServer(asyncore.dispatcher):
+    """Event driven svn:// server.
+
+    Connections are multiplexed in a single event loop, so mostly idle
+    clients are cheap. Commands are dispatched using the command table of
+    SVNServer and run in a pool of worker threads, so that slow backend
+    calls do not block the event loop.
+
+    :param backend: ServerBackend to use
+    :param addr: Address to listen on; either a (host, port) tuple or the
+        path of a Unix domain socket
+    :param logf: Optional file to log to
+    :param workers: Number of worker threads, and thus the maximum number
+        of commands that run at the same time
+    """
+
+    def __init__(self, backend, addr, logf=None, workers=10):
+        self._map = {}
+        asyncore.dispatcher.__init__(self, map=self._map)
+        self._backend = _SerializedBackend(backend)
+        self._logf = logf
+        if isinstance(addr, basestring):
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        self.bind(addr)
+        self.listen(socket.SOMAXCONN)
+        self.server_address = self.socket.getsockname()
+        self._shutdown = False
+        self._waker = _Waker(self._map)
+        self._workers = _WorkerPool(workers, "svnserve-worker")
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        (sock, client_address) = pair
+        if sock.family == socket.AF_INET:
+            # Replies are often written in several small pieces
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self._logf is not None:
+            self._logf.write("Accepted connection from %r\n" %
+                (client_address, ))
+        _AsyncSVNConnection(self, sock)
+
+    def handle_error(self):
+        if self._logf is not None:
+            traceback.print_exc(file=self._logf)
+        else:
+            traceback.print_exc()
+
+    def writable(self):
+        return False
+
+    def serve(self, poll_interval=0.5):
+        """Run the event loop until shutdown() is called.
+
+        :param poll_interval: Maximum number of seconds to wait for events
+        """
+        # select() is limited to FD_SETSIZE descriptors
+        use_poll = hasattr(select, "poll")
+        while not self._shutdown:
+            asyncore.loop(poll_interval, use_poll, self._map, count=1)
+        self.close()
+        for dispatcher in self._map.values():
+            if isinstance(dispatcher, _AsyncSVNConnection):
+                dispatcher.abort()
+        self._workers.close()
+        self._waker.close()
+
+    def shutdown(self):
+        """Stop the event loop; can be called from any thread."""
+        self._shutdown = True
+        self._waker.wake(self)
+
+    def wakeup(self):
+        pass
+
+
+class AsyncRequest(object):
+    """Pending result of a command sent by an AsyncSVNClient."""
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self._callbacks = []
+
+    def add_done_callback(self, fn):
+        """Call fn with this request as argument once it has finished."""
+        if self.done:
+            fn(self)
+        else:
+            self._callbacks.append(fn)
+
+    def get_result(self):
+        """Return the result of the command, or raise its error."""
+        if not self.done:
+            raise AssertionError("request has not finished yet")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _finish(self, result=None, error=None):
+        self.done = True
+        self.result = result
+        self.error = error
+        callbacks = self._callbacks
+        self._callbacks = []
+        for fn in callbacks:
+            fn(self)
+
+
+class AsyncSVNClient(asyncore.dispatcher):
+    """svn:// client that does not block on network I/O.
+
+    Clients are driven by an asyncore event loop, so a single thread can
+    talk to many repositories at once. Commands return an AsyncRequest
+    immediately; they are sent to the server as soon as the connection
+    has been set up, and their responses are processed in order.
+
+    :param url: svn:// URL to connect to
+    :param map: asyncore socket map to use; the global map if None
+    """
+
+    def __init__(self, url, map=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        self.url = url
+        (type, opaque) = urllib.splittype(url)
+        if type != "svn":
+            raise NotImplementedError("Unsupported URL scheme %r" % type)
+        (host, path) = urllib.splithost(opaque)
+        (host, port) = urllib.splitnport(host, SVN_PORT)
+        (family, socktype, proto, canonname, sockaddr) = socket.getaddrinfo(
+            host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)[0]
+        self._unmarshaller = Unmarshaller()
+        self._outbuffer = []
+        # Messages that can not be sent until the handshake has finished
+        self._deferred = []
+        self._handlers = deque()
+        self._uuid = None
+        self._root_url = None
+        self._server_capabilities = None
+        self.connected_request = AsyncRequest()
+        self._handlers.append((self.connected_request,
+            self._handshake(self.connected_request)))
+        self._handlers[0][1].next()
+        self.create_socket(family, socktype)
+        self.connect(sockaddr)
+
+    def _send_msg(self, msg):
+        self._outbuffer.append(marshall(msg))
+
+    def _handshake(self, request):
+        (min_version, max_version, _, self._server_capabilities) = \
+            parse_response((yield))
+        self._send_msg([max_version,
+            [literal(x) for x in CAPABILITIES
+             if x in self._server_capabilities], self.url])
+        (server_mechanisms, mech_arg) = parse_response((yield))
+        if server_mechanisms != []:
+            self._send_msg([literal("ANONYMOUS"),
+                [base64.b64encode("anonymous@%s" % socket.gethostname())]])
+            parse_response((yield))
+        msg = parse_response((yield))
+        if len(msg) > 2:
+            self._server_capabilities += msg[2]
+        (self._uuid, self._root_url) = msg[0:2]
+        for msg in self._deferred:
+            self._send_msg(msg)
+        self._deferred = None
+        request._finish()
+
+    def _request(self, msg, handler, *args):
+        request = AsyncRequest()
+        if self._deferred is None:
+            self._send_msg(msg)
+        else:
+            self._deferred.append(msg)
+        gen = handler(request, *args)
+        gen.next()
+        self._handlers.append((request, gen))
+        return request
+
+    def _simple_response(self, request, convert):
+        parse_response((yield))
+        request._finish(convert(parse_response((yield))))
+
+    def get_uuid(self):
+        return self._uuid
+
+    def get_repos_root(self):
+        return self._root_url
+
+    def has_capability(self, capability):
+        return capability in self._server_capabilities
+
+    def get_latest_revnum(self):
+        """Retrieve the youngest revision number."""
+        return self._request([literal("get-latest-rev"), []],
+            self._simple_response, lambda ret: ret[0])
+
+    def check_path(self, path, revision=None):
+        """Retrieve the node kind of a path."""
+        return self._request(
+            [literal("check-path"), [path, _revnum_arg(revision)]],
+            self._simple_response, lambda ret: unmarshall_node_kind(ret[0]))
+
+    def stat(self, path, revision=-1):
+        """Retrieve the dirent of a path, or None if it does not exist."""
+        return self._request([literal("stat"), [path, _revnum_arg(revision)]],
+            self._simple_response, unmarshall_stat)
+
+    def get_dir(self, path, revision=-1, dirent_fields=0, want_props=True,
+                want_contents=True):
+        """Retrieve a directory listing.
+
+        The result is a tuple with dirents, fetched revision and properties.
+        """
+        return self._request([literal("get-dir"), _get_dir_args(path,
+            revision, dirent_fields, want_props, want_contents)],
+            self._simple_response, unmarshall_dir)
+
+    def rev_proplist(self, revision):
+        """Retrieve the properties of a revision."""
+        return self._request([literal("rev-proplist"), [revision]],
+            self._simple_response, lambda ret: dict(ret[0]))
+
+    def _log_response(self, request, callback):
+        parse_response((yield))
+        entries = []
+        while True:
+            msg = (yield)
+            if msg == "done":
+                break
+            entry = unmarshall_log_entry(msg)
+            if callback is None:
+                entries.append(entry)
+            else:
+                callback(*entry)
+        parse_response((yield))
+        if callback is None:
+            request._finish(entries)
+        else:
+            request._finish()
+
+    def log(self, paths, start, end, limit=0, discover_changed_paths=True,
+            strict_node_history=True, include_merged_revisions=True,
+            revprops=None, callback=None):
+        """Retrieve log entries.
+
+        :param callback: Function that is called with the changed paths,
+            revision number, revision properties and has_children for
+            each log entry as it arrives. If None, the result of the
+            request is a list of these tuples.
+        """
+        return self._request([literal("log"), _log_args(paths, start, end,
+            limit, discover_changed_paths, strict_node_history,
+            include_merged_revisions, revprops)],
+            self._log_response, callback)
+
+    def _replay_response(self, request, editor):
+        parse_response((yield))
+        driver = EditorDriver(editor, for_replay=True)
+        while True:
+            msg = (yield)
+            if driver.process(msg):
+                break
+        if msg[0] != "finish-replay":
+            self._send_msg([literal("success"), []])
+        parse_response((yield))
+        request._finish()
+
+    def replay(self, revision, low_water_mark, update_editor,
+               send_deltas=True):
+        """Replay a revision, driving update_editor."""
+        return self._request([literal("replay"),
+            [revision, low_water_mark, send_deltas]],
+            self._replay_response, update_editor)
+
+    def _fail_pending(self, error):
+        handlers = self._handlers
+        self._handlers = deque()
+        for (request, gen) in handlers:
+            gen.close()
+            request._finish(error=error)
+
+    def _process_msg(self, msg):
+        if not self._handlers:
+            raise MarshallError("Unexpected message %r" % (msg, ))
+        (request, gen) = self._handlers[0]
+        try:
+            gen.send(msg)
+        except StopIteration:
+            self._handlers.popleft()
+        except Exception, e:
+            if msg[0] != "failure":
+                # The remaining response to this command can no longer
+                # be told apart from the responses to later commands.
+                raise
+            self._handlers.popleft()
+            request._finish(error=e)
+        else:
+            return
+        if not request.done:
+            request._finish()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return not self.connected or bool(self._outbuffer)
+
+    def handle_connect(self):
+        pass
+
+    def handle_read(self):
+        data = self.recv(RECV_BUFFER_SIZE)
+        if data == "":
+            return
+        self._unmarshaller.feed(data)
+        while True:
+            try:
+                msg = self._unmarshaller.read_item()
+            except NeedMoreData:
+                return
+            self._process_msg(msg)
+
+    def handle_write(self):
+        data = "".join(self._outbuffer)
+        sent = self.send(data)
+        if sent < len(data):
+            self._outbuffer = [data[sent:]]
+        else:
+            self._outbuffer = []
+
+    def handle_close(self):
+        self.close()
+        self._fail_pending(SubversionException("Connection closed",
+            ERR_RA_SVN_CONNECTION_CLOSED))
+
+    def handle_error(self):
+        error = sys.exc_info()[1]
+        self.close()
+        self._fail_pending(error)
+
+
+def wait(requests, map=None, timeout=None):
+    """Run the asyncore event loop until all requests have finished.
+
+    :param requests: AsyncRequests to wait for
+    :param map: asyncore socket map to use; the global map if None
+    :param timeout: Maximum number of seconds to wait; None to wait forever
+    :return: Whether all requests have finished
+    """
+    use_poll = hasattr(select, "poll")
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for request in requests:
+        while not request.done:
+            if timeout is None:
+                poll_timeout = 30.0
+            else:
+                poll_timeout = deadline - time.time()
+                if poll_timeout <= 0:
+                    return False
+            asyncore.loop(poll_timeout, use_poll, map, count=1)
+    return True
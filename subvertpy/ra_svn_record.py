@@ -0,0 +1,162 @@
+# Copyright (C) 2006-2008 Jelmer Vernooij <jelmer@samba.org>
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+"""Recording and playback of svn protocol sessions.
+
+A recording contains the data an endpoint of a svn:// connection received
+and sent, in order. It can be played back to a client or server without
+using the network, which is useful for benchmarking.
+
+Recording a client session::
+
+    f = open("session.rec", "wb")
+    transport = SessionRecorder(f, socket.create_connection((host, 3690)))
+    client = SVNClient(url, transport=transport)
+    ...
+    transport.close()
+
+Replaying it::
+
+    player = SessionPlayer(open("session.rec", "rb"))
+    client = SVNClient(url, transport=player)
+"""
+
+__author__ = "Jelmer Vernooij <jelmer@samba.org>"
+
+import struct
+
+from subvertpy.marshall import MarshallError
+
+MAGIC = "SVNSESS1"
+
+# Directions of recorded data, relative to the recorded endpoint
+RECEIVED = "<"
+SENT = ">"
+
+_record_header = struct.Struct(">cI")
+
+# Maximum amount of data in one direction to buffer before writing it
+MAX_PENDING_SIZE = 1024 * 1024
+
+
+class SessionRecorder(object):
+    """Transport wrapper that records all data exchanged to a file.
+
+    Consecutive data in the same direction is merged into a single record.
+
+    :param f: File to write the recording to
+    :param transport: Object with recv and sendall methods, such as a
+        connected socket
+    """
+
+    def __init__(self, f, transport):
+        self._f = f
+        self._transport = transport
+        self._direction = None
+        self._pending = []
+        self._pending_size = 0
+        f.write(MAGIC)
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        data = "".join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._f.write(_record_header.pack(self._direction, len(data)))
+        self._f.write(data)
+
+    def _record(self, direction, data):
+        if direction != self._direction:
+            self._write_pending()
+            self._direction = direction
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= MAX_PENDING_SIZE:
+            self._write_pending()
+
+    def recv(self, size):
+        data = self._transport.recv(size)
+        if data:
+            self._record(RECEIVED, data)
+        return data
+
+    def sendall(self, data):
+        self._record(SENT, data)
+        self._transport.sendall(data)
+
+    def flush(self):
+        """Write all recorded data to the file."""
+        self._write_pending()
+        self._f.flush()
+
+    def close(self):
+        """Write all recorded data and close the underlying transport."""
+        self.flush()
+        self._transport.close()
+
+
+def read_session(f):
+    """Read a recorded session.
+
+    :param f: File with the recording
+    :return: Iterator over (direction, data) tuples
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise MarshallError("Not a svn session recording")
+    while True:
+        header = f.read(_record_header.size)
+        if header == "":
+            return
+        if len(header) != _record_header.size:
+            raise MarshallError("Truncated session recording")
+        (direction, length) = _record_header.unpack(header)
+        data = f.read(length)
+        if len(data) != length:
+            raise MarshallError("Truncated session recording")
+        yield (direction, data)
+
+
+class SessionPlayer(object):
+    """Transport that plays back one direction of a recorded session.
+
+    Data passed to sendall() is discarded, so the session plays back at
+    full speed. The number of bytes that was passed to it is available
+    as bytes_sent.
+
+    :param f: File with the recording
+    :param direction: Data to return from recv(). RECEIVED to play back
+        the data the recorded endpoint received, so the session can be
+        repeated by the same kind of endpoint. SENT to play back the data
+        the recorded endpoint sent, to drive its peer; e.g. the client
+        side of a recorded client session to a server.
+    """
+
+    def __init__(self, f, direction=RECEIVED):
+        self._data = "".join([data for (d, data) in read_session(f)
+                              if d == direction])
+        self._offset = 0
+        self.bytes_sent = 0
+
+    def recv(self, size):
+        data = self._data[self._offset:self._offset+size]
+        self._offset += len(data)
+        return data
+
+    def sendall(self, data):
+        self.bytes_sent += len(data)
+
+    def close(self):
+        pass
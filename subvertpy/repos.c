@@ -744,6 +744,194 @@ static PyObject *fs_root_is_file(FileSystemRootObject *self, PyObject *args)
 	return PyBool_FromLong(is_file);
 }
 
+static PyObject *fs_root_check_path(FileSystemRootObject *self, PyObject *args)
+{
+	svn_node_kind_t kind;
+	apr_pool_t *temp_pool;
+	char *path;
+
+	if (!PyArg_ParseTuple(args, "s", &path))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL)
+		return NULL;
+	RUN_SVN_WITH_POOL(temp_pool, svn_fs_check_path(&kind, self->root, 
+											   path, temp_pool));
+	apr_pool_destroy(temp_pool);
+	return PyInt_FromLong(kind);
+}
+
+static PyObject *fs_root_node_created_rev(FileSystemRootObject *self, PyObject *args)
+{
+	svn_revnum_t rev;
+	apr_pool_t *temp_pool;
+	char *path;
+
+	if (!PyArg_ParseTuple(args, "s", &path))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL)
+		return NULL;
+	RUN_SVN_WITH_POOL(temp_pool, svn_fs_node_created_rev(&rev, self->root, 
+											   path, temp_pool));
+	apr_pool_destroy(temp_pool);
+	return PyInt_FromLong(rev);
+}
+
+static PyObject *fs_root_copied_from(FileSystemRootObject *self, PyObject *args)
+{
+	svn_revnum_t rev;
+	const char *from_path;
+	apr_pool_t *temp_pool;
+	char *path;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, "s", &path))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL)
+		return NULL;
+	RUN_SVN_WITH_POOL(temp_pool, svn_fs_copied_from(&rev, &from_path, 
+											   self->root, path, temp_pool));
+	if (from_path == NULL) {
+		ret = Py_None;
+		Py_INCREF(ret);
+	} else {
+		ret = Py_BuildValue("(sl)", from_path, rev);
+	}
+	apr_pool_destroy(temp_pool);
+	return ret;
+}
+
+static PyObject *fs_root_dir_entries(FileSystemRootObject *self, PyObject *args)
+{
+	apr_pool_t *temp_pool;
+	apr_hash_t *entries;
+	apr_hash_index_t *idx;
+	const char *key;
+	apr_ssize_t klen;
+	svn_fs_dirent_t *dirent;
+	char *path;
+	PyObject *ret;
+
+	if (!PyArg_ParseTuple(args, "s", &path))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL)
+		return NULL;
+	RUN_SVN_WITH_POOL(temp_pool, svn_fs_dir_entries(&entries, self->root, 
+											   path, temp_pool));
+
+	ret = PyDict_New();
+	if (ret == NULL) {
+		apr_pool_destroy(temp_pool);
+		return NULL;
+	}
+
+	for (idx = apr_hash_first(temp_pool, entries); idx != NULL;
+		 idx = apr_hash_next(idx)) {
+		PyObject *py_kind;
+		apr_hash_this(idx, (const void **)&key, &klen, (void **)&dirent);
+		py_kind = PyInt_FromLong(dirent->kind);
+		if (py_kind == NULL) {
+			apr_pool_destroy(temp_pool);
+			Py_DECREF(ret);
+			return NULL;
+		}
+		if (PyDict_SetItemString(ret, key, py_kind) != 0) {
+			apr_pool_destroy(temp_pool);
+			Py_DECREF(py_kind);
+			Py_DECREF(ret);
+			return NULL;
+		}
+		Py_DECREF(py_kind);
+	}
+	apr_pool_destroy(temp_pool);
+	return ret;
+}
+
+static PyObject *fs_root_node_history(FileSystemRootObject *self, PyObject *args)
+{
+	char *path;
+	bool cross_copies = true;
+	svn_revnum_t min_revnum = 0, hist_rev;
+	const char *hist_path;
+	apr_pool_t *temp_pool, *oldpool, *newpool, *swap;
+	svn_fs_history_t *history;
+	svn_error_t *err;
+	PyObject *ret, *item;
+
+	if (!PyArg_ParseTuple(args, "s|bl", &path, &cross_copies, &min_revnum))
+		return NULL;
+
+	temp_pool = Pool(NULL);
+	if (temp_pool == NULL)
+		return NULL;
+	oldpool = Pool(temp_pool);
+	if (oldpool == NULL) {
+		apr_pool_destroy(temp_pool);
+		return NULL;
+	}
+	newpool = Pool(temp_pool);
+	if (newpool == NULL) {
+		apr_pool_destroy(temp_pool);
+		return NULL;
+	}
+	RUN_SVN_WITH_POOL(temp_pool, svn_fs_node_history(&history, self->root, 
+											   path, oldpool));
+
+	ret = PyList_New(0);
+	if (ret == NULL) {
+		apr_pool_destroy(temp_pool);
+		return NULL;
+	}
+
+	while (true) {
+		Py_BEGIN_ALLOW_THREADS
+		err = svn_fs_history_prev(&history, history, cross_copies, newpool);
+		if (err == NULL && history != NULL)
+			err = svn_fs_history_location(&hist_path, &hist_rev, history,
+										  newpool);
+		Py_END_ALLOW_THREADS
+		if (err != NULL) {
+			handle_svn_error(err);
+			svn_error_clear(err);
+			Py_DECREF(ret);
+			apr_pool_destroy(temp_pool);
+			return NULL;
+		}
+		if (history == NULL)
+			break;
+		item = Py_BuildValue("(sl)", hist_path, hist_rev);
+		if (item == NULL) {
+			Py_DECREF(ret);
+			apr_pool_destroy(temp_pool);
+			return NULL;
+		}
+		if (PyList_Append(ret, item) != 0) {
+			Py_DECREF(item);
+			Py_DECREF(ret);
+			apr_pool_destroy(temp_pool);
+			return NULL;
+		}
+		Py_DECREF(item);
+		if (hist_rev <= min_revnum)
+			break;
+		/* The previous history object is no longer needed; reuse its
+		 * pool for the next one. */
+		apr_pool_clear(oldpool);
+		swap = oldpool;
+		oldpool = newpool;
+		newpool = swap;
+	}
+	apr_pool_destroy(temp_pool);
+	return ret;
+}
+
 static PyObject *fs_root_file_length(FileSystemRootObject *self, PyObject *args)
 {
 	svn_filesize_t filesize;
@@ -860,6 +1048,23 @@ static PyMethodDef fs_root_methods[] = {
 	{ "paths_changed", (PyCFunction)fs_root_paths_changed, METH_NOARGS, NULL },
 	{ "is_dir", (PyCFunction)fs_root_is_dir, METH_VARARGS, NULL },
 	{ "is_file", (PyCFunction)fs_root_is_file, METH_VARARGS, NULL },
+	{ "check_path", (PyCFunction)fs_root_check_path, METH_VARARGS,
+		"S.check_path(path) -> kind\n"
+		"Return the node kind (one of the NODE_* constants) of a path." },
+	{ "node_created_rev", (PyCFunction)fs_root_node_created_rev, METH_VARARGS,
+		"S.node_created_rev(path) -> revnum\n"
+		"Return the revision in which a path was last changed." },
+	{ "copied_from", (PyCFunction)fs_root_copied_from, METH_VARARGS,
+		"S.copied_from(path) -> (copyfrom_path, copyfrom_rev) or None" },
+	{ "node_history", (PyCFunction)fs_root_node_history, METH_VARARGS,
+		"S.node_history(path, cross_copies=True, min_revnum=0) -> list\n"
+		"Return the (path, revnum) locations at which a node changed, "
+		"youngest first. Stops after the first location at or below "
+		"min_revnum." },
+	{ "dir_entries", (PyCFunction)fs_root_dir_entries, METH_VARARGS,
+		"S.dir_entries(path) -> dict\n"
+		"Return a dictionary mapping the names of the entries of a "
+		"directory to their node kind." },
 	{ "file_length", (PyCFunction)fs_root_file_length, METH_VARARGS, NULL },
 	{ "file_content", (PyCFunction)fs_root_file_contents, METH_VARARGS, NULL },
 	{ "file_checksum", (PyCFunction)fs_root_file_checksum, METH_VARARGS, NULL },
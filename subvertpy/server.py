@@ -41,7 +41,13 @@ class ServerRepositoryBackend(object):
             changed_paths, strict_node, limit):
         raise NotImplementedError(self.log)
 
-    def update(self, editor, revnum, target_path, recurse=True):
+    def update(self, editor, revnum, target_path, recurse=True,
+               base_revnum=None):
+        """Send the changes to a tree to an editor.
+
+        :param base_revnum: Revision the whole tree of the client is at,
+            or None if the full tree should be sent
+        """
         raise NotImplementedError(self.update)
 
     def check_path(self, path, revnum):
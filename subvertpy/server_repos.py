@@ -0,0 +1,538 @@
+# Copyright (C) 2006-2009 Jelmer Vernooij <jelmer@samba.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301, USA
+
+"""Server backend that serves local repositories using subvertpy.repos."""
+
+import os
+import posixpath
+import threading
+import urllib
+
+from subvertpy import (
+    ERR_FS_NO_SUCH_REVISION,
+    ERR_FS_NOT_FOUND,
+    ERR_FS_PATH_SYNTAX,
+    ERR_RA_SVN_REPOS_NOT_FOUND,
+    NODE_DIR,
+    NODE_FILE,
+    NODE_NONE,
+    SubversionException,
+    repos,
+    )
+from subvertpy.delta import send_stream
+from subvertpy.server import (
+    ServerBackend,
+    ServerRepositoryBackend,
+    )
+
+# Keep in sync with svn_fs_path_change_kind_t
+CHANGE_ACTIONS = {0: "M", 1: "A", 2: "D", 3: "R"}
+
+NODE_KIND_NAMES = {NODE_DIR: "dir", NODE_FILE: "file"}
+
+MAX_CACHED_ROOTS = 32
+
+
+def _split_path(path):
+    """Split a path into its components, refusing to go up the tree."""
+    parts = [p for p in path.split("/") if p not in ("", ".")]
+    if ".." in parts:
+        raise SubversionException("Invalid path '%s'" % path,
+                                  ERR_FS_PATH_SYNTAX)
+    return parts
+
+
+def _is_repository(path):
+    return (os.path.isfile(os.path.join(path, "format")) and
+            os.path.isdir(os.path.join(path, "db")))
+
+
+class _CachedRepository(object):
+    """A repository that is shared between connections.
+
+    Subversion filesystem objects are not thread-safe, so all access to the
+    filesystem and its revision roots should happen with ``lock`` held.
+    Revision roots never change once created and are kept in a least
+    recently used cache.
+    """
+
+    def __init__(self, path, max_roots=MAX_CACHED_ROOTS):
+        self.path = path
+        self.lock = threading.RLock()
+        self.repos = repos.Repository(path)
+        self.fs = self.repos.fs()
+        self.uuid = self.fs.get_uuid()
+        self._max_roots = max_roots
+        self._roots = {}
+        self._root_order = []
+
+    def revision_root(self, revnum):
+        """Return the root of a revision.
+
+        The caller should hold ``lock``.
+        """
+        root = self._roots.get(revnum)
+        if root is not None:
+            if self._root_order[-1] != revnum:
+                self._root_order.remove(revnum)
+                self._root_order.append(revnum)
+            return root
+        root = self.fs.revision_root(revnum)
+        self._roots[revnum] = root
+        self._root_order.append(revnum)
+        if len(self._root_order) > self._max_roots:
+            del self._roots[self._root_order.pop(0)]
+        return root
+
+    def youngest_revision(self):
+        self.lock.acquire()
+        try:
+            return self.fs.youngest_revision()
+        finally:
+            self.lock.release()
+
+    def revision_proplist(self, revnum):
+        self.lock.acquire()
+        try:
+            return self.fs.revision_proplist(revnum)
+        finally:
+            self.lock.release()
+
+
+class _LockedStream(object):
+    """File-like wrapper that reads a filesystem stream with a lock held."""
+
+    def __init__(self, stream, lock, root):
+        self._stream = stream
+        self._lock = lock
+        # Keep the revision root alive while its contents are being read,
+        # even if it is evicted from the cache.
+        self._root = root
+
+    def read(self, length=-1):
+        self._lock.acquire()
+        try:
+            return self._stream.read(length)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._stream.close()
+        finally:
+            self._lock.release()
+
+
+class ReposRepositoryBackend(ServerRepositoryBackend):
+    """Repository backend for a single connection.
+
+    Paths passed in by the server are relative to the URL the client
+    opened, paths sent back (in logs and locations) are absolute paths
+    inside the repository.
+    """
+
+    def __init__(self, repository, relpath):
+        self._repository = repository
+        self.relpath = relpath
+
+    def _repos_path(self, path):
+        return "/" + "/".join(_split_path(self.relpath) + _split_path(path))
+
+    def _revnum(self, revnum):
+        youngest = self._repository.youngest_revision()
+        if revnum is None or revnum < 0:
+            return youngest
+        if revnum > youngest:
+            raise SubversionException("No such revision %d" % revnum,
+                                      ERR_FS_NO_SUCH_REVISION)
+        return revnum
+
+    def _check_exists(self, root, path, revnum):
+        if root.check_path(path) == NODE_NONE:
+            raise SubversionException(
+                "File not found: revision %d, path '%s'" % (revnum, path),
+                ERR_FS_NOT_FOUND)
+
+    def get_uuid(self):
+        return self._repository.uuid
+
+    def get_latest_revnum(self):
+        return self._repository.youngest_revision()
+
+    def rev_proplist(self, revnum):
+        return self._repository.revision_proplist(self._revnum(revnum))
+
+    def check_path(self, path, revnum):
+        revnum = self._revnum(revnum)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            return repository.revision_root(revnum).check_path(
+                self._repos_path(path))
+        finally:
+            repository.lock.release()
+
+    def stat(self, path, revnum):
+        revnum = self._revnum(revnum)
+        path = self._repos_path(path)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            root = repository.revision_root(revnum)
+            kind = root.check_path(path)
+            if kind == NODE_NONE:
+                return None
+            if kind == NODE_FILE:
+                size = root.file_length(path)
+            else:
+                size = 0
+            has_props = bool(root.proplist(path))
+            created_rev = root.node_created_rev(path)
+        finally:
+            repository.lock.release()
+        revprops = repository.revision_proplist(created_rev)
+        ret = {
+            "name": posixpath.basename(path),
+            "kind": NODE_KIND_NAMES[kind],
+            "size": size,
+            "has-props": has_props,
+            "created-rev": created_rev,
+            }
+        if "svn:date" in revprops:
+            ret["created-date"] = revprops["svn:date"]
+        if "svn:author" in revprops:
+            ret["last-author"] = revprops["svn:author"]
+        return ret
+
+    def _node_history(self, path, revnum, min_revnum, strict_node=False):
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            root = repository.revision_root(revnum)
+            self._check_exists(root, path, revnum)
+            return root.node_history(path, not strict_node, min_revnum)
+        finally:
+            repository.lock.release()
+
+    def _changed_paths(self, revnum):
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            root = repository.revision_root(revnum)
+            ret = {}
+            for path, change in root.paths_changed().iteritems():
+                action = CHANGE_ACTIONS[change[1]]
+                copyfrom = None
+                if action in ("A", "R"):
+                    copyfrom = root.copied_from(path)
+                if copyfrom is None:
+                    ret[path] = (action, None, -1)
+                else:
+                    ret[path] = (action, copyfrom[0], copyfrom[1])
+            return ret
+        finally:
+            repository.lock.release()
+
+    def log(self, send_revision, target_path, start_rev, end_rev,
+            changed_paths, strict_node, limit):
+        start_rev = self._revnum(start_rev)
+        end_rev = self._revnum(end_rev)
+        min_revnum = min(start_rev, end_rev)
+        if isinstance(target_path, str):
+            target_paths = [target_path]
+        else:
+            target_paths = target_path
+        revnums = set()
+        for path in target_paths:
+            history = self._node_history(self._repos_path(path),
+                max(start_rev, end_rev), min_revnum, strict_node)
+            revnums.update([revnum for (location, revnum) in history
+                            if revnum >= min_revnum])
+        revnums = sorted(revnums, reverse=(start_rev >= end_rev))
+        if limit:
+            revnums = revnums[:limit]
+        for revnum in revnums:
+            revprops = self._repository.revision_proplist(revnum)
+            if changed_paths:
+                paths = self._changed_paths(revnum)
+            else:
+                paths = None
+            send_revision(revnum, revprops.get("svn:author"),
+                revprops.get("svn:date"), revprops.get("svn:log"), paths)
+
+    def get_locations(self, path, peg_revnum, revnums):
+        peg_revnum = self._revnum(peg_revnum)
+        # Only locations in the past of the peg revision can be found by
+        # walking the node history.
+        wanted = sorted([revnum for revnum in revnums if revnum <= peg_revnum],
+                        reverse=True)
+        ret = {}
+        if not wanted:
+            return ret
+        history = self._node_history(self._repos_path(path), peg_revnum,
+                                     wanted[-1])
+        for (location, revnum) in history:
+            while wanted and wanted[0] >= revnum:
+                ret[wanted.pop(0)] = location
+        return ret
+
+    def update(self, editor, revnum, target_path, recurse=True,
+               base_revnum=None):
+        """Send the tree at a revision to an editor.
+
+        If base_revnum is given, only the changes since that revision are
+        sent, with file contents as deltas against their old contents.
+        Otherwise the full tree is sent, as for a checkout.
+        """
+        revnum = self._revnum(revnum)
+        revprops = {}
+        editor.set_target_revision(revnum)
+        if base_revnum is not None:
+            base_revnum = self._revnum(base_revnum)
+            root_editor = editor.open_root(base_revnum)
+            if target_path == "":
+                self._update_props(root_editor, base_revnum, revnum, "",
+                                   revprops)
+                self._update_entries(root_editor, base_revnum, revnum, "",
+                                     recurse, revprops)
+            else:
+                self._update_node(root_editor, base_revnum, revnum,
+                                  target_path, recurse, revprops)
+        else:
+            root_editor = editor.open_root()
+            if target_path == "":
+                self._send_props(root_editor, revnum, "", revprops)
+                self._send_entries(root_editor, revnum, "", recurse, revprops)
+            else:
+                self._send_node(root_editor, revnum, target_path, recurse,
+                                revprops)
+        root_editor.close()
+        editor.close()
+
+    def _send_props(self, node_editor, revnum, path, revprops,
+                    base_props=None):
+        repos_path = self._repos_path(path)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            root = repository.revision_root(revnum)
+            props = root.proplist(repos_path)
+            created_rev = root.node_created_rev(repos_path)
+        finally:
+            repository.lock.release()
+        if created_rev not in revprops:
+            revprops[created_rev] = repository.revision_proplist(created_rev)
+        if base_props is not None:
+            for name in sorted(base_props):
+                if name not in props:
+                    node_editor.change_prop(name, None)
+        for name, value in sorted(props.iteritems()):
+            if base_props is None or base_props.get(name) != value:
+                node_editor.change_prop(name, value)
+        node_editor.change_prop("svn:entry:committed-rev", str(created_rev))
+        for (name, revprop) in [("svn:entry:committed-date", "svn:date"),
+                                ("svn:entry:last-author", "svn:author")]:
+            if revprop in revprops[created_rev]:
+                node_editor.change_prop(name, revprops[created_rev][revprop])
+        node_editor.change_prop("svn:entry:uuid", repository.uuid)
+
+    def _send_entries(self, dir_editor, revnum, path, recurse, revprops):
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            entries = repository.revision_root(revnum).dir_entries(
+                self._repos_path(path))
+        finally:
+            repository.lock.release()
+        for name in sorted(entries):
+            if entries[name] == NODE_DIR and not recurse:
+                continue
+            self._send_node(dir_editor, revnum, posixpath.join(path, name),
+                            recurse, revprops)
+
+    def _send_node(self, dir_editor, revnum, path, recurse, revprops):
+        repos_path = self._repos_path(path)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            root = repository.revision_root(revnum)
+            kind = root.check_path(repos_path)
+            if kind == NODE_FILE:
+                stream = _LockedStream(root.file_content(repos_path),
+                                       repository.lock, root)
+        finally:
+            repository.lock.release()
+        if kind == NODE_DIR:
+            child_editor = dir_editor.add_directory(path)
+            self._send_props(child_editor, revnum, path, revprops)
+            self._send_entries(child_editor, revnum, path, recurse, revprops)
+            child_editor.close()
+        elif kind == NODE_FILE:
+            file_editor = dir_editor.add_file(path)
+            self._send_props(file_editor, revnum, path, revprops)
+            try:
+                digest = send_stream(stream, file_editor.apply_textdelta())
+            finally:
+                stream.close()
+            file_editor.close(digest.encode("hex"))
+
+    def _update_props(self, node_editor, base_revnum, revnum, path,
+                      revprops):
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            base_props = repository.revision_root(base_revnum).proplist(
+                self._repos_path(path))
+        finally:
+            repository.lock.release()
+        self._send_props(node_editor, revnum, path, revprops, base_props)
+
+    def _update_entries(self, dir_editor, base_revnum, revnum, path, recurse,
+                        revprops):
+        repos_path = self._repos_path(path)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            base_entries = repository.revision_root(base_revnum).dir_entries(
+                repos_path)
+            entries = repository.revision_root(revnum).dir_entries(repos_path)
+        finally:
+            repository.lock.release()
+        for name in sorted(base_entries):
+            if name not in entries:
+                dir_editor.delete_entry(posixpath.join(path, name),
+                                        base_revnum)
+        for name in sorted(entries):
+            if entries[name] == NODE_DIR and not recurse:
+                continue
+            self._update_node(dir_editor, base_revnum, revnum,
+                              posixpath.join(path, name), recurse, revprops)
+
+    def _update_node(self, dir_editor, base_revnum, revnum, path, recurse,
+                     revprops):
+        repos_path = self._repos_path(path)
+        repository = self._repository
+        repository.lock.acquire()
+        try:
+            base_root = repository.revision_root(base_revnum)
+            root = repository.revision_root(revnum)
+            base_kind = base_root.check_path(repos_path)
+            kind = root.check_path(repos_path)
+            if base_kind == kind and kind != NODE_NONE:
+                if (base_root.node_created_rev(repos_path) ==
+                    root.node_created_rev(repos_path)):
+                    # Not changed since the base revision
+                    return
+            if base_kind == kind == NODE_FILE:
+                base_checksum = base_root.file_checksum(repos_path,
+                    repos.CHECKSUM_MD5, True)
+                if root.file_checksum(repos_path, repos.CHECKSUM_MD5,
+                                      True) == base_checksum:
+                    # Only the properties changed
+                    base_stream = stream = None
+                else:
+                    base_stream = _LockedStream(
+                        base_root.file_content(repos_path), repository.lock,
+                        base_root)
+                    stream = _LockedStream(root.file_content(repos_path),
+                                           repository.lock, root)
+        finally:
+            repository.lock.release()
+        if base_kind != kind or kind == NODE_NONE:
+            if base_kind != NODE_NONE:
+                dir_editor.delete_entry(path, base_revnum)
+            self._send_node(dir_editor, revnum, path, recurse, revprops)
+        elif kind == NODE_DIR:
+            child_editor = dir_editor.open_directory(path, base_revnum)
+            self._update_props(child_editor, base_revnum, revnum, path,
+                               revprops)
+            self._update_entries(child_editor, base_revnum, revnum, path,
+                                 recurse, revprops)
+            child_editor.close()
+        else:
+            file_editor = dir_editor.open_file(path, base_revnum)
+            self._update_props(file_editor, base_revnum, revnum, path,
+                               revprops)
+            if stream is None:
+                file_editor.close()
+                return
+            try:
+                digest = send_stream(stream,
+                    file_editor.apply_textdelta(base_checksum),
+                    source_stream=base_stream)
+            finally:
+                stream.close()
+                base_stream.close()
+            file_editor.close(digest.encode("hex"))
+
+
+class ReposServerBackend(ServerBackend):
+    """Serve the repositories below a local directory.
+
+    Repositories are opened on first use and shared between all
+    connections, as are their revision roots.
+
+    :param root: Directory to serve, like the -r option of svnserve. It
+        can be a repository itself.
+    :param max_roots: Maximum number of revision roots to keep open per
+        repository
+    """
+
+    def __init__(self, root, max_roots=MAX_CACHED_ROOTS):
+        self.root = os.path.abspath(root)
+        self._max_roots = max_roots
+        self._repositories = {}
+        self._lock = threading.Lock()
+
+    def _find_repository(self, parts):
+        """Find the repository that contains a path.
+
+        :param parts: Components of the path relative to the served directory
+        :return: Tuple with repository and number of components in its path
+        """
+        for i in range(len(parts), -1, -1):
+            path = os.path.join(self.root, *parts[:i])
+            repository = self._repositories.get(path)
+            if repository is not None:
+                return (repository, i)
+            if _is_repository(path):
+                repository = _CachedRepository(path, self._max_roots)
+                self._repositories[path] = repository
+                return (repository, i)
+        return (None, 0)
+
+    def open_repository(self, location):
+        parts = _split_path(urllib.unquote(location))
+        self._lock.acquire()
+        try:
+            (repository, i) = self._find_repository(parts)
+        finally:
+            self._lock.release()
+        if repository is None:
+            raise SubversionException(
+                "No repository found in '%s'" % location,
+                ERR_RA_SVN_REPOS_NOT_FOUND)
+        relpath = "/".join(parts[i:])
+        return (ReposRepositoryBackend(repository, relpath), relpath)
+
+    def close(self):
+        """Close all cached repositories."""
+        self._lock.acquire()
+        try:
+            self._repositories.clear()
+        finally:
+            self._lock.release()
@@ -440,6 +440,7 @@ def test_suite():
         'marshall',
         'properties',
         'ra',
+        'ra_svn',
         'repos',
         'server',
         'wc',
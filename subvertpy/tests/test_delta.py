@@ -16,14 +16,26 @@
 """Tests for subvertpy.delta."""
 
 from cStringIO import StringIO
+import sys
 
 from subvertpy.delta import (
+    SVNDiffDecoder,
+    _py_compute_txdelta_window,
+    compute_txdelta_window,
     decode_length,
     encode_length,
     pack_svndiff0,
+    pack_svndiff0_window,
+    pack_svndiff1,
+    pack_svndiff1_section,
     send_stream,
     unpack_svndiff0,
+    unpack_svndiff1,
+    unpack_svndiff1_section,
+    unpack_svndiff_stream,
     apply_txdelta_handler,
+    apply_txdelta_handler_file,
+    txdelta_apply_ops,
     TXDELTA_NEW, TXDELTA_SOURCE, TXDELTA_TARGET,
     )
 from subvertpy.tests import TestCase
@@ -43,6 +55,55 @@ class DeltaTests(TestCase):
         self.assertEqual([(0, 0, 3, 0, [(2, 0, 3)], 'foo'), None], 
                           self.windows)
     
+    def test_send_stream_source(self):
+        source = "".join(["line %d\n" % i for i in range(1000)])
+        target = source.replace("line 500\n", "line 500 changed\n")
+        send_stream(StringIO(target), self.storing_window_handler,
+                    source_stream=StringIO(source))
+        self.assertEqual(None, self.windows[-1])
+        self.assertEqual(" changed", self.windows[0][5])
+        stream = StringIO()
+        handler = apply_txdelta_handler(source, stream)
+        for window in self.windows:
+            handler(window)
+        self.assertEqual(target, stream.getvalue())
+
+    def test_send_stream_source_svndiff_roundtrip(self):
+        source = "".join(["line %d\n" % i for i in range(1000)])
+        target = source.replace("line 100\n", "line 100 changed\n").replace(
+            "line 700\n", "line 700 changed\n")
+        send_stream(StringIO(target), self.storing_window_handler,
+                    source_stream=StringIO(source))
+        windows = self.windows[:-1]
+        self.assertTrue([op[0] for op in windows[0][4]].count(TXDELTA_NEW) > 1)
+        for pack, unpack in [(pack_svndiff0, unpack_svndiff0),
+                             (pack_svndiff1, unpack_svndiff1)]:
+            stream = StringIO()
+            handler = apply_txdelta_handler(source, stream)
+            for window in unpack(pack(windows)):
+                handler(window)
+            handler(None)
+            self.assertEqual(target, stream.getvalue())
+
+    def test_compute_window_target_copy(self):
+        window = compute_txdelta_window("", "abcd" * 100, 0, 4)
+        self.assertEqual((0, 0, 400, 0,
+            [(TXDELTA_NEW, 0, 4), (TXDELTA_TARGET, 0, 396)], "abcd"), window)
+
+    def test_compute_window_implementations_agree(self):
+        try:
+            from subvertpy._delta import compute_txdelta_window as c_compute
+        except ImportError:
+            return
+        source = "".join(["line %d\n" % i for i in range(200)])
+        for target in ["", "short", source, source[::-1],
+                       source.replace("line 50\n", "x") * 2,
+                       "ab" * 300 + source[100:900]]:
+            for match_size in (1, 4, 64):
+                self.assertEqual(
+                    _py_compute_txdelta_window(source, target, 7, match_size),
+                    c_compute(source, target, 7, match_size))
+
     def test_apply_delta(self):
         stream = StringIO()
         source = "(source)"
@@ -65,6 +126,39 @@ class DeltaTests(TestCase):
         handler(None)
         self.assertEqual(result, stream.getvalue())
 
+    def test_apply_delta_file(self):
+        source = StringIO("".join(["line %d\n" % i for i in range(10000)]))
+        target = source.getvalue().replace("line 5000\n", "")
+        send_stream(StringIO(target), self.storing_window_handler,
+                    block_size=1000, source_stream=StringIO(source.getvalue()))
+        stream = StringIO()
+        handler = apply_txdelta_handler_file(source, stream)
+        for window in self.windows:
+            handler(window)
+        self.assertEqual(target, stream.getvalue())
+
+    def test_apply_ops_run_length(self):
+        ops = [(TXDELTA_NEW, 0, 2), (TXDELTA_TARGET, 0, 1001)]
+        self.assertEqual("ab" * 501 + "a", txdelta_apply_ops(0, ops, "ab", ""))
+
+    def test_apply_ops_invalid_source_range(self):
+        self.assertRaises(Exception, txdelta_apply_ops, 0,
+            [(TXDELTA_SOURCE, 2, 5)], "", "source")
+
+    def test_apply_ops_huge_ranges(self):
+        # Offsets and lengths are read from svndiff data sent by the server
+        for op in [(TXDELTA_SOURCE, sys.maxsize, 1),
+                   (TXDELTA_SOURCE, 1, sys.maxsize),
+                   (TXDELTA_NEW, sys.maxsize, 1),
+                   (TXDELTA_NEW, 1, sys.maxsize),
+                   (TXDELTA_TARGET, sys.maxsize, 1),
+                   (TXDELTA_NEW, -1, 1)]:
+            self.assertRaises(Exception, txdelta_apply_ops, 0, [op],
+                              "abc", "xyz")
+        self.assertRaises(Exception, txdelta_apply_ops, 0,
+            [(TXDELTA_NEW, 0, 1), (TXDELTA_TARGET, 0, sys.maxsize),
+             (TXDELTA_TARGET, 0, sys.maxsize)], "abc", "xyz")
+
 
 class MarshallTests(TestCase):
 
@@ -78,3 +172,77 @@ class MarshallTests(TestCase):
     def test_roundtrip_window(self):
         mywindow = (0, 0, 3, 1, [(2, 0, 3)], 'foo')
         self.assertEqual([mywindow], list(unpack_svndiff0(pack_svndiff0([mywindow]))))
+
+    def test_roundtrip_window_svndiff1(self):
+        mywindow = (0, 0, 3, 1, [(2, 0, 3)], 'foo')
+        self.assertEqual([mywindow],
+            list(unpack_svndiff1(pack_svndiff1([mywindow]))))
+
+    def test_svndiff1_section_small(self):
+        self.assertEqual("\x03foo", pack_svndiff1_section("foo"))
+        self.assertEqual("foo", unpack_svndiff1_section("\x03foo"))
+
+    def test_svndiff1_section_compressed(self):
+        data = "a" * 1000
+        packed = pack_svndiff1_section(data)
+        self.assertTrue(len(packed) < 100)
+        self.assertEqual(data, unpack_svndiff1_section(packed))
+
+    def test_svndiff1_compresses(self):
+        data = "foo bar\n" * 10000
+        mywindow = (0, 0, len(data), 1, [(2, 0, len(data))], data)
+        packed = pack_svndiff1([mywindow])
+        self.assertTrue(len(packed) < len(data) / 10)
+        self.assertEqual([mywindow], list(unpack_svndiff_stream(
+            StringIO(packed))))
+
+
+class SVNDiffDecoderTests(TestCase):
+
+    def test_bytewise(self):
+        windows = [(0, 0, 3, 1, [(2, 0, 3)], 'foo'),
+                   (0, 3, 6, 2, [(0, 0, 3), (2, 0, 3)], 'bar')]
+        text = pack_svndiff0(windows)
+        decoder = SVNDiffDecoder()
+        ret = []
+        for c in text:
+            ret.extend(decoder.feed(c))
+        decoder.finish()
+        self.assertEqual(windows, ret)
+
+    def test_window_per_chunk(self):
+        window = (0, 0, 3, 1, [(2, 0, 3)], 'foo')
+        decoder = SVNDiffDecoder()
+        self.assertEqual([], decoder.feed("SVN\0"))
+        self.assertEqual([window], decoder.feed(pack_svndiff0_window(window)))
+        self.assertEqual([window], decoder.feed(pack_svndiff0_window(window)))
+
+    def test_stream(self):
+        windows = [(0, 0, 3, 1, [(2, 0, 3)], 'foo'),
+                   (3, 3, 100, 2, [(0, 0, 3), (1, 0, 97)], '')]
+        stream = StringIO(pack_svndiff0(windows))
+        self.assertEqual(windows, list(unpack_svndiff_stream(stream, 5)))
+
+    def test_multiple_new_ops(self):
+        window = (0, 3, 9, 3,
+                  [(TXDELTA_NEW, 0, 2), (TXDELTA_SOURCE, 0, 3),
+                   (TXDELTA_NEW, 2, 4)], "abcdef")
+        [unpacked] = list(unpack_svndiff0(pack_svndiff0([window])))
+        self.assertEqual(window[4], unpacked[4])
+        self.assertEqual("abxyzcdef",
+            txdelta_apply_ops(unpacked[3], unpacked[4], unpacked[5], "xyz"))
+
+    def test_truncated(self):
+        decoder = SVNDiffDecoder()
+        decoder.feed(pack_svndiff0([(0, 0, 3, 1, [(2, 0, 3)], 'foo')])[:-1])
+        self.assertRaises(ValueError, decoder.finish)
+
+    def test_invalid_header(self):
+        self.assertRaises(ValueError, SVNDiffDecoder().feed, "SVN\2")
+        self.assertRaises(ValueError, list,
+            unpack_svndiff1(pack_svndiff0([(0, 0, 3, 1, [(2, 0, 3)], 'foo')])))
+
+    def test_invalid_instruction(self):
+        # Instruction code 3 does not exist
+        self.assertRaises(ValueError, SVNDiffDecoder().feed,
+                          "SVN\0\0\0\1\1\0\xc1")
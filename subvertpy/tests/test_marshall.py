@@ -18,14 +18,45 @@
 
 from subvertpy.marshall import (
     MarshallError,
+    NeedMoreData,
+    _PyUnmarshaller,
+    _py_marshall,
     literal,
-    marshall,
     unmarshall,
     )
-from subvertpy.tests import TestCase
+from subvertpy.tests import (
+    SkipTest,
+    TestCase,
+    )
+
+try:
+    from subvertpy import _marshall
+except ImportError:
+    _marshall = None
+
+
+class CImplementationMixin(object):
+    """Run the tests of a test case against the C implementation."""
+
+    def setUp(self):
+        if _marshall is None:
+            raise SkipTest("subvertpy._marshall is not available")
+        super(CImplementationMixin, self).setUp()
+        self.marshall = _marshall.marshall
+        self.Unmarshaller = _marshall.Unmarshaller
+
 
 class TestMarshalling(TestCase):
 
+    marshall = staticmethod(_py_marshall)
+    Unmarshaller = _PyUnmarshaller
+
+    def unmarshall(self, x):
+        u = self.Unmarshaller()
+        u.feed(x)
+        ret = u.read_item()
+        return (u.remaining(), ret)
+
     def test_literal_txt(self):
         l = literal("foo")
         self.assertEqual("foo", l.txt)
@@ -43,53 +74,165 @@ class TestMarshalling(TestCase):
         self.assertEqual("bla bla", e.__str__())
     
     def test_marshall_int(self):
-        self.assertEqual("1 ", marshall(1))
+        self.assertEqual("1 ", self.marshall(1))
 
     def test_marshall_list(self):
-        self.assertEqual("( 1 2 3 4 ) ", marshall([1,2,3,4]))
+        self.assertEqual("( 1 2 3 4 ) ", self.marshall([1,2,3,4]))
     
     def test_marshall_list_mixed(self):
-        self.assertEqual("( 1 3 4 3:str ) ", marshall([1,3,4,"str"]))
+        self.assertEqual("( 1 3 4 3:str ) ", self.marshall([1,3,4,"str"]))
 
     def test_marshall_literal(self):
-        self.assertEqual("foo ", marshall(literal("foo")))
+        self.assertEqual("foo ", self.marshall(literal("foo")))
 
     def test_marshall_string(self):
-        self.assertEqual("3:foo ", marshall("foo"))
+        self.assertEqual("3:foo ", self.marshall("foo"))
 
     def test_marshall_raises(self):
-        self.assertRaises(MarshallError, marshall, dict())
+        self.assertRaises(MarshallError, self.marshall, dict())
 
     def test_marshall_list_nested(self):
-        self.assertEqual("( ( ( 3 ) 4 ) ) ", marshall([[[3], 4]]))
+        self.assertEqual("( ( ( 3 ) 4 ) ) ", self.marshall([[[3], 4]]))
 
     def test_marshall_string_space(self):
-        self.assertEqual("5:bla l ", marshall("bla l"))
+        self.assertEqual("5:bla l ", self.marshall("bla l"))
 
     def test_unmarshall_string(self):
-        self.assertEqual(('', "bla l"), unmarshall("5:bla l"))
+        self.assertEqual(('', "bla l"), self.unmarshall("5:bla l"))
 
     def test_unmarshall_list(self):
-        self.assertEqual(('', [4,5]), unmarshall("( 4 5 ) "))
+        self.assertEqual(('', [4,5]), self.unmarshall("( 4 5 ) "))
 
     def test_unmarshall_int(self):
-        self.assertEqual(('', 2), unmarshall("2 "))
+        self.assertEqual(('', 2), self.unmarshall("2 "))
 
     def test_unmarshall_literal(self):
-        self.assertEqual(('', literal("x")), unmarshall("x "))
+        self.assertEqual(('', literal("x")), self.unmarshall("x "))
 
     def test_unmarshall_empty(self):
-        self.assertRaises(MarshallError, unmarshall, "")
+        self.assertRaises(MarshallError, self.unmarshall, "")
 
     def test_unmarshall_nospace(self):
-        self.assertRaises(MarshallError, unmarshall, "nospace")
+        self.assertRaises(MarshallError, self.unmarshall, "nospace")
 
     def test_unmarshall_toolong(self):
-        self.assertRaises(MarshallError, unmarshall, "43432432:bla")
+        self.assertRaises(MarshallError, self.unmarshall, "43432432:bla")
 
     def test_unmarshall_literal(self):
-        self.assertRaises(MarshallError, unmarshall, ":-3213")
+        self.assertRaises(MarshallError, self.unmarshall, ":-3213")
 
     def test_unmarshall_open_list(self):
-        self.assertRaises(MarshallError, unmarshall, "( 3 4 ")
-
+        self.assertRaises(MarshallError, self.unmarshall, "( 3 4 ")
+
+    def test_unmarshall_function(self):
+        self.assertEqual(("3 ", [1, "ab"]), unmarshall("( 1 2:ab ) 3 "))
+
+
+
+class TestUnmarshaller(TestCase):
+
+    Unmarshaller = _PyUnmarshaller
+
+    def feed_bytewise(self, text):
+        u = self.Unmarshaller()
+        ret = []
+        for c in text:
+            u.feed(c)
+            while True:
+                try:
+                    ret.append(u.read_item())
+                except NeedMoreData:
+                    break
+        return ret
+
+    def test_empty(self):
+        u = self.Unmarshaller()
+        self.assertRaises(NeedMoreData, u.read_item)
+
+    def test_multiple(self):
+        u = self.Unmarshaller()
+        u.feed("( success ( 2 ) ) 3:abc 42 ")
+        self.assertEqual(["success", [2]], u.read_item())
+        self.assertEqual("abc", u.read_item())
+        self.assertEqual(42, u.read_item())
+        self.assertRaises(NeedMoreData, u.read_item)
+
+    def test_bytewise(self):
+        text = "( success ( 2 2 ( ) ( edit-pipeline svndiff1 ) ) ) 11:( foo bar ) x "
+        self.assertEqual([
+            ["success", [2, 2, [], ["edit-pipeline", "svndiff1"]]],
+            "( foo bar )", "x"], self.feed_bytewise(text))
+
+    def test_string_in_pieces(self):
+        u = self.Unmarshaller()
+        u.feed("( 10:abc")
+        self.assertRaises(NeedMoreData, u.read_item)
+        u.feed("defg")
+        self.assertRaises(NeedMoreData, u.read_item)
+        u.feed("hij ) ")
+        self.assertEqual(["abcdefghij"], u.read_item())
+
+    def test_remaining(self):
+        u = self.Unmarshaller()
+        u.feed("( 1 ) ( 2")
+        self.assertEqual([1], u.read_item())
+        self.assertEqual("( 2", u.remaining())
+
+    def test_invalid(self):
+        u = self.Unmarshaller()
+        u.feed(") ")
+        self.assertRaises(MarshallError, u.read_item)
+
+
+class CTestMarshalling(CImplementationMixin, TestMarshalling):
+    pass
+
+
+class CTestUnmarshaller(CImplementationMixin, TestUnmarshaller):
+    pass
+
+
+class ImplementationsAgreeTests(TestCase):
+    """Check that the C and Python implementations behave the same."""
+
+    def setUp(self):
+        if _marshall is None:
+            raise SkipTest("subvertpy._marshall is not available")
+        super(ImplementationsAgreeTests, self).setUp()
+
+    def read_all(self, unmarshaller_class, text, chunk_size):
+        """Feed text in chunks and parse items until an error occurs.
+
+        :return: Tuple with the items and the type of the error
+        """
+        u = unmarshaller_class()
+        items = []
+        for i in range(0, len(text), chunk_size):
+            u.feed(text[i:i+chunk_size])
+            while True:
+                try:
+                    items.append(u.read_item())
+                except NeedMoreData:
+                    break
+                except MarshallError, e:
+                    return (items, type(e))
+        return (items, None)
+
+    def test_marshall(self):
+        for item in [0, 42, -1, "", "foo bar", u"\xe9", literal("x"), True,
+                     False, [], [1, [2, ["abc", literal("y")]]], (1, 2)]:
+            self.assertEqual(_py_marshall(item), _marshall.marshall(item))
+        for item in [None, {}, 1.5, [1, None]]:
+            self.assertRaises(MarshallError, _py_marshall, item)
+            self.assertRaises(MarshallError, _marshall.marshall, item)
+
+    def test_unmarshall(self):
+        valid = ("( success ( 2 2 ( ) ( edit-pipeline svndiff1 ) ) ) "
+                 "11:( foo bar ) x 0: 123 ( ( ) ( 3:a b ) ) ")
+        invalid = [") ", "(x", "( 3x ", "abc( ", "3:abcd ", "! ",
+                   "( 1 2 )x", "12345678901234567890 "]
+        for text in [valid] + invalid + [valid + text for text in invalid]:
+            for chunk_size in [1, 2, 3, 7, len(text)]:
+                self.assertEqual(
+                    self.read_all(_PyUnmarshaller, text, chunk_size),
+                    self.read_all(_marshall.Unmarshaller, text, chunk_size))
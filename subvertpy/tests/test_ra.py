@@ -16,9 +16,12 @@
 """Subversion ra library tests."""
 
 from cStringIO import StringIO
+import gzip
+import os
+import threading
 
 from subvertpy import (
-    NODE_DIR, NODE_NONE, NODE_UNKNOWN,
+    NODE_DIR, NODE_FILE, NODE_NONE, NODE_UNKNOWN,
     SubversionException,
     ra,
     )
@@ -45,6 +48,109 @@ class TestRemoteAccessUnknown(TestCase):
         self.assertRaises(SubversionException, ra.RemoteAccess, "bla://")
 
 
+class FakeSession(object):
+
+    def __init__(self, url, root="svn://example.com/repo"):
+        self.url = url
+        self.root = root
+        self.healthy = True
+        self.closed = False
+
+    def get_repos_root(self):
+        return self.root
+
+    def reparent(self, url):
+        self.url = url
+
+    def get_latest_revnum(self):
+        if not self.healthy:
+            raise SubversionException("Connection closed", 0)
+        return 0
+
+    def close(self):
+        self.closed = True
+        if not self.healthy:
+            raise SubversionException("Connection closed", 0)
+
+
+class SessionPoolTests(TestCase):
+
+    def setUp(self):
+        super(SessionPoolTests, self).setUp()
+        self.opened = []
+        self.pool = ra.SessionPool(self.open_session, max_per_host=2)
+
+    def open_session(self, url):
+        session = FakeSession(url)
+        self.opened.append(session)
+        return session
+
+    def test_reuse_reparent(self):
+        session = self.pool.acquire("svn://example.com/repo/trunk")
+        self.pool.release(session)
+        self.assertIs(session,
+            self.pool.acquire("svn://example.com/repo/branches/foo"))
+        self.assertEqual("svn://example.com/repo/branches/foo", session.url)
+        self.assertEqual(1, len(self.opened))
+
+    def test_max_per_host(self):
+        self.pool.acquire("svn://example.com/repo")
+        self.pool.acquire("svn://example.com/repo")
+        self.assertRaises(ra.SessionPoolTimeout, self.pool.acquire,
+            "svn://example.com/repo", timeout=0)
+        other = self.pool.acquire("svn://example.org/repo")
+        self.assertEqual(3, len(self.opened))
+        self.pool.release(other)
+
+    def test_discard(self):
+        self.pool.acquire("svn://example.com/repo")
+        session = self.pool.acquire("svn://example.com/repo")
+        self.pool.release(session, discard=True)
+        self.assertIsNot(session, self.pool.acquire("svn://example.com/repo"))
+        self.assertTrue(session.closed)
+
+    def test_ttl(self):
+        self.pool.ttl = 0
+        self.pool.release(self.pool.acquire("svn://example.com/repo"))
+        self.pool.acquire("svn://example.com/repo")
+        self.assertEqual(2, len(self.opened))
+        self.assertTrue(self.opened[0].closed)
+        self.assertFalse(self.opened[1].closed)
+
+    def test_health_check(self):
+        self.pool.check_interval = 0
+        session = self.pool.acquire("svn://example.com/repo")
+        self.pool.release(session)
+        session.healthy = False
+        self.assertIsNot(session, self.pool.acquire("svn://example.com/repo"))
+        self.assertTrue(session.closed)
+
+    def test_close_without_lock(self):
+        # Closing a session can block on the network, which should not
+        # hold up other threads using the pool.
+        session = self.pool.acquire("svn://example.com/repo")
+        blocked = []
+        def close():
+            thread = threading.Thread(target=self.pool.evict_idle)
+            thread.start()
+            thread.join(5)
+            blocked.append(thread.isAlive())
+        session.close = close
+        self.pool.release(session, discard=True)
+        self.assertEqual([False], blocked)
+
+    def test_session_context_manager(self):
+        with self.pool.session("svn://example.com/repo") as session:
+            pass
+        self.assertIs(session, self.pool.acquire("svn://example.com/repo"))
+        try:
+            with self.pool.session("svn://example.com/repo") as session:
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIsNot(session, self.pool.acquire("svn://example.com/repo"))
+
+
 class TestRemoteAccess(SubversionTestCase):
 
     def setUp(self):
@@ -179,6 +285,125 @@ class TestRemoteAccess(SubversionTestCase):
             strict_node_history=False, revprops=["svn:date", "svn:author", "svn:log"]))
         check_results(returned)
 
+    def test_iter_log_small_queue(self):
+        for i in range(3):
+            dc = self.get_commit_editor(self.repos_url)
+            dc.add_dir("dir%d" % i)
+            dc.close()
+        returned = list(self.ra.iter_log(None, 0, 3, max_queue_size=1,
+            revprops=["svn:date", "svn:author", "svn:log"]))
+        self.assertEqual([0, 1, 2, 3], [entry[1] for entry in returned])
+
+    def test_iter_replay(self):
+        cb = self.commit_editor()
+        cb.add_dir("foo")
+        f = cb.add_file("foo/bar")
+        f.modify("a")
+        f.change_prop("bla:bar", "blie")
+        cb.close()
+
+        cb = self.commit_editor()
+        cb.delete("foo/bar")
+        cb.add_file("foo/bar").modify("b")
+        cb.close()
+
+        returned = list(self.ra.iter_replay(1, 2, 0, max_queue_size=1))
+        self.assertEqual([1, 2], [entry[0] for entry in returned])
+        (revnum, revprops, changes) = returned[0]
+        self.assertEqual("Test commit", revprops["svn:log"])
+        self.assertEqual(set(["foo", "foo/bar"]), set(changes.keys()))
+        self.assertEqual(('A', None, -1, NODE_DIR, {}, None), changes["foo"])
+        (action, copyfrom_path, copyfrom_rev, kind, props, delta) = changes["foo/bar"]
+        self.assertEqual(('A', NODE_FILE), (action, kind))
+        self.assertEqual("blie", props["bla:bar"])
+        self.assertEqual([], delta)
+        (revnum, revprops, changes) = returned[1]
+        self.assertEqual(['foo/bar'], changes.keys())
+        self.assertEqual('R', changes["foo/bar"][0])
+
+    def test_replay_changes(self):
+        cb = self.commit_editor()
+        cb.add_file("bar").modify("a")
+        cb.close()
+
+        cb = self.commit_editor()
+        cb.add_file("foo", "bar", 1)
+        f = cb.open_file("bar")
+        f.modify("b")
+        f.change_prop("bla:bar", "blie")
+        cb.close()
+
+        changes = self.ra.replay_changes(2, 0)
+        self.assertEqual(set(["foo", "bar"]), set(changes.keys()))
+        (action, copyfrom_path, copyfrom_rev, kind, props, delta) = changes["foo"]
+        self.assertEqual(('A', 1, NODE_FILE, {}, None),
+                         (action, copyfrom_rev, kind, props, delta))
+        self.assertTrue(copyfrom_path.endswith("bar"))
+        self.assertEqual(('M', None, -1, NODE_FILE, {"bla:bar": "blie"}, []),
+                         changes["bar"])
+
+    def test_export_editor(self):
+        cb = self.commit_editor()
+        cb.add_dir("foo")
+        cb.add_file("foo/bar").modify("bar contents")
+        f = cb.add_file("foo/script")
+        f.modify("#!/bin/sh\n")
+        f.change_prop("svn:executable", "*")
+        f = cb.add_file("foo/link")
+        f.modify("link bar")
+        f.change_prop("svn:special", "*")
+        cb.close()
+
+        cb = self.commit_editor()
+        cb.open_dir("foo").open_file("foo/bar").modify("new contents")
+        cb.delete("foo/script")
+        cb.close()
+
+        target = os.path.join(self.test_dir, "export")
+        editor = ra.ExportEditor(target)
+        reporter = self.ra.do_update(1, "", True, editor)
+        reporter.set_path("", 0, True)
+        reporter.finish()
+        self.assertEqual("bar contents",
+                         open(os.path.join(target, "foo/bar")).read())
+        self.assertTrue(os.access(os.path.join(target, "foo/script"), os.X_OK))
+        self.assertFalse(os.access(os.path.join(target, "foo/bar"), os.X_OK))
+        self.assertEqual("bar", os.readlink(os.path.join(target, "foo/link")))
+
+        self.ra.replay(2, 0, editor)
+        self.assertEqual("new contents",
+                         open(os.path.join(target, "foo/bar")).read())
+        self.assertFalse(os.path.exists(os.path.join(target, "foo/script")))
+
+    def test_export_editor_checksum_mismatch(self):
+        cb = self.commit_editor()
+        cb.add_file("bar").modify("bar contents")
+        cb.close()
+
+        cb = self.commit_editor()
+        cb.open_file("bar").modify("new contents")
+        cb.close()
+
+        target = os.path.join(self.test_dir, "export")
+        editor = ra.ExportEditor(target)
+        reporter = self.ra.do_update(1, "", True, editor)
+        reporter.set_path("", 0, True)
+        reporter.finish()
+
+        f = open(os.path.join(target, "bar"), "w")
+        try:
+            f.write("local changes")
+        finally:
+            f.close()
+
+        editor = ra.ExportEditor(target)
+        reporter = self.ra.do_update(2, "", True, editor)
+        reporter.set_path("", 1, False)
+        self.assertRaises(SubversionException, reporter.finish)
+        self.assertEqual("local changes",
+                         open(os.path.join(target, "bar")).read())
+        self.assertEqual(["bar"], os.listdir(target))
+
     def test_get_log(self):
         returned = []
         def cb(*args):
@@ -336,6 +561,58 @@ class TestRemoteAccess(SubversionTestCase):
         stream.seek(0)
         self.assertEqual("a", stream.read())
 
+    def test_get_file_buffer(self):
+        cb = self.commit_editor()
+        cb.add_file("bar").modify("contents")
+        cb.close()
+
+        buf = bytearray(10)
+        (rev, props) = self.ra.get_file("bar", buf, 1)
+        self.assertEqual(1, rev)
+        self.assertEqual("contents\0\0", str(buf))
+
+        buf = bytearray(10)
+        (rev, props, length) = self.ra.get_file_into("bar", buf, 1)
+        self.assertEqual(1, rev)
+        self.assertEqual(8, length)
+        self.assertEqual("contents\0\0", str(buf))
+        self.assertRaises(TypeError, self.ra.get_file_into, "bar",
+                          StringIO(), 1)
+
+        self.assertRaises(SubversionException, self.ra.get_file, "bar",
+                          bytearray(2), 1)
+
+    def test_get_file_fileno(self):
+        cb = self.commit_editor()
+        cb.add_file("bar").modify("contents")
+        cb.close()
+
+        f = open(os.path.join(self.test_dir, "bar"), "w+")
+        try:
+            f.write("prefix ")
+            self.ra.get_file("bar", f, 1)
+            f.seek(0)
+            self.assertEqual("prefix contents", f.read())
+        finally:
+            f.close()
+
+    def test_get_file_gzip(self):
+        cb = self.commit_editor()
+        cb.add_file("bar").modify("contents")
+        cb.close()
+
+        path = os.path.join(self.test_dir, "bar.gz")
+        f = gzip.GzipFile(path, "w")
+        try:
+            self.ra.get_file("bar", f, 1)
+        finally:
+            f.close()
+        f = gzip.GzipFile(path, "r")
+        try:
+            self.assertEqual("contents", f.read())
+        finally:
+            f.close()
+
     def test_get_locations_root(self):
         self.assertEqual({0: "/"}, self.ra.get_locations("", 0, [0]))
 
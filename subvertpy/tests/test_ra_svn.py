@@ -0,0 +1,275 @@
+# Copyright (C) 2006-2008 Jelmer Vernooij <jelmer@samba.org>
+
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for subvertpy.ra_svn."""
+
+from cStringIO import StringIO
+from hashlib import md5
+
+from subvertpy import (
+    ERR_CHECKSUM_MISMATCH,
+    ERR_RA_SVN_CONNECTION_CLOSED,
+    SubversionException,
+    )
+from subvertpy.delta import (
+    SVNDIFF0_HEADER,
+    pack_svndiff0_window,
+    )
+from subvertpy.marshall import (
+    literal,
+    marshall,
+    )
+from subvertpy.ra_svn import (
+    RECV_BUFFER_SIZE,
+    SEND_BUFFER_SIZE,
+    SVNClient,
+    SVNConnection,
+    feed_editor,
+    )
+from subvertpy.tests import TestCase
+
+
+class FakeTransport(object):
+    """In-memory transport that hands out data in fixed pieces."""
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+        self.requested = []
+        self.sent = []
+
+    def recv(self, count):
+        self.requested.append(count)
+        if not self.pieces:
+            return ""
+        return self.pieces.pop(0)
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+class SVNConnectionTests(TestCase):
+
+    def test_recv_msg_large_reads(self):
+        transport = FakeTransport(["( success ( 2 ", "2 ) ) ( 3 ) "])
+        conn = SVNConnection(transport.recv, transport.send)
+        self.assertEqual(["success", [2, 2]], conn.recv_msg())
+        self.assertEqual([RECV_BUFFER_SIZE, RECV_BUFFER_SIZE],
+                         transport.requested)
+        self.assertEqual([3], conn.recv_msg())
+        self.assertEqual(2, len(transport.requested))
+
+    def test_send_msg_buffered(self):
+        transport = FakeTransport(["( success ( ) ) "])
+        conn = SVNConnection(transport.recv, transport.send)
+        conn.send_msg([literal("get-latest-rev"), []])
+        conn.send_msg([literal("get-latest-rev"), []])
+        self.assertEqual([], transport.sent)
+        conn.recv_msg()
+        self.assertEqual(["( get-latest-rev ( ) ) ( get-latest-rev ( ) ) "],
+                         transport.sent)
+        self.assertEqual(1, conn.flushes)
+        self.assertEqual(len(transport.sent[0]), conn.bytes_sent)
+
+    def test_send_msg_threshold(self):
+        transport = FakeTransport([])
+        conn = SVNConnection(transport.recv, transport.send)
+        conn.send_msg("x" * SEND_BUFFER_SIZE)
+        self.assertEqual(1, len(transport.sent))
+        conn.flush()
+        self.assertEqual(1, conn.flushes)
+
+    def test_recv_msg_closed(self):
+        transport = FakeTransport(["( success "])
+        conn = SVNConnection(transport.recv, transport.send)
+        try:
+            conn.recv_msg()
+        except SubversionException, e:
+            self.assertEqual(ERR_RA_SVN_CONNECTION_CLOSED, e.args[1])
+        else:
+            self.fail("Expected SubversionException")
+
+
+class FakeEditorConnection(object):
+    """Connection that replays a fixed list of editor commands."""
+
+    def __init__(self, msgs):
+        self.msgs = list(msgs)
+        self.sent = []
+
+    def recv_msg(self):
+        return self.msgs.pop(0)
+
+    def send_success(self, *contents):
+        self.sent.append(("success", contents))
+
+    def _unpack(self):
+        pass
+
+
+class RecordingEditor(object):
+
+    def __init__(self, log):
+        self.log = log
+
+    def open_root(self, base_revnum=None):
+        self.log.append(("open-root", base_revnum))
+        return self
+
+    def open_file(self, path, base_revnum):
+        self.log.append(("open-file", path))
+        return self
+
+    def apply_textdelta(self, base_checksum=None):
+        return lambda window: self.log.append(("window", window))
+
+    def close(self, checksum=None):
+        self.log.append(("close", ))
+
+
+class FeedEditorTests(TestCase):
+
+    def test_textdelta_streamed(self):
+        log = []
+        window = (0, 0, 3, 1, [(2, 0, 3)], 'foo')
+        msgs = [
+            ["open-root", [[1], "d0"]],
+            ["open-file", ["foo", "d0", "f0", [1]]],
+            ["apply-textdelta", ["f0", []]],
+            ["textdelta-chunk", ["f0", SVNDIFF0_HEADER]],
+            ["textdelta-chunk", ["f0", pack_svndiff0_window(window)]],
+            ["textdelta-chunk", ["f0", pack_svndiff0_window(window)]],
+            ["textdelta-end", ["f0"]],
+            ["close-file", ["f0", []]],
+            ["close-dir", ["d0"]],
+            ["close-edit", []],
+            ]
+        conn = FakeEditorConnection(msgs)
+        feed_editor(conn, RecordingEditor(log))
+        self.assertEqual([
+            ("open-root", 1),
+            ("open-file", "foo"),
+            ("window", window),
+            ("window", window),
+            ("window", None),
+            ("close", ),
+            ("close", ),
+            ("close", ),
+            ], log)
+
+
+def make_client(msgs):
+    """Create a SVNClient that receives a fixed list of messages."""
+    transport = FakeTransport([marshall(msg) for msg in msgs])
+    client = SVNClient.__new__(SVNClient)
+    SVNConnection.__init__(client, transport.recv, transport.send)
+    client.busy = False
+    client.transport = transport
+    return client
+
+
+def success(*contents):
+    return [literal("success"), list(contents)]
+
+
+class GetFileTests(TestCase):
+
+    def get_file_msgs(self, checksum, chunks):
+        return [success([], ""),
+                success([checksum], 3, [("svn:eol-style", "native")])
+                ] + chunks + ["", success()]
+
+    def test_get_file(self):
+        client = make_client(self.get_file_msgs(
+            md5("foobar").hexdigest(), ["foo", "bar"]))
+        stream = StringIO()
+        self.assertEqual((3, {"svn:eol-style": "native"}),
+            client.get_file("trunk/foo", stream, verify_checksum=True))
+        self.assertEqual("foobar", stream.getvalue())
+
+    def test_get_file_checksum_mismatch(self):
+        client = make_client(self.get_file_msgs(
+            md5("foobar").hexdigest(), ["foo", "baz"]))
+        try:
+            client.get_file("trunk/foo", StringIO(), verify_checksum=True)
+        except SubversionException, e:
+            self.assertEqual(ERR_CHECKSUM_MISMATCH, e.args[1])
+        else:
+            self.fail("Expected SubversionException")
+
+
+class ReplayTests(TestCase):
+
+    def revision_msgs(self, revnum):
+        return [
+            [literal("revprops"), [["svn:log", "rev %d" % revnum]]],
+            [literal("open-root"), [[revnum - 1], "d0"]],
+            [literal("close-dir"), ["d0"]],
+            [literal("finish-replay"), []],
+            ]
+
+    def test_replay(self):
+        log = []
+        client = make_client([success([], "")] +
+            self.revision_msgs(1)[1:] + [success()])
+        client.replay(1, 0, RecordingEditor(log))
+        self.assertEqual([("open-root", 0), ("close", )], log)
+        # The client does not respond to finish-replay
+        self.assertEqual(1, len(client.transport.sent))
+
+    def test_replay_range(self):
+        log = []
+        def start(revnum, revprops):
+            log.append(("start", revnum, revprops["svn:log"]))
+            return RecordingEditor(log)
+        def finish(revnum, revprops, editor):
+            log.append(("finish", revnum))
+        client = make_client([success([], "")] + self.revision_msgs(1) +
+            self.revision_msgs(2) + [success()])
+        client.replay_range(1, 2, 0, (start, finish))
+        self.assertEqual([
+            ("start", 1, "rev 1"), ("open-root", 0), ("close", ),
+            ("finish", 1),
+            ("start", 2, "rev 2"), ("open-root", 1), ("close", ),
+            ("finish", 2),
+            ], log)
+        self.assertEqual(1, len(client.transport.sent))
+
+
+class CommandStatsTests(TestCase):
+
+    def test_disabled(self):
+        client = make_client([success([], ""), success(42)])
+        self.assertEqual(42, client.get_latest_revnum())
+        self.assertIs(None, client.command_stats)
+
+    def test_client_stats(self):
+        msgs = [success([], ""), success(42), success([], ""), success(43)]
+        client = make_client(msgs)
+        finished = []
+        client.enable_stats(finished.append)
+        client.get_latest_revnum()
+        client.get_latest_revnum()
+        self.assertEqual(["get-latest-rev", "get-latest-rev"],
+                         [command["command"] for command in finished])
+        self.assertEqual(2, finished[0]["messages_in"])
+        self.assertEqual(1, finished[0]["messages_out"])
+        self.assertEqual(len(marshall(msgs[0]) + marshall(msgs[1])),
+                         finished[0]["bytes_in"])
+        self.assertEqual(len("( get-latest-rev ( ) ) "),
+                         finished[0]["bytes_out"])
+        totals = client.command_stats["get-latest-rev"]
+        self.assertEqual(2, totals["count"])
+        self.assertEqual(4, totals["messages_in"])
+        self.assertTrue(totals["time"] >= totals["unmarshall_time"] >= 0)
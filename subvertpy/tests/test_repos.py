@@ -19,7 +19,7 @@ from cStringIO import StringIO
 import os
 import textwrap
 
-from subvertpy import repos, SubversionException
+from subvertpy import NODE_DIR, NODE_NONE, repos, SubversionException
 from subvertpy.tests import TestCaseInTempDir, TestCase
 
 
@@ -129,6 +129,32 @@ class TestRepository(TestCaseInTempDir):
         self.assertEqual(False, root.is_file(""))
         self.assertEqual(False, root.is_file("nonexistant"))
 
+    def test_check_path(self):
+        repos.create(os.path.join(self.test_dir, "foo"))
+        root = repos.Repository("foo").fs().revision_root(0)
+        self.assertEqual(NODE_DIR, root.check_path(""))
+        self.assertEqual(NODE_NONE, root.check_path("nonexistant"))
+
+    def test_dir_entries(self):
+        repos.create(os.path.join(self.test_dir, "foo"))
+        root = repos.Repository("foo").fs().revision_root(0)
+        self.assertEqual({}, root.dir_entries(""))
+
+    def test_node_created_rev(self):
+        repos.create(os.path.join(self.test_dir, "foo"))
+        root = repos.Repository("foo").fs().revision_root(0)
+        self.assertEqual(0, root.node_created_rev(""))
+
+    def test_copied_from(self):
+        repos.create(os.path.join(self.test_dir, "foo"))
+        root = repos.Repository("foo").fs().revision_root(0)
+        self.assertEqual(None, root.copied_from(""))
+
+    def test_node_history(self):
+        repos.create(os.path.join(self.test_dir, "foo"))
+        root = repos.Repository("foo").fs().revision_root(0)
+        self.assertEqual([("/", 0)], root.node_history(""))
+
 
 class StreamTests(TestCase):
 
@@ -15,6 +15,333 @@
 
 """Subversion server tests."""
 
-from subvertpy.ra_svn import SVNServer
-from subvertpy.tests import SubversionTestCase
+import os
+import shutil
+from cStringIO import StringIO
+import socket
+import tempfile
+import threading
 
+from subvertpy import (
+    NODE_DIR,
+    NODE_FILE,
+    NODE_NONE,
+    SubversionException,
+    )
+from subvertpy.delta import txdelta_apply_ops
+from subvertpy.marshall import Unmarshaller
+from subvertpy.ra_svn import (
+    SVNClient,
+    SVNServer,
+    ThreadPoolTCPSVNServer,
+    )
+from subvertpy.ra_svn_async import (
+    AsyncSVNClient,
+    AsyncSVNServer,
+    wait,
+    )
+from subvertpy.ra_svn_record import (
+    SENT,
+    SessionPlayer,
+    SessionRecorder,
+    )
+from subvertpy.server import (
+    ServerBackend,
+    ServerRepositoryBackend,
+    )
+from subvertpy.server_repos import ReposServerBackend
+from subvertpy.tests import (
+    SubversionTestCase,
+    TestCase,
+    )
+
+
+class ThreadPoolTCPSVNServerTests(TestCase):
+
+    def setUp(self):
+        super(ThreadPoolTCPSVNServerTests, self).setUp()
+        self.server = ThreadPoolTCPSVNServer(ServerBackend(),
+            ("127.0.0.1", 0), workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close(timeout=1)
+        self.thread.join()
+        super(ThreadPoolTCPSVNServerTests, self).tearDown()
+
+    def connect(self):
+        return socket.create_connection(self.server.server_address)
+
+    def recv_greeting(self, sock):
+        unmarshaller = Unmarshaller()
+        unmarshaller.feed(sock.recv(4096))
+        return unmarshaller.read_item()
+
+    def test_concurrent_clients(self):
+        idle = self.connect()
+        other = self.connect()
+        try:
+            self.assertEqual("success", self.recv_greeting(other)[0])
+            self.assertEqual("success", self.recv_greeting(idle)[0])
+        finally:
+            idle.close()
+            other.close()
+
+
+
+class FakeRepositoryBackend(ServerRepositoryBackend):
+
+    def get_uuid(self):
+        return "b2d6e6a8-6b1d-4b7d-9b2a-5d1a7d0f4a4e"
+
+    def get_latest_revnum(self):
+        return 42
+
+    def check_path(self, path, revnum):
+        return NODE_DIR
+
+    def log(self, send_revision, target_path, start_rev, end_rev,
+            changed_paths, strict_node, limit):
+        for revnum in range(start_rev, end_rev + 1):
+            send_revision(revnum, "jelmer", "2008-01-01T00:00:00.000000Z",
+                          "msg %d" % revnum)
+
+
+class FakeServerBackend(ServerBackend):
+
+    def open_repository(self, location):
+        return (FakeRepositoryBackend(), location)
+
+
+class AsyncSVNServerTests(TestCase):
+
+    def start_server(self, addr):
+        self.server = AsyncSVNServer(FakeServerBackend(), addr, workers=2)
+        self.thread = threading.Thread(target=self.server.serve,
+            kwargs={"poll_interval": 0.1})
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        super(AsyncSVNServerTests, self).tearDown()
+
+    def test_client(self):
+        self.start_server(("127.0.0.1", 0))
+        url = "svn://127.0.0.1:%d/repo" % self.server.server_address[1]
+        clients = [SVNClient(url) for i in range(5)]
+        for client in clients:
+            self.assertEqual(42, client.get_latest_revnum())
+        self.assertEqual("b2d6e6a8-6b1d-4b7d-9b2a-5d1a7d0f4a4e",
+                         clients[0].get_uuid())
+
+    def test_batch(self):
+        self.start_server(("127.0.0.1", 0))
+        client = SVNClient("svn://127.0.0.1:%d/repo" %
+            self.server.server_address[1])
+        sent = []
+        send_fn = client.send_fn
+        def record_send(data):
+            sent.append(data)
+            send_fn(data)
+        client.send_fn = record_send
+        self.assertEqual([42, NODE_DIR, NODE_DIR],
+            client.batch().get_latest_revnum().check_path("trunk").check_path(
+                "trunk", 3).execute())
+        self.assertEqual(1, len(sent))
+        self.assertEqual(42, client.get_latest_revnum())
+
+    def test_record_replay(self):
+        self.start_server(("127.0.0.1", 0))
+        url = "svn://127.0.0.1:%d/repo" % self.server.server_address[1]
+        f = StringIO()
+        recorder = SessionRecorder(f,
+            socket.create_connection(self.server.server_address))
+        client = SVNClient(url, transport=recorder)
+        self.assertEqual(42, client.get_latest_revnum())
+        recorder.close()
+        # Play the server side back to a new client
+        player = SessionPlayer(StringIO(f.getvalue()))
+        client = SVNClient(url, transport=player)
+        self.assertEqual(42, client.get_latest_revnum())
+        self.assertEqual(client.bytes_sent, player.bytes_sent)
+        # Play the client side back to a new server
+        player = SessionPlayer(StringIO(f.getvalue()), SENT)
+        server = SVNServer(FakeServerBackend(), player.recv, player.sendall)
+        self.assertRaises(SubversionException, server.serve)
+        self.assertEqual(server.bytes_sent, player.bytes_sent)
+
+    def test_unix_socket(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "svn.sock")
+            self.start_server(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+                unmarshaller = Unmarshaller()
+                unmarshaller.feed(sock.recv(4096))
+                self.assertEqual("success", unmarshaller.read_item()[0])
+            finally:
+                sock.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class RecordingEditor(object):
+    """Editor that records the calls made to it and its children."""
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        def record(*args):
+            self.calls.append((name, ) + args)
+            if name.startswith("open_") or name.startswith("add_"):
+                return self
+            if name == "apply_textdelta":
+                return self.calls.append
+        return record
+
+
+class ReposServerBackendTests(SubversionTestCase):
+
+    def setUp(self):
+        super(ReposServerBackendTests, self).setUp()
+        self.repos_url = self.make_repository("d")
+        dc = self.get_commit_editor(self.repos_url, message="Add trunk")
+        trunk = dc.add_dir("trunk")
+        trunk.add_file("trunk/foo").modify("foo data")
+        dc.close()
+        dc = self.get_commit_editor(self.repos_url, message="Branch")
+        branches = dc.add_dir("branches")
+        branches.add_dir("branches/b", "trunk", 1)
+        dc.close()
+        self.server = ThreadPoolTCPSVNServer(
+            ReposServerBackend(self.test_dir), ("127.0.0.1", 0), workers=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = "svn://127.0.0.1:%d/d" % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close(timeout=1)
+        self.thread.join()
+        super(ReposServerBackendTests, self).tearDown()
+
+    def test_get_latest_revnum(self):
+        client = SVNClient(self.url)
+        self.assertEqual(2, client.get_latest_revnum())
+        self.assertEqual(self.open_fs("d").get_uuid(), client.get_uuid())
+
+    def test_check_path(self):
+        client = SVNClient(self.url)
+        self.assertEqual(NODE_DIR, client.check_path("trunk"))
+        self.assertEqual(NODE_FILE, client.check_path("trunk/foo"))
+        self.assertEqual(NODE_NONE, client.check_path("branches", 1))
+
+    def test_stat(self):
+        client = SVNClient(self.url)
+        dirent = client.stat("branches/b/foo", 2)
+        self.assertEqual("file", dirent["kind"])
+        self.assertEqual(8, dirent["size"])
+        self.assertEqual(1, dirent["created-rev"])
+        self.assertEqual(None, client.stat("nonexistent", 2))
+
+    def test_log_follows_copies(self):
+        client = SVNClient(self.url)
+        entries = list(client.log(["branches/b"], 2, 0,
+                                  strict_node_history=False))
+        self.assertEqual([2, 1], [entry[1] for entry in entries])
+        self.assertEqual(("A", "/trunk", 1), entries[0][0]["/branches/b"])
+        self.assertEqual("Branch", entries[0][2]["svn:log"])
+
+    def test_log_strict_node(self):
+        client = SVNClient(self.url)
+        entries = list(client.log(["branches/b"], 0, 2,
+                                  strict_node_history=True))
+        self.assertEqual([2], [entry[1] for entry in entries])
+
+    def test_session_below_root(self):
+        client = SVNClient(self.url + "/trunk")
+        self.assertEqual(self.url, client.get_repos_root())
+        self.assertEqual(NODE_FILE, client.check_path("foo"))
+
+    def test_no_repository(self):
+        self.assertRaises(SubversionException, SVNClient,
+            "svn://127.0.0.1:%d/nonexistent" % self.server.server_address[1])
+
+    def test_update_delta(self):
+        contents = "".join(["line %d\n" % i for i in range(100)])
+        dc = self.get_commit_editor(self.repos_url)
+        dc.open_dir("trunk").open_file("trunk/foo").modify(contents)
+        dc.close()
+        dc = self.get_commit_editor(self.repos_url)
+        dc.open_dir("trunk").open_file("trunk/foo").modify(contents + "end\n")
+        dc.close()
+
+        (backend, relpath) = ReposServerBackend(self.test_dir).open_repository(
+            "/d")
+        calls = []
+        backend.update(RecordingEditor(calls), 4, "", True, 3)
+        self.assertEqual(("open_root", 3), calls[1])
+        self.assertTrue(("open_directory", "trunk", 3) in calls)
+        self.assertTrue(("open_file", "trunk/foo", 3) in calls)
+        self.assertFalse(("open_directory", "branches", 3) in calls)
+        windows = [call for call in calls
+                   if isinstance(call, tuple) and len(call) == 6]
+        self.assertEqual(1, len(windows))
+        self.assertEqual(contents + "end\n",
+            txdelta_apply_ops(windows[0][3], windows[0][4], windows[0][5],
+                              contents))
+        self.assertEqual("end\n", windows[0][5])
+
+
+class AsyncSVNClientTests(TestCase):
+
+    def setUp(self):
+        super(AsyncSVNClientTests, self).setUp()
+        self.server = AsyncSVNServer(FakeServerBackend(), ("127.0.0.1", 0),
+            workers=2)
+        self.thread = threading.Thread(target=self.server.serve,
+            kwargs={"poll_interval": 0.1})
+        self.thread.start()
+        self.url = "svn://127.0.0.1:%d/repo" % self.server.server_address[1]
+        self.map = {}
+
+    def tearDown(self):
+        for client in self.map.values():
+            client.close()
+        self.server.shutdown()
+        self.thread.join()
+        super(AsyncSVNClientTests, self).tearDown()
+
+    def test_many_clients(self):
+        clients = [AsyncSVNClient(self.url, self.map) for i in range(10)]
+        requests = [client.get_latest_revnum() for client in clients]
+        self.assertTrue(wait(requests, self.map, timeout=10))
+        self.assertEqual([42] * 10, [r.get_result() for r in requests])
+        self.assertEqual("b2d6e6a8-6b1d-4b7d-9b2a-5d1a7d0f4a4e",
+                         clients[0].get_uuid())
+
+    def test_pipelined(self):
+        client = AsyncSVNClient(self.url, self.map)
+        entries = []
+        requests = [
+            client.check_path("trunk"),
+            client.log([""], 1, 2, callback=lambda *args: entries.append(args)),
+            client.log([""], 3, 3),
+            ]
+        self.assertTrue(wait(requests, self.map, timeout=10))
+        self.assertEqual(NODE_DIR, requests[0].get_result())
+        self.assertEqual([1, 2], [entry[1] for entry in entries])
+        self.assertEqual("msg 1", entries[0][2]["svn:log"])
+        self.assertEqual([3], [entry[1] for entry in requests[2].get_result()])
+
+    def test_unknown_command(self):
+        client = AsyncSVNClient(self.url, self.map)
+        request = client.get_dir("trunk")
+        self.assertTrue(wait([request], self.map, timeout=10))
+        self.assertRaises(NotImplementedError, request.get_result)
@@ -632,6 +632,154 @@ svn_stream_t *new_py_stream(apr_pool_t *pool, PyObject *py)
 	return stream;
 }
 
+struct buffer_stream {
+	Py_buffer view;
+	/* Object providing an old-style buffer; kept alive until the
+	 * stream is gone, as such buffers can not be locked. */
+	PyObject *obj;
+	Py_ssize_t *written;
+};
+
+static svn_error_t *buffer_stream_write(void *baton, const char *data, apr_size_t *len)
+{
+	struct buffer_stream *self = (struct buffer_stream *)baton;
+
+	if (*len > self->view.len - *self->written) {
+		return svn_error_create(SVN_ERR_INCORRECT_PARAMS, NULL,
+								"Buffer is too small for the file contents");
+	}
+	memcpy((char *)self->view.buf + *self->written, data, *len);
+	*self->written += *len;
+	return NULL;
+}
+
+static apr_status_t buffer_stream_cleanup(void *baton)
+{
+	struct buffer_stream *self = (struct buffer_stream *)baton;
+	if (self->obj != NULL) {
+		Py_DECREF(self->obj);
+	} else {
+		PyBuffer_Release(&self->view);
+	}
+	return APR_SUCCESS;
+}
+
+/* Obtain a writable buffer for py. Returns false without an exception set
+ * if py does not provide one. */
+static bool get_writable_buffer(PyObject *py, struct buffer_stream *buffer)
+{
+	void *buf;
+	Py_ssize_t len;
+
+	if (PyObject_CheckBuffer(py)) {
+		if (PyObject_GetBuffer(py, &buffer->view, PyBUF_WRITABLE) == 0)
+			return true;
+	} else if (PyObject_AsWriteBuffer(py, &buf, &len) == 0) {
+		/* Old-style buffers, such as mmap, don't have a release
+		 * function, so only keep a reference to the object. */
+		PyBuffer_FillInfo(&buffer->view, NULL, buf, len, 0, PyBUF_WRITABLE);
+		Py_INCREF(py);
+		buffer->obj = py;
+		return true;
+	}
+	PyErr_Clear();
+	return false;
+}
+
+/* Check whether writes to the file descriptor of py end up in the same
+ * place as py.write() would put them. This is only the case for real
+ * file objects and unbuffered io.FileIO objects; wrappers such as
+ * gzip.GzipFile transform the data before writing it to their file
+ * descriptor. Returns -1 with an exception set on error. */
+static int is_raw_file(PyObject *py)
+{
+	PyObject *io, *fileio_type;
+	int ret;
+
+	if (PyFile_Check(py))
+		return 1;
+
+	io = PyImport_ImportModule("io");
+	if (io == NULL)
+		return -1;
+
+	fileio_type = PyObject_GetAttrString(io, "FileIO");
+	Py_DECREF(io);
+	if (fileio_type == NULL)
+		return -1;
+
+	ret = PyObject_IsInstance(py, fileio_type);
+	Py_DECREF(fileio_type);
+	return ret;
+}
+
+/* Like apr_file_from_object, but returns NULL without setting an exception
+ * if py is not a file whose descriptor can be written to directly. Other
+ * errors, such as a failing flush(), do set an exception. */
+static apr_file_t *get_output_file(PyObject *py, apr_pool_t *pool)
+{
+	PyObject *ret;
+	apr_file_t *file;
+
+	if (is_raw_file(py) != 1)
+		return NULL;
+
+	/* Data buffered by the object has to end up before what is
+	 * written to the file descriptor. */
+	ret = PyObject_CallMethod(py, "flush", "");
+	if (ret == NULL)
+		return NULL;
+	Py_DECREF(ret);
+
+	file = apr_file_from_object(py, pool);
+	if (file == NULL && (PyErr_ExceptionMatches(PyExc_TypeError) ||
+						 PyErr_ExceptionMatches(PyExc_ValueError) ||
+						 PyErr_ExceptionMatches(PyExc_IOError))) {
+		/* e.g. closed files */
+		PyErr_Clear();
+	}
+	return file;
+}
+
+/* Create a stream that writes to py. Writable buffers are filled in place
+ * and plain files are written to through their file descriptor; anything
+ * else has its write() method called.
+ *
+ * If written is not NULL, it is set to the number of bytes written so far
+ * when py is a buffer and to -1 otherwise. */
+svn_stream_t *new_py_output_stream(apr_pool_t *pool, PyObject *py, Py_ssize_t *written)
+{
+	struct buffer_stream *buffer;
+	svn_stream_t *stream;
+	apr_file_t *file;
+
+	buffer = apr_pcalloc(pool, sizeof(struct buffer_stream));
+	if (get_writable_buffer(py, buffer)) {
+		if (written == NULL)
+			written = apr_palloc(pool, sizeof(Py_ssize_t));
+		*written = 0;
+		buffer->written = written;
+		apr_pool_cleanup_register(pool, buffer, buffer_stream_cleanup,
+								  apr_pool_cleanup_null);
+		stream = svn_stream_create(buffer, pool);
+		svn_stream_set_write(stream, buffer_stream_write);
+		return stream;
+	}
+
+	if (written != NULL)
+		*written = -1;
+
+	file = get_output_file(py, pool);
+	if (file != NULL) {
+		/* The file descriptor is owned by py, so leave it open. */
+		return svn_stream_from_aprfile2(file, TRUE, pool);
+	}
+	if (PyErr_Occurred())
+		return NULL;
+
+	return new_py_stream(pool, py);
+}
+
 svn_error_t *py_cancel_check(void *cancel_baton)
 {
 	PyGILState_STATE state = PyGILState_Ensure();
@@ -83,6 +83,7 @@ PyTypeObject *PyErr_GetSubversionExceptionTypeObject(void);
 PyObject *wrap_lock(svn_lock_t *lock);
 apr_array_header_t *revnum_list_to_apr_array(apr_pool_t *pool, PyObject *l);
 svn_stream_t *new_py_stream(apr_pool_t *pool, PyObject *py);
+svn_stream_t *new_py_output_stream(apr_pool_t *pool, PyObject *py, Py_ssize_t *written);
 PyObject *PyErr_NewSubversionException(svn_error_t *error);
 apr_hash_t *config_hash_from_object(PyObject *config, apr_pool_t *pool);
 void PyErr_SetAprStatus(apr_status_t status);